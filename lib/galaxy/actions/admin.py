@@ -53,6 +53,7 @@ class AdminActions( object ):
                     gqa = self.app.model.GroupQuotaAssociation( group, quota )
                     self.sa_session.add( gqa )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             message = "Quota '%s' has been created with %d associated users and %d associated groups." % \
                       ( quota.name, len( params.in_users ), len( params.in_groups ) )
             return quota, message
@@ -101,6 +102,7 @@ class AdminActions( object ):
             quota.operation = params.operation
             self.sa_session.add( quota )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             message = "Quota '%s' is now '%s'" % ( quota.name, quota.operation + quota.display_amount )
             return message
 
@@ -117,6 +119,7 @@ class AdminActions( object ):
                     for dqa in quota.default:
                         self.sa_session.delete( dqa )
                     self.sa_session.flush()
+                    self.app.quota_agent.invalidate()
                 else:
                     message = "Quota '%s' is not a default." % quota.name
             return message
@@ -129,6 +132,7 @@ class AdminActions( object ):
             for dqa in quota.default:
                 self.sa_session.delete( dqa )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             return message
 
     def _mark_quota_deleted( self, quota, params ):
@@ -147,6 +151,7 @@ class AdminActions( object ):
             self.sa_session.add( q )
             names.append( q.name )
         self.sa_session.flush()
+        self.app.quota_agent.invalidate()
         message += ', '.join( names )
         return message
 
@@ -166,6 +171,7 @@ class AdminActions( object ):
             self.sa_session.add( q )
             names.append( q.name )
         self.sa_session.flush()
+        self.app.quota_agent.invalidate()
         message += ', '.join( names )
         return message
 
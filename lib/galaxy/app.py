@@ -36,6 +36,7 @@ class UniverseApplication( object, config.ConfiguresGalaxyMixin ):
         self.config.check()
         config.configure_logging( self.config )
         self.configure_fluent_log()
+        self.configure_query_profiler()
 
         self._configure_tool_shed_registry()
 
@@ -139,6 +140,11 @@ class UniverseApplication( object, config.ConfiguresGalaxyMixin ):
         # FIXME: These are exposed directly for backward compatibility
         self.job_queue = self.job_manager.job_queue
         self.job_stop_queue = self.job_manager.job_stop_queue
+        # Start the workflow scheduling manager (schedules invocations in
+        # the background if this process is a job handler).
+        from galaxy.workflow import scheduling_manager
+        self.workflow_scheduling_manager = scheduling_manager.WorkflowSchedulingManager( self )
+        self.workflow_scheduling_manager.start()
         self.proxy_manager = ProxyManager( self.config )
         # Initialize the external service types
         self.external_service_types = external_service_types.ExternalServiceTypesCollection( self.config.external_service_type_config_file, self.config.external_service_type_path, self )
@@ -150,6 +156,7 @@ class UniverseApplication( object, config.ConfiguresGalaxyMixin ):
         self.control_worker.start()
 
     def shutdown( self ):
+        self.workflow_scheduling_manager.shutdown()
         self.job_manager.shutdown()
         self.object_store.shutdown()
         if self.heartbeat:
@@ -171,3 +178,7 @@ class UniverseApplication( object, config.ConfiguresGalaxyMixin ):
             self.trace_logger = FluentTraceLogger( 'galaxy', self.config.fluent_host, self.config.fluent_port )
         else:
             self.trace_logger = None
+
+    def configure_query_profiler( self ):
+        from galaxy.model.orm.query_profiling import QueryProfiler
+        self.query_profiler = QueryProfiler.from_config( self.config )
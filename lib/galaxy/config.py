@@ -55,6 +55,9 @@ class Configuration( object ):
         self.database_engine_options = get_database_engine_options( kwargs )
         self.database_create_tables = string_as_bool( kwargs.get( "database_create_tables", "True" ) )
         self.database_query_profiling_proxy = string_as_bool( kwargs.get( "database_query_profiling_proxy", "False" ) )
+        self.database_query_profiling_sample_rate = float( kwargs.get( "database_query_profiling_sample_rate", "0" ) )
+        self.database_query_profiling_keep = int( kwargs.get( "database_query_profiling_keep", "100" ) )
+        self.database_query_profiling_headers = string_as_bool( kwargs.get( "database_query_profiling_headers", "False" ) )
 
         # Don't set this to true for production databases, but probably should
         # default to True for sqlite databases.
@@ -149,6 +152,8 @@ class Configuration( object ):
         self.outputs_to_working_directory = string_as_bool( kwargs.get( 'outputs_to_working_directory', False ) )
         self.output_size_limit = int( kwargs.get( 'output_size_limit', 0 ) )
         self.retry_job_output_collection = int( kwargs.get( 'retry_job_output_collection', 0 ) )
+        self.retry_job_output_collection_delay = float( kwargs.get( 'retry_job_output_collection_delay', 2 ) )
+        self.retry_job_output_collection_max_delay = float( kwargs.get( 'retry_job_output_collection_max_delay', 60 ) )
         self.job_walltime = kwargs.get( 'job_walltime', None )
         self.job_walltime_delta = None
         if self.job_walltime is not None:
@@ -183,6 +188,11 @@ class Configuration( object ):
         self.smtp_ssl = kwargs.get( 'smtp_ssl', None )
         self.track_jobs_in_database = kwargs.get( 'track_jobs_in_database', 'None' )
         self.start_job_runners = listify(kwargs.get( 'start_job_runners', '' ))
+        # Workflow scheduling
+        self.schedule_workflows_in_background = string_as_bool( kwargs.get( 'schedule_workflows_in_background', 'False' ) )
+        self.maximum_workflow_invocations_per_handler = int( kwargs.get( 'maximum_workflow_invocations_per_handler', 10 ) )
+        self.workflow_scheduling_steps_per_iteration = int( kwargs.get( 'workflow_scheduling_steps_per_iteration', 10 ) )
+        self.workflow_scheduling_sleep = int( kwargs.get( 'workflow_scheduling_sleep', 1 ) )
         self.expose_dataset_path = string_as_bool( kwargs.get( 'expose_dataset_path', 'False' ) )
         # External Service types used in sample tracking
         self.external_service_type_path = resolve_path( kwargs.get( 'external_service_type_path', 'external_service_types' ), self.root )
@@ -193,6 +203,10 @@ class Configuration( object ):
         self.enable_beta_job_managers = string_as_bool( kwargs.get( 'enable_beta_job_managers', 'False' ) )
         # Per-user Job concurrency limitations
         self.cache_user_job_count = string_as_bool( kwargs.get( 'cache_user_job_count', False ) )
+        self.tool_statistics_refresh_interval = int( kwargs.get( 'tool_statistics_refresh_interval', 600 ) )
+        self.tool_statistics_window_days = int( kwargs.get( 'tool_statistics_window_days', 30 ) )
+        self.tool_statistics_min_jobs = int( kwargs.get( 'tool_statistics_min_jobs', 5 ) )
+        self.job_count_snapshot_ttl = float( kwargs.get( 'job_count_snapshot_ttl', 5 ) )
         self.user_job_limit = int( kwargs.get( 'user_job_limit', 0 ) )
         self.registered_user_job_limit = int( kwargs.get( 'registered_user_job_limit', self.user_job_limit ) )
         self.anonymous_user_job_limit = int( kwargs.get( 'anonymous_user_job_limit', self.user_job_limit ) )
@@ -776,6 +790,7 @@ class ConfiguresGalaxyMixin:
                                    database_query_profiling_proxy=self.config.database_query_profiling_proxy,
                                    object_store=self.object_store,
                                    trace_logger=getattr(self, "trace_logger", None),
+                                   query_profiler=getattr(self, "query_profiler", None),
                                    use_pbkdf2=self.config.get_bool( 'use_pbkdf2', True ) )
 
         if combined_install_database:
@@ -20,33 +20,30 @@ leaf = Leaf()
 
 class Tree( object ):
 
-    def __init__( self, dataset_collection, collection_type_description ):
+    def __init__( self, dataset_collection, collection_type_description, flattened_elements=None ):
         self.collection_type_description = collection_type_description
+        # Built from the collection's flattened elements (identifier paths)
+        # rather than by walking each nested collection.
+        if flattened_elements is None:
+            flattened_elements = dataset_collection.flattened_elements( structure_depth( collection_type_description ) )
         children = []
-        for element in dataset_collection.elements:
-            if collection_type_description.has_subcollections():
-                child_collection = element.child_collection
-                subcollection_type_description = collection_type_description.subcollection_type_description()  # Type description of children
-                children.append( ( element.element_identifier, Tree( child_collection, collection_type_description=subcollection_type_description )  ) )
-            else:
-                children.append( ( element.element_identifier, leaf ) )
+        if collection_type_description.has_subcollections():
+            subcollection_type_description = collection_type_description.subcollection_type_description()  # Type description of children
+            for identifier, child_elements in group_by_identifier( flattened_elements ):
+                children.append( ( identifier, Tree( None, subcollection_type_description, flattened_elements=child_elements ) ) )
+        else:
+            for identifiers, element in flattened_elements:
+                children.append( ( identifiers[ 0 ], leaf ) )
 
         self.children = children
 
     def walk_collections( self, hdca_dict ):
-        return self._walk_collections( dict_map( lambda hdca: hdca.collection, hdca_dict ) )
-
-    def _walk_collections( self, collection_dict ):
-        for index, ( identifier, substructure ) in enumerate( self.children ):
-            def element( collection ):
-                return collection[ index ]
-
-            if substructure.is_leaf:
-                yield dict_map( element, collection_dict )
-            else:
-                sub_collections = dict_map( lambda collection: element( collection ).child_collection, collection_dict )
-                for element in substructure._walk_collections( sub_collections ):
-                    yield element
+        # Collections matched this structure, so their elements at its leaves
+        # line up by position.
+        depth = structure_depth( self.collection_type_description )
+        elements_dict = dict_map( lambda hdca: hdca.collection.flattened_elements( depth ), hdca_dict )
+        for index in range( len( self ) ):
+            yield dict_map( lambda elements: elements[ index ][ 1 ], elements_dict )
 
     @property
     def is_leaf( self ):
@@ -101,6 +98,26 @@ def dict_map( func, input_dict ):
     return dict( [ ( k, func(v) ) for k, v in input_dict.iteritems() ] )
 
 
+def structure_depth( collection_type_description ):
+    depth = 1
+    while collection_type_description.has_subcollections():
+        collection_type_description = collection_type_description.subcollection_type_description()
+        depth += 1
+    return depth
+
+
+def group_by_identifier( flattened_elements ):
+    """ Group flattened ( identifiers, element ) pairs by their first
+    identifier, stripping it from the pairs in each group.
+    """
+    groups = []
+    for identifiers, element in flattened_elements:
+        if not groups or groups[ -1 ][ 0 ] != identifiers[ 0 ]:
+            groups.append( ( identifiers[ 0 ], [] ) )
+        groups[ -1 ][ 1 ].append( ( identifiers[ 1: ], element ) )
+    return groups
+
+
 def get_structure( dataset_collection_instance, collection_type_description, leaf_subcollection_type=None ):
     if leaf_subcollection_type:
         collection_type_description = collection_type_description.effective_collection_type_description( leaf_subcollection_type )
@@ -11,15 +11,14 @@ def _split_dataset_collection( dataset_collection, collection_type ):
     this_collection_type = dataset_collection.collection_type
     if not this_collection_type.endswith( collection_type ) or this_collection_type == collection_type:
         raise exceptions.MessageException( "Cannot split collection in desired fashion." )
-        
+
+    # Elements holding the subcollections of the requested type.
+    depth = len( this_collection_type.split( ":" ) ) - len( collection_type.split( ":" ) )
     split_elements = []
-    for element in dataset_collection.elements:
+    for identifiers, element in dataset_collection.flattened_elements( depth ):
         child_collection = element.child_collection
-        if child_collection is None:
+        if child_collection is None or child_collection.collection_type != collection_type:
             raise exceptions.MessageException( "Cannot split collection in desired fashion." )
-        if child_collection.collection_type == collection_type:
-            split_elements.append( element )
-        else:
-            split_elements.extend( _split_dataset_collection( element.child_collection ) )
+        split_elements.append( element )
 
     return split_elements
@@ -240,7 +240,7 @@ class Bam( Binary ):
         ##$ samtools index
         ##Usage: samtools index <in.bam> [<out.index>]
         stderr_name = tempfile.NamedTemporaryFile( prefix = "bam_index_stderr" ).name
-        command = 'samtools index %s %s' % ( dataset.file_name, index_file.file_name )
+        command = 'samtools index %s %s' % ( dataset.file_name, index_file.file_name_to_overwrite )
         proc = subprocess.Popen( args=command, shell=True, stderr=open( stderr_name, 'wb' ) )
         exit_code = proc.wait()
         #Did index succeed?
@@ -242,12 +242,7 @@ class Data( object ):
             error = False
             try:
                 if (params.do_action == 'zip'):
-                    # Can't use mkstemp - the file must not exist first
-                    tmpd = tempfile.mkdtemp()
-                    util.umask_fix_perms( tmpd, trans.app.config.umask, 0777, trans.app.config.gid )
-                    tmpf = os.path.join( tmpd, 'library_download.' + params.do_action )
-                    archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED, True )
-                    archive.add = lambda x, y: archive.write( x, y.encode('CP437') )
+                    archive = util.streamball.ZipStreamBall( zipfile.ZIP_DEFLATED )
                 elif params.do_action == 'tgz':
                     archive = util.streamball.StreamBall( 'w|gz' )
                 elif params.do_action == 'tbz':
@@ -286,12 +281,11 @@ class Data( object ):
                                 continue
                 if not error:
                     if params.do_action == 'zip':
-                        archive.close()
-                        tmpfh = open( tmpf )
-                        # CANNOT clean up - unlink/rmdir was always failing because file handle retained to return - must rely on a cron job to clean up tmp
                         trans.response.set_content_type( "application/x-zip-compressed" )
                         trans.response.headers[ "Content-Disposition" ] = 'attachment; filename="%s.zip"' % outfname
-                        return tmpfh
+                        archive.wsgi_status = trans.response.wsgi_status()
+                        archive.wsgi_headeritems = trans.response.wsgi_headeritems()
+                        return archive.stream
                     else:
                         trans.response.set_content_type( "application/x-tar" )
                         outext = 'tgz'
@@ -488,7 +482,20 @@ class Data( object ):
         converter = trans.app.datatypes_registry.get_converter_by_target_type( original_dataset.ext, target_type )
 
         if converter is None:
-            raise Exception( "A converter does not exist for %s to %s." % ( original_dataset.ext, target_type ) )
+            conversion_path = trans.app.datatypes_registry.get_conversion_path( original_dataset.ext, target_type )
+            if conversion_path is None:
+                raise Exception( "A converter does not exist for %s to %s." % ( original_dataset.ext, target_type ) )
+            # Convert through the intermediate datatypes, the jobs converting
+            # each intermediate dataset wait for the previous conversion.
+            intermediate_ext = conversion_path[ 0 ][ 0 ]
+            intermediate_dataset = original_dataset.get_converted_files_by_type( intermediate_ext )
+            if not intermediate_dataset or intermediate_dataset.state in [ intermediate_dataset.states.ERROR, intermediate_dataset.states.DISCARDED ]:
+                intermediate_dataset = self.convert_dataset( trans, original_dataset, intermediate_ext, return_output=True, visible=False, set_output_history=set_output_history ).values()[0]
+                assoc = trans.app.model.ImplicitlyConvertedDatasetAssociation( parent=original_dataset, file_type=intermediate_ext, dataset=intermediate_dataset, metadata_safe=False )
+                trans.sa_session.add( intermediate_dataset )
+                trans.sa_session.add( assoc )
+                trans.sa_session.flush()
+            return intermediate_dataset.datatype.convert_dataset( trans, intermediate_dataset, target_type, return_output=return_output, visible=visible, deps=deps, set_output_history=set_output_history )
         #Generate parameter dictionary
         params = {}
         #determine input parameter name and add to params
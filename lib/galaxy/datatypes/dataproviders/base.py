@@ -264,13 +264,8 @@ class LimitedOffsetDataProvider( FilteredDataProvider ):
             if self.limit != None and self.num_data_returned >= self.limit:
                 break
 
-    #TODO: skipping lines is inefficient - somehow cache file position/line_num pair and allow provider
-    #   to seek to a pos/line and then begin providing lines
-    # the important catch here is that we need to have accurate pos/line pairs
-    #   in order to preserve the functionality of limit and offset
-    #if file_seek and len( file_seek ) == 2:
-    #    seek_pos, new_line_num = file_seek
-    #    self.seek_and_set_curr_line( seek_pos, new_line_num )
+    #NOTE: skipping data is inefficient - line.FilteredLineDataProvider uses an index of
+    #   file positions to seek close to the offset when its source is a file
 
     #def seek_and_set_curr_line( self, file_seek, new_curr_line_num ):
     #    self.seek( file_seek, os.SEEK_SET )
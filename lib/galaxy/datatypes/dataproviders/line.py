@@ -5,13 +5,12 @@ Dataproviders that iterate over lines from their sources.
 import collections
 import os
 import re
+import threading
 
 import base
+from galaxy.util.lrucache import LRUCache
 
 _TODO = """
-line offsets (skip to some place in a file) needs to work more efficiently than simply iterating till we're there
-    capture tell() when provider is done
-        def stop( self ): self.endpoint = source.tell(); raise StopIteration()
 a lot of the hierarchy here could be flattened since we're implementing pipes
 """
 
@@ -19,6 +18,63 @@ import logging
 log = logging.getLogger( __name__ )
 
 
+# ----------------------------------------------------------------------------- line offsets
+class LineOffsetIndex( object ):
+    """
+    Sparse index of the valid lines in a file: maps every `stride`th valid
+    line (as counted by a provider's filter) to the number of lines read and
+    the file position just after it.
+
+    The index is built incrementally as providers read through the file, so
+    a later request for some offset can seek to the nearest checkpoint rather
+    than reading (and discarding) every preceding line.
+    """
+    DEFAULT_STRIDE = 1000
+
+    def __init__( self, stride=DEFAULT_STRIDE ):
+        self.stride = stride
+        # checkpoints[ i ] is ( lines read, file position ) after i * stride valid lines
+        self.checkpoints = [ ( 0, 0 ) ]
+        self.lock = threading.Lock()
+
+    def nearest( self, offset ):
+        """
+        Return ( valid lines read, lines read, file position ) of the last
+        checkpoint at or before `offset` valid lines.
+        """
+        checkpoint_index = min( offset // self.stride, len( self.checkpoints ) - 1 )
+        num_read, position = self.checkpoints[ checkpoint_index ]
+        return ( checkpoint_index * self.stride, num_read, position )
+
+    def add( self, num_valid_read, num_read, position ):
+        """
+        Record a checkpoint - ignored unless it is the next one expected.
+        """
+        with self.lock:
+            if num_valid_read == len( self.checkpoints ) * self.stride:
+                self.checkpoints.append( ( num_read, position ) )
+
+
+# indeces are kept per file and per filter settings for the most recently read files
+_line_offset_indeces = LRUCache( 100 )
+# LRUCache is not thread safe
+_line_offset_indeces_lock = threading.Lock()
+
+
+def get_line_offset_index( line_file, filter_key ):
+    """
+    Return the LineOffsetIndex for `line_file` read with the filter settings
+    in `filter_key` - creating it if needed.
+    """
+    stat = os.fstat( line_file.fileno() )
+    key = ( os.path.abspath( line_file.name ), stat.st_size, stat.st_mtime, filter_key )
+    with _line_offset_indeces_lock:
+        index = _line_offset_indeces[ key ]
+        if index is None:
+            index = _line_offset_indeces[ key ] = LineOffsetIndex()
+    return index
+
+
 # ----------------------------------------------------------------------------- text
 class FilteredLineDataProvider( base.LimitedOffsetDataProvider ):
     """
@@ -83,6 +139,65 @@ class FilteredLineDataProvider( base.LimitedOffsetDataProvider ):
 
         return super( FilteredLineDataProvider, self ).filter( line )
 
+    def __iter__( self ):
+        """
+        When an offset is requested and the source is a file, seek to the
+        nearest indexed line before the offset instead of reading from the
+        start of the file.
+        """
+        line_file = self.offset and self.get_seekable_source_file()
+        filter_key = line_file and self.line_offset_index_key()
+        if not line_file or filter_key is None:
+            return super( FilteredLineDataProvider, self ).__iter__()
+        return self._iter_from_index( line_file, get_line_offset_index( line_file, filter_key ) )
+
+    def get_seekable_source_file( self ):
+        """
+        Return the file that is the (unfiltered) source of this provider
+        or None if there isn't one.
+        """
+        source = self.source
+        # e.g. a DatasetDataProvider - a plain provider of the lines of its file
+        if ( isinstance( source, base.DataProvider )
+                and type( source ).__iter__ == base.DataProvider.__iter__ ):
+            source = source.source
+        if isinstance( source, file ) and not source.closed and source.name:
+            return source
+        return None
+
+    def line_offset_index_key( self ):
+        """
+        Return a hashable description of how this provider decides which lines
+        are valid (since offset counts valid lines) or None if that can't be
+        described (and no index should be used).
+        """
+        if self.filter_fn:
+            return None
+        return ( self.strip_lines, self.strip_newlines, self.provide_blank, self.comment_char )
+
+    def _iter_from_index( self, line_file, index ):
+        if self.limit != None and self.limit <= 0:
+            return
+
+        with self:
+            self.num_valid_data_read, self.num_data_read, position = index.nearest( self.offset )
+            line_file.seek( position )
+            # readline (rather than iterating) keeps tell() accurate
+            for line in iter( line_file.readline, '' ):
+                self.num_data_read += 1
+                datum = self.filter( line )
+                if datum == None:
+                    continue
+                self.num_valid_data_read += 1
+                if self.num_valid_data_read % index.stride == 0:
+                    index.add( self.num_valid_data_read, self.num_data_read, line_file.tell() )
+
+                if self.num_valid_data_read > self.offset:
+                    self.num_data_returned += 1
+                    yield datum
+                    if self.limit != None and self.num_data_returned >= self.limit:
+                        break
+
 
 class RegexLineDataProvider( FilteredLineDataProvider ):
     """
@@ -116,6 +231,12 @@ class RegexLineDataProvider( FilteredLineDataProvider ):
         self.invert = invert
         #NOTE: no support for flags
 
+    def line_offset_index_key( self ):
+        key = super( RegexLineDataProvider, self ).line_offset_index_key()
+        if key is None:
+            return None
+        return key + ( tuple( self.regex_list ), self.invert )
+
     def filter( self, line ):
         #NOTE: filter_fn will occur BEFORE any matching
         line = super( RegexLineDataProvider, self ).filter( line )
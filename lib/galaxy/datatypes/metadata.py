@@ -4,7 +4,6 @@ Galaxy Metadata
 """
 
 import copy
-import cPickle
 import json
 import os
 import shutil
@@ -572,7 +571,11 @@ class FileParameter( MetadataParameter ):
         if isinstance( value, galaxy.model.MetadataFile ):
             value = value.id
         elif isinstance( value, MetadataTempFile ):
-            value = MetadataTempFile.to_JSON( value )
+            if value.is_unmodified_copy:
+                # set_meta() never touched the existing file, keep it as is
+                value = value.source_id
+            else:
+                value = MetadataTempFile.to_JSON( value )
         return value
 
     def new_file( self, dataset = None, **kwds ):
@@ -595,23 +598,64 @@ class MetadataTempFile( object ):
     def __init__( self, **kwds ):
         self.kwds = kwds
         self._filename = None
+        #existing MetadataFile this file starts out as a copy of - the copy is
+        #only made when the file is first needed (see file_name)
+        self.source_file_name = None
+        self.source_id = None
+
+    @classmethod
+    def copy_of( cls, metadata_file ):
+        rval = cls()
+        rval.source_file_name = metadata_file.file_name
+        rval.source_id = metadata_file.id
+        return rval
 
     @property
     def file_name( self ):
         if self._filename is None:
-            #we need to create a tmp file, accessable across all nodes/heads, save the name, and return it
-            self._filename = abspath( tempfile.NamedTemporaryFile( dir = self.tmp_dir, prefix = "metadata_temp_file_" ).name )
-            open( self._filename, 'wb+' ) #create an empty file, so it can't be reused using tempfile
+            self.__create_file()
+            if self.source_file_name:
+                shutil.copy( self.source_file_name, self._filename )
         return self._filename
 
+    @property
+    def file_name_to_overwrite( self ):
+        """
+        Path for set_meta() to write this file from scratch to - unlike
+        file_name the existing file it is a copy of is not copied first.
+        """
+        if self._filename is None:
+            self.__create_file()
+            #the existing file is replaced, not modified
+            self.source_file_name = None
+            self.source_id = None
+        return self._filename
+
+    def __create_file( self ):
+        #we need to create a tmp file, accessable across all nodes/heads, save the name
+        self._filename = abspath( tempfile.NamedTemporaryFile( dir = self.tmp_dir, prefix = "metadata_temp_file_" ).name )
+        open( self._filename, 'wb+' ) #create an empty file, so it can't be reused using tempfile
+
+    @property
+    def is_unmodified_copy( self ):
+        return self.source_id is not None and self._filename is None
+
     def to_JSON( self ):
-        return { '__class__':self.__class__.__name__, 'filename':self.file_name, 'kwds':self.kwds }
+        rval = { '__class__':self.__class__.__name__, 'kwds':self.kwds }
+        if self.source_id is not None:
+            #don't force the copy to be made
+            rval.update( filename=self._filename, source_file_name=self.source_file_name, source_id=self.source_id )
+        else:
+            rval[ 'filename' ] = self.file_name
+        return rval
 
     @classmethod
     def from_JSON( cls, json_dict ):
         #need to ensure our keywords are not unicode
         rval = cls( **stringify_dictionary_keys( json_dict['kwds'] ) )
         rval._filename = json_dict['filename']
+        rval.source_file_name = json_dict.get( 'source_file_name', None )
+        rval.source_id = json_dict.get( 'source_id', None )
         return rval
 
     @classmethod
@@ -624,17 +668,69 @@ class MetadataTempFile( object ):
             for key, value in json.load( open( filename ) ).items():
                 if cls.is_JSONified_value( value ):
                     value = cls.from_JSON( value )
-                if isinstance( value, cls ) and os.path.exists( value.file_name ):
-                    log.debug( 'Cleaning up abandoned MetadataTempFile file: %s' % value.file_name )
-                    os.unlink( value.file_name )
+                #don't use file_name, it would create (or copy) the file
+                if isinstance( value, cls ) and value._filename and os.path.exists( value._filename ):
+                    log.debug( 'Cleaning up abandoned MetadataTempFile file: %s' % value._filename )
+                    os.unlink( value._filename )
         except Exception, e:
             log.debug( 'Failed to cleanup MetadataTempFile temp files from %s: %s' % ( filename, e ) )
 
 
+EXTERNAL_DATASET_CLASSES = [ 'HistoryDatasetAssociation', 'LibraryDatasetDatasetAssociation' ]
+
+
+def dataset_to_JSON( dataset ):
+    """
+    Describe a dataset instance - just what set_meta() needs - for the
+    external set_metadata.py process, see dataset_from_JSON().
+    """
+    underlying_dataset = dataset.dataset
+    return dict( __class__=dataset.__class__.__name__,
+                 id=dataset.id,
+                 name=dataset.name,
+                 info=dataset.info,
+                 extension=dataset.extension,
+                 metadata=json.loads( dataset.metadata.to_JSON_dict() ),
+                 dataset=dict( id=underlying_dataset.id,
+                               uuid=underlying_dataset.uuid and str( underlying_dataset.uuid ),
+                               state=underlying_dataset.state,
+                               external_filename=underlying_dataset.external_filename,
+                               extra_files_path=underlying_dataset._extra_files_path,
+                               object_store_id=underlying_dataset.object_store_id,
+                               file_size=underlying_dataset.file_size and int( underlying_dataset.file_size ) ) )
+
+
+def dataset_from_JSON( json_dict ):
+    """
+    Build a transient (never flushed) dataset instance from the description
+    written by dataset_to_JSON().
+    """
+    class_name = json_dict[ '__class__' ]
+    if class_name not in EXTERNAL_DATASET_CLASSES:
+        raise ValueError( "Cannot set metadata of a %s" % class_name )
+    dataset_dict = json_dict[ 'dataset' ]
+    underlying_dataset = galaxy.model.Dataset( id=dataset_dict[ 'id' ],
+                                               state=dataset_dict[ 'state' ],
+                                               external_filename=dataset_dict[ 'external_filename' ],
+                                               extra_files_path=dataset_dict[ 'extra_files_path' ],
+                                               file_size=dataset_dict[ 'file_size' ],
+                                               uuid=dataset_dict[ 'uuid' ] )
+    underlying_dataset.object_store_id = dataset_dict[ 'object_store_id' ]
+    dataset = getattr( galaxy.model, class_name )( id=json_dict[ 'id' ],
+                                                    name=json_dict[ 'name' ],
+                                                    info=json_dict[ 'info' ],
+                                                    extension=json_dict[ 'extension' ],
+                                                    dataset=underlying_dataset )
+    #values are already in the form they are stored in, FileParameters are
+    #replaced by MetadataTempFiles from the override metadata file
+    dataset._metadata = stringify_dictionary_keys( json_dict[ 'metadata' ] )
+    return dataset
+
+
 #Class with methods allowing set_meta() to be called externally to the Galaxy head
 class JobExternalOutputMetadataWrapper( object ):
     #this class allows access to external metadata filenames for all outputs associated with a job
-    #We will use JSON as the medium of exchange of information, except for the DatasetInstance object which will use pickle (in the future this could be JSONified as well)
+    #We will use JSON as the medium of exchange of information, the DatasetInstance objects are described by dataset_to_JSON()
 
     def __init__( self, job ):
         self.job_id = job.id
@@ -656,7 +752,7 @@ class JobExternalOutputMetadataWrapper( object ):
         return "%s_%d" % ( dataset.__class__.__name__, dataset.id )
 
     def setup_external_metadata( self, datasets, sa_session, exec_dir=None, tmp_dir=None, dataset_files_path=None,
-                                 output_fnames=None, config_root=None, config_file=None, datatypes_config=None, job_metadata=None, compute_tmp_dir=None, kwds=None ):
+                                 output_fnames=None, config_root=None, config_file=None, datatypes_config=None, job_metadata=None, compute_tmp_dir=None, kwds=None, parallel=False ):
         kwds = kwds or {}
         if tmp_dir is None:
             tmp_dir = MetadataTempFile.tmp_dir
@@ -716,15 +812,7 @@ class JobExternalOutputMetadataWrapper( object ):
 
                 #file to store existing dataset
                 metadata_files.filename_in = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_in_%s_" % key ).name )
-
-                #FIXME: HACK
-                #sqlalchemy introduced 'expire_on_commit' flag for sessionmaker at version 0.5x
-                #This may be causing the dataset attribute of the dataset_association object to no-longer be loaded into memory when needed for pickling.
-                #For now, we'll simply 'touch' dataset_association.dataset to force it back into memory.
-                dataset.dataset #force dataset_association.dataset to be loaded before pickling
-                #A better fix could be setting 'expire_on_commit=False' on the session, or modifying where commits occur, or ?
-
-                cPickle.dump( dataset, open( metadata_files.filename_in, 'wb+' ) )
+                json.dump( dataset_to_JSON( dataset ), open( metadata_files.filename_in, 'wb+' ) )
                 #file to store metadata results of set_meta()
                 metadata_files.filename_out = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_out_%s_" % key ).name )
                 open( metadata_files.filename_out, 'wb+' ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
@@ -735,14 +823,14 @@ class JobExternalOutputMetadataWrapper( object ):
                 #file to store kwds passed to set_meta()
                 metadata_files.filename_kwds = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_kwds_%s_" % key ).name )
                 json.dump( kwds, open( metadata_files.filename_kwds, 'wb+' ), ensure_ascii=True )
-                #existing metadata file parameters need to be overridden with cluster-writable file locations
+                #existing metadata file parameters need to be overridden with cluster-writable file locations,
+                #the existing files are only copied if and when set_meta() uses them
                 metadata_files.filename_override_metadata = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_override_%s_" % key ).name )
                 open( metadata_files.filename_override_metadata, 'wb+' ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
                 override_metadata = []
                 for meta_key, spec_value in dataset.metadata.spec.iteritems():
                     if isinstance( spec_value.param, FileParameter ) and dataset.metadata.get( meta_key, None ) is not None:
-                        metadata_temp = MetadataTempFile()
-                        shutil.copy( dataset.metadata.get( meta_key, None ).file_name, metadata_temp.file_name )
+                        metadata_temp = MetadataTempFile.copy_of( dataset.metadata.get( meta_key, None ) )
                         override_metadata.append( ( meta_key, metadata_temp.to_JSON() ) )
                 json.dump( override_metadata, open( metadata_files.filename_override_metadata, 'wb+' ) )
                 #add to session and flush
@@ -750,7 +838,11 @@ class JobExternalOutputMetadataWrapper( object ):
                 sa_session.flush()
             metadata_files_list.append( metadata_files )
         #return command required to build
-        return "%s %s %s %s %s %s %s %s" % ( os.path.join( exec_dir, 'set_metadata.sh' ), dataset_files_path, compute_tmp_dir or tmp_dir, config_root, config_file, datatypes_config, job_metadata, " ".join( map( __metadata_files_list_to_cmd_line, metadata_files_list ) ) )
+        set_metadata_script = os.path.join( exec_dir, 'set_metadata.sh' )
+        if parallel:
+            #spread the outputs over a pool of $GALAXY_SLOTS processes
+            set_metadata_script = "%s --parallel" % set_metadata_script
+        return "%s %s %s %s %s %s %s %s" % ( set_metadata_script, dataset_files_path, compute_tmp_dir or tmp_dir, config_root, config_file, datatypes_config, job_metadata, " ".join( map( __metadata_files_list_to_cmd_line, metadata_files_list ) ) )
 
     def external_metadata_set_successfully( self, dataset, sa_session ):
         metadata_files = self.get_output_filenames_by_dataset( dataset, sa_session )
@@ -7,6 +7,7 @@ import tempfile
 import threading
 import logging
 import imp
+from collections import deque
 import data
 import tabular
 import interval
@@ -31,6 +32,9 @@ from display_applications.application import DisplayApplication
 class ConfigurationError( Exception ):
     pass
 
+# Longest chain of converters run to implicitly convert a dataset.
+MAX_CONVERSION_STEPS = 3
+
 
 class Registry( object ):
 
@@ -45,6 +49,11 @@ class Registry( object ):
         # Converters defined in datatypes_conf.xml included in installed tool shed repositories.
         self.proprietary_converters = []
         self.converter_deps = {}
+        # Converters and conversion paths by source extension, computed from
+        # datatype_converters as needed and reset when datatypes or converters
+        # are (un)loaded.
+        self.converters_by_source = {}
+        self.conversion_paths_by_source = {}
         self.available_tracks = []
         self.set_external_metadata_tool = None
         self.sniff_order = []
@@ -296,6 +305,7 @@ class Registry( object ):
             # set_metadata processing.
             self.to_xml_file()
         self.set_default_values()
+        self.reset_converter_graph()
 
         def append_to_sniff_order():
             # Just in case any supported data types are not included in the config's sniff_order section.
@@ -549,6 +559,11 @@ class Registry( object ):
                     self.log.exception( "Error deactivating converter from (%s): %s" % ( converter_path, str( e ) ) )
                 else:
                     self.log.exception( "Error loading converter (%s): %s" % ( converter_path, str( e ) ) )
+        self.reset_converter_graph()
+
+    def reset_converter_graph( self ):
+        self.converters_by_source = {}
+        self.conversion_paths_by_source = {}
 
     def load_display_applications( self, installed_repository_dict=None, deactivate=False ):
         """
@@ -754,7 +769,15 @@ class Registry( object ):
             ]
 
     def get_converters_by_datatype( self, ext ):
-        """Returns available converters by source type"""
+        """
+        Returns available converters by source type - the returned odict is
+        shared and must not be modified.
+        """
+        if ext not in self.converters_by_source:
+            self.converters_by_source[ ext ] = self.__find_converters( ext )
+        return self.converters_by_source[ ext ]
+
+    def __find_converters( self, ext ):
         converters = odict()
         source_datatype = type( self.get_datatype_by_extension( ext ) )
         for ext2, dict in self.datatype_converters.items():
@@ -773,9 +796,51 @@ class Registry( object ):
             return converters[ target_ext ]
         return None
 
+    def get_conversion_paths( self, ext ):
+        """
+        Returns an odict mapping each extension datasets of type ext can be converted to,
+        directly or through intermediate datatypes, to the shortest list of
+        ( target_ext, converter ) conversion steps - ordered by the number of steps and
+        starting with the converters returned by get_converters_by_datatype.
+        """
+        if ext not in self.conversion_paths_by_source:
+            self.conversion_paths_by_source[ ext ] = self.__find_conversion_paths( ext )
+        return self.conversion_paths_by_source[ ext ]
+
+    def get_conversion_path( self, source_ext, target_ext ):
+        """Returns the list of ( target_ext, converter ) steps converting source_ext to target_ext or None"""
+        return self.get_conversion_paths( source_ext ).get( target_ext, None )
+
+    def __find_conversion_paths( self, ext ):
+        # Dependencies are only resolved for single conversions (see
+        # DatasetInstance.get_converted_dataset) so converters with
+        # dependencies are not chained.
+        converters_with_deps = []
+        for source_ext, targets in self.converter_deps.items():
+            for target_ext in targets:
+                converter = self.datatype_converters.get( source_ext, {} ).get( target_ext, None )
+                if converter is not None:
+                    converters_with_deps.append( converter )
+        paths = odict()
+        # Breadth first so the first path found to an extension is the shortest.
+        to_visit = deque( [ ( ext, [] ) ] )
+        while to_visit:
+            source_ext, path = to_visit.popleft()
+            if path and path[ -1 ][ 1 ] in converters_with_deps:
+                continue
+            for target_ext, converter in self.get_converters_by_datatype( source_ext ).items():
+                if target_ext == ext or target_ext in paths:
+                    continue
+                if path and converter in converters_with_deps:
+                    continue
+                paths[ target_ext ] = path + [ ( target_ext, converter ) ]
+                if len( paths[ target_ext ] ) < MAX_CONVERSION_STEPS:
+                    to_visit.append( ( target_ext, paths[ target_ext ] ) )
+        return paths
+
     def find_conversion_destination_for_dataset_by_extensions( self, dataset, accepted_formats, converter_safe=True ):
         """Returns ( target_ext, existing converted dataset )"""
-        for convert_ext in self.get_converters_by_datatype( dataset.ext ):
+        for convert_ext in self.get_conversion_paths( dataset.ext ):
             if self.get_datatype_by_extension( convert_ext ).matches_any( accepted_formats ):
                 converted_dataset = dataset.get_converted_files_by_type( convert_ext )
                 if converted_dataset:
@@ -3,12 +3,12 @@ Sequence classes
 """
 
 from . import data
-import gzip
 import json
 import logging
 import os
 import re
 import string
+import zlib
 
 from cgi import escape
 
@@ -17,6 +17,7 @@ from galaxy.datatypes import metadata
 from galaxy.datatypes.checkers import is_gzip
 from galaxy.datatypes.sniff import get_test_fname, get_headers
 from galaxy.datatypes.metadata import MetadataElement
+from galaxy.util.bunch import Bunch
 
 
 try:
@@ -28,6 +29,178 @@ except:
 
 log = logging.getLogger(__name__)
 
+# Size of the (uncompressed) blocks sequence files are counted in.
+SEQUENCE_COUNT_BLOCK_SIZE = 2 ** 20
+# Number of sequences (at least) in each section of a FASTQ offset index.
+SEQUENCES_PER_INDEX_SECTION = 100000
+
+
+def _iter_sequence_file_blocks( file_name, compressed, block_size=SEQUENCE_COUNT_BLOCK_SIZE ):
+    """
+    Yield the contents of `file_name` as ( data, member_end ) tuples - if
+    `compressed` the (concatenated gzip) file is decompressed and member_end
+    is the offset in the file at which a gzip member ended after data (None
+    otherwise).
+    """
+    fh = open( file_name, 'rb' )
+    try:
+        if not compressed:
+            while True:
+                data = fh.read( block_size )
+                if not data:
+                    break
+                yield data, None
+            return
+        offset = 0
+        decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+        while True:
+            compressed_data = fh.read( block_size )
+            if not compressed_data:
+                break
+            while compressed_data:
+                data = decompressor.decompress( compressed_data )
+                unused_data = decompressor.unused_data
+                offset += len( compressed_data ) - len( unused_data )
+                if not unused_data:
+                    yield data, None
+                    break
+                # The member ended within this block, continue with the next.
+                yield data + decompressor.flush(), offset
+                if not unused_data.strip( '\0' ):
+                    # Trailing padding
+                    offset += len( unused_data )
+                    break
+                decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+                compressed_data = unused_data
+        data = decompressor.flush()
+        yield data, offset
+    finally:
+        fh.close()
+
+
+def _nth_newline( data, n ):
+    """
+    Return the offset in `data` of its `n`th newline (counting from 1).
+    """
+    index = -1
+    for i in xrange( n ):
+        index = data.index( '\n', index + 1 )
+    return index
+
+
+def count_sequences( file_name, record_marker='>', lines_per_record=None, build_index=False, index_section_size=SEQUENCES_PER_INDEX_SECTION ):
+    """
+    Count the data lines and sequences of a (possibly gzip compressed)
+    sequence file in a single pass. The file is read in large blocks and
+    newlines and record markers are counted over whole blocks rather than
+    line by line.
+
+    Sequences are either counted as lines starting with `record_marker` (and
+    lines starting with ``#`` anywhere in the file are comments) or, if
+    `lines_per_record` is set, as fixed size blocks of lines (and only
+    leading lines starting with ``#`` are comments - e.g. FASTQ quality lines
+    may start with ``#``). Leading whitespace is not stripped before checking
+    for markers.
+
+    If `build_index` (only supported with `lines_per_record`), also builds an
+    FQTOC style index - a list of { start, end, sequences } sections
+    containing (at least) `index_section_size` whole records each, offsets
+    are into the file as stored (for compressed files, sections are made up
+    of whole gzip members). The index is None if it can't be built - e.g.
+    a compressed file's members don't end on record boundaries.
+
+    Returns a Bunch with `data_lines`, `sequences` and `sections`.
+    """
+    compressed = is_gzip( file_name )
+    newlines = 0
+    comments = 0
+    records = 0
+    last_char = '\n'
+    # Uncompressed offset of the current block.
+    position = 0
+    # Leading comments are skipped when counting blocks of lines.
+    in_leading_comments = lines_per_record is not None
+    in_comment = False
+    data_start = 0
+    # Index state - offsets at which new sections start (in uncompressed
+    # files) or the members making up the current section (in compressed
+    # files).
+    build_index = build_index and lines_per_record is not None
+    index_valid = build_index
+    section_lines = lines_per_record and lines_per_record * index_section_size
+    section_starts = []
+    sections = []
+    section_start = 0
+    section_start_newlines = 0
+    member_end = None
+    for data, member_end in _iter_sequence_file_blocks( file_name, compressed ):
+        offset = 0
+        while in_leading_comments and offset < len( data ):
+            if in_comment:
+                offset = data.find( '\n', offset ) + 1 or len( data )
+                in_comment = data[ offset - 1 ] != '\n'
+            elif data[ offset ] == '#':
+                comments += 1
+                in_comment = True
+            else:
+                in_leading_comments = False
+                data_start = section_start = position + offset
+                section_start_newlines = comments
+                if compressed and comments:
+                    index_valid = False
+        block_newlines = data.count( '\n' )
+        if lines_per_record is None:
+            records += data.count( '\n' + record_marker )
+            comments += data.count( '\n#' )
+            if last_char == '\n' and data:
+                records += data.startswith( record_marker )
+                comments += data.startswith( '#' )
+        elif index_valid and not compressed:
+            # Sections start on the first line of every section_lines data
+            # lines.
+            next_section_newlines = section_start_newlines + section_lines * ( len( section_starts ) + 1 )
+            while next_section_newlines <= newlines + block_newlines:
+                offset = position + _nth_newline( data, next_section_newlines - newlines ) + 1
+                section_starts.append( offset )
+                next_section_newlines += section_lines
+        newlines += block_newlines
+        position += len( data )
+        if data:
+            last_char = data[ -1 ]
+        if member_end is not None and index_valid and compressed:
+            member_lines = newlines - section_start_newlines
+            if position and ( last_char != '\n' or member_lines % lines_per_record ):
+                # Member doesn't end on a record boundary
+                index_valid = False
+            elif member_lines >= section_lines:
+                sections.append( dict( start=section_start, end=member_end, sequences=member_lines / lines_per_record ) )
+                section_start = member_end
+                section_start_newlines = newlines
+    lines = newlines
+    if last_char != '\n':
+        lines += 1
+    data_lines = lines - comments
+    if lines_per_record is not None:
+        sequences = data_lines / lines_per_record
+    else:
+        sequences = records
+    if build_index and index_valid and data_lines % lines_per_record == 0:
+        if compressed:
+            # Remaining members form the final section.
+            if member_end is not None and member_end > section_start:
+                sections.append( dict( start=section_start, end=member_end, sequences=( newlines - section_start_newlines ) / lines_per_record ) )
+        else:
+            starts = [ data_start ] + [ start for start in section_starts if start < position ]
+            ends = starts[ 1: ] + [ position ]
+            for start, end in zip( starts, ends ):
+                sections.append( dict( start=start, end=end, sequences=index_section_size ) )
+            if sections:
+                sections[ -1 ][ 'sequences' ] = sequences - index_section_size * ( len( sections ) - 1 )
+    else:
+        sections = None
+    return Bunch( data_lines=data_lines, sequences=sequences, sections=sections )
+
+
 class SequenceSplitLocations( data.Text ):
     """
     Class storing information about a sequence file composed of multiple gzip files concatenated as
@@ -81,20 +254,10 @@ class Sequence( data.Text ):
         """
         Set the number of sequences and the number of data lines in dataset.
         """
-        data_lines = 0
-        sequences = 0
-        for line in file( dataset.file_name ):
-            line = line.strip()
-            if line and line.startswith( '#' ):
-                # We don't count comment lines for sequence data types
-                continue
-            if line and line.startswith( '>' ):
-                sequences += 1
-                data_lines +=1
-            else:
-                data_lines += 1
-        dataset.metadata.data_lines = data_lines
-        dataset.metadata.sequences = sequences
+        # We don't count comment lines for sequence data types
+        counts = count_sequences( dataset.file_name, record_marker='>' )
+        dataset.metadata.data_lines = counts.data_lines
+        dataset.metadata.sequences = counts.sequences
     def set_peek( self, dataset, is_multi_byte=False ):
         if not dataset.dataset.purged:
             dataset.peek = data.get_file_peek( dataset.file_name, is_multi_byte=is_multi_byte )
@@ -128,27 +291,10 @@ class Sequence( data.Text ):
 
     def do_slow_split( cls, input_datasets, subdir_generator_function, split_params):
         # count the sequences so we can split
-        # TODO: if metadata is present, take the number of lines / 4
         if input_datasets[0].metadata is not None and input_datasets[0].metadata.sequences is not None:
             total_sequences = input_datasets[0].metadata.sequences
         else:
-            input_file = input_datasets[0].file_name
-            compress = is_gzip(input_file)
-            if compress:
-                # gzip is really slow before python 2.7!
-                in_file = gzip.GzipFile(input_file, 'r')
-            else:
-                # TODO
-                # if a file is not compressed, seek locations can be calculated and stored
-                # ideally, this would be done in metadata
-                # TODO
-                # Add BufferedReader if python 2.7?
-                in_file = open(input_file, 'rt')
-            total_sequences = long(0)
-            for i, line in enumerate(in_file):
-                total_sequences += 1
-            in_file.close()
-            total_sequences /= 4
+            total_sequences = count_sequences( input_datasets[0].file_name, lines_per_record=4 ).sequences
 
         sequences_per_file = cls.get_sequences_per_file(total_sequences, split_params)
         return cls.write_split_files(input_datasets, None, subdir_generator_function, sequences_per_file)
@@ -197,6 +343,87 @@ class Sequence( data.Text ):
         return directories
     write_split_files = classmethod(write_split_files)
 
+    def get_split_commands_with_toc(input_name, output_name, toc_file, start_sequence, sequence_count):
+        """
+        Uses a Table of Contents dict, parsed from an FQTOC file, to come up with a set of
+        shell commands that will extract the parts necessary. Runs of whole sections are
+        copied as is, only partial sections are decompressed and trimmed.
+
+        >>> three_sections = [dict(start=0, end=74, sequences=10), dict(start=74, end=148, sequences=10), dict(start=148, end=148+76, sequences=10)]
+        >>> Sequence.get_split_commands_with_toc('./input.fastq', './output.fastq', dict(sections=three_sections), start_sequence=0, sequence_count=20)
+        ['tail -c +1 "./input.fastq" 2> /dev/null | head -c 148 >> "./output.fastq"']
+        >>> Sequence.get_split_commands_with_toc('./input.fastq', './output.fastq', dict(sections=three_sections), start_sequence=15, sequence_count=10)
+        ['tail -c +75 "./input.fastq" 2> /dev/null | head -c 74 | ( tail -n +21 2> /dev/null ) | head -20 >> "./output.fastq"', 'tail -c +149 "./input.fastq" 2> /dev/null | head -c 76 | ( tail -n +1 2> /dev/null ) | head -20 >> "./output.fastq"']
+        """
+        sections = toc_file['sections']
+        compressed = is_gzip(input_name)
+        result = []
+
+        current_sequence = long(0)
+        i = 0
+        # skip to the section that contains my starting sequence
+        while i < len(sections) and start_sequence >= current_sequence + long(sections[i]['sequences']):
+            current_sequence += long(sections[i]['sequences'])
+            i += 1
+        if i == len(sections):  # bad input or bad math
+            raise Exception("No FQTOC section contains starting sequence %s" % start_sequence)
+
+        copy_cmd = 'tail -c +%s "%s" 2> /dev/null | head -c %s >> "%s"'
+        if compressed:
+            extract_cmd = 'tail -c +%s "%s" 2> /dev/null | head -c %s | zcat | ( tail -n +%s 2> /dev/null ) | head -%s | gzip -c >> "%s"'
+        else:
+            extract_cmd = 'tail -c +%s "%s" 2> /dev/null | head -c %s | ( tail -n +%s 2> /dev/null ) | head -%s >> "%s"'
+        # These two variables act as an accumulator for consecutive entire
+        # sections that can be copied verbatim (without decompressing)
+        start_chunk = long(-1)
+        end_chunk = long(-1)
+        while sequence_count > 0 and i < len(sections):
+            sequences = long(sections[i]['sequences'])
+            skip_sequences = start_sequence - current_sequence
+            sequences_to_extract = min(sequence_count, sequences - skip_sequences)
+            start_copy = long(sections[i]['start'])
+            end_copy = long(sections[i]['end'])
+            if sequences_to_extract < sequences:
+                if start_chunk > -1:
+                    result.append(copy_cmd % (start_chunk + 1, input_name, end_chunk - start_chunk, output_name))
+                    start_chunk = -1
+                result.append(extract_cmd % (start_copy + 1, input_name, end_copy - start_copy, skip_sequences * 4 + 1, sequences_to_extract * 4, output_name))
+            else:
+                if start_chunk == -1:
+                    start_chunk = start_copy
+                end_chunk = end_copy
+            sequence_count -= sequences_to_extract
+            start_sequence += sequences_to_extract
+            current_sequence += sequences
+            i += 1
+        if start_chunk > -1:
+            result.append(copy_cmd % (start_chunk + 1, input_name, end_chunk - start_chunk, output_name))
+
+        if sequence_count > 0:
+            raise Exception("%s sequences not found in file" % sequence_count)
+
+        return result
+    get_split_commands_with_toc = staticmethod(get_split_commands_with_toc)
+
+    def get_split_commands_sequential(is_compressed, input_name, output_name, start_sequence, sequence_count):
+        """
+        Does a sequential scan & extract of certain sequences
+
+        >>> Sequence.get_split_commands_sequential(True, './input.gz', './output.gz', start_sequence=0, sequence_count=10)
+        ['zcat "./input.gz" | ( tail -n +1 2> /dev/null ) | head -40 | gzip -c > "./output.gz"']
+        >>> Sequence.get_split_commands_sequential(False, './input.fastq', './output.fastq', start_sequence=10, sequence_count=10)
+        ['tail -n +41 "./input.fastq" 2> /dev/null | head -40 > "./output.fastq"']
+        """
+        start_line = start_sequence * 4
+        line_count = sequence_count * 4
+        if is_compressed:
+            cmd = 'zcat "%s" | ( tail -n +%s 2> /dev/null ) | head -%s | gzip -c' % (input_name, start_line + 1, line_count)
+        else:
+            cmd = 'tail -n +%s "%s" 2> /dev/null | head -%s' % (start_line + 1, input_name, line_count)
+        cmd += ' > "%s"' % output_name
+        return [cmd]
+    get_split_commands_sequential = staticmethod(get_split_commands_sequential)
+
     def split( cls, input_datasets, subdir_generator_function, split_params):
         """Split a generic sequence file (not sensible or possible, see subclasses)."""
         if split_params is None:
@@ -444,49 +671,36 @@ class csFasta( Sequence ):
             pass
         return False
 
-    def set_meta( self, dataset, **kwd ):
-        if self.max_optional_metadata_filesize >= 0 and dataset.get_size() > self.max_optional_metadata_filesize:
-            dataset.metadata.data_lines = None
-            dataset.metadata.sequences = None
-            return
-        return Sequence.set_meta( self, dataset, **kwd )
-
 
 class Fastq ( Sequence ):
     """Class representing a generic FASTQ sequence"""
     file_ext = "fastq"
 
+    MetadataElement( name="sequence_index", desc="Sequence offset index (FQTOC)", param=metadata.FileParameter, file_ext="fqtoc", readonly=True, no_value=None, visible=False, optional=True )
+
     def set_meta( self, dataset, **kwd ):
         """
         Set the number of sequences and the number of data lines
-        in dataset.
+        in dataset and index the offsets of its sequences for splitting.
         FIXME: This does not properly handle line wrapping
         """
-        if self.max_optional_metadata_filesize >= 0 and dataset.get_size() > self.max_optional_metadata_filesize:
-            dataset.metadata.data_lines = None
-            dataset.metadata.sequences = None
-            return
-        data_lines = 0
-        sequences = 0
-        seq_counter = 0     # blocks should be 4 lines long
-        for line in file( dataset.file_name ):
-            line = line.strip()
-            if line and line.startswith( '#' ) and not data_lines:
-                # We don't count comment lines for sequence data types
-                continue
-            seq_counter += 1
-            data_lines += 1
-            if line and line.startswith( '@' ):
-                if seq_counter >= 4:
-                    # count previous block
-                    # blocks should be 4 lines long
-                    sequences += 1
-                    seq_counter = 1
-        if seq_counter >= 4:
-            # count final block
-            sequences += 1
-        dataset.metadata.data_lines = data_lines
-        dataset.metadata.sequences = sequences
+        # Counted regardless of max_optional_metadata_filesize - a single
+        # pass over the file in blocks, and large files are the ones that
+        # need the index to be split quickly.
+        # blocks should be 4 lines long, we don't count leading comment lines
+        counts = count_sequences( dataset.file_name, lines_per_record=4, build_index=True )
+        dataset.metadata.data_lines = counts.data_lines
+        dataset.metadata.sequences = counts.sequences
+        if counts.sections is not None:
+            index_file = dataset.metadata.sequence_index
+            if not index_file:
+                index_file = dataset.metadata.spec['sequence_index'].param.new_file( dataset=dataset )
+            out = open( index_file.file_name_to_overwrite, 'wb' )
+            json.dump( dict( sections=counts.sections ), out )
+            out.close()
+            dataset.metadata.sequence_index = index_file
+        else:
+            dataset.metadata.sequence_index = None
     def sniff ( self, filename ):
         """
         Determines whether the file is in generic fastq format
@@ -532,6 +746,9 @@ class Fastq ( Sequence ):
                 fqtoc_file = tmp_ds.get_converted_files_by_type('fqtoc')
                 tmp_ds = tmp_ds.copied_from_library_dataset_dataset_association
 
+            if fqtoc_file is None:
+                # the offset index built when setting metadata
+                fqtoc_file = ds.metadata.sequence_index or None
             if fqtoc_file is not None:
                 toc_file_datasets.append(fqtoc_file)
 
@@ -608,7 +825,7 @@ class Maf( Alignment ):
         chrom_file = dataset.metadata.species_chromosomes
         if not chrom_file:
             chrom_file = dataset.metadata.spec['species_chromosomes'].param.new_file( dataset = dataset )
-        chrom_out = open( chrom_file.file_name, 'wb' )
+        chrom_out = open( chrom_file.file_name_to_overwrite, 'wb' )
         for spec, chroms in species_chromosomes.items():
             chrom_out.write( "%s\t%s\n" % ( spec, "\t".join( chroms ) ) )
         chrom_out.close()
@@ -617,7 +834,7 @@ class Maf( Alignment ):
         index_file = dataset.metadata.maf_index
         if not index_file:
             index_file = dataset.metadata.spec['maf_index'].param.new_file( dataset = dataset )
-        indexes.write( open( index_file.file_name, 'wb' ) )
+        indexes.write( open( index_file.file_name_to_overwrite, 'wb' ) )
         dataset.metadata.maf_index = index_file
     def set_peek( self, dataset, is_multi_byte=False ):
         if not dataset.dataset.purged:
@@ -261,17 +261,18 @@ class Tabular( data.Text ):
     def get_chunk(self, trans, dataset, chunk):
         ck_index = int(chunk)
         f = open(dataset.file_name)
-        f.seek(ck_index * trans.app.config.display_chunk_size)
-        # If we aren't at the start of the file, seek to next newline.  Do this better eventually.
-        if f.tell() != 0:
-            cursor = f.read(1)
-            while cursor and cursor != '\n':
-                cursor = f.read(1)
-        ck_data = f.read(trans.app.config.display_chunk_size)
-        cursor = f.read(1)
-        while cursor and ck_data[-1] != '\n':
-            ck_data += cursor
-            cursor = f.read(1)
+        try:
+            f.seek(ck_index * trans.app.config.display_chunk_size)
+            # If we aren't at the start of the file, skip the remainder of
+            # the line the previous chunk finished.
+            if f.tell() != 0:
+                f.readline()
+            ck_data = f.read(trans.app.config.display_chunk_size)
+            # Finish the last line of the chunk.
+            if ck_data and ck_data[-1] != '\n':
+                ck_data += f.readline()
+        finally:
+            f.close()
         return dumps( { 'ck_data': util.unicodify( ck_data ), 'ck_index': ck_index + 1 } )
 
     def display_data(self, trans, dataset, preview=False, filename=None, to_ext=None, chunk=None, **kwd):
@@ -4,7 +4,6 @@ Support for running a tool in Galaxy via an internal job management system
 from abc import ABCMeta
 from abc import abstractmethod
 
-import time
 import copy
 import datetime
 import galaxy
@@ -1012,11 +1011,15 @@ class JobWrapper( object ):
         self.sa_session.add(job)
         self.sa_session.flush()
 
-    def finish( self, stdout, stderr, tool_exit_code=None, remote_working_directory=None ):
+    def finish( self, stdout, stderr, tool_exit_code=None, remote_working_directory=None, output_collection_attempt=0 ):
         """
         Called to indicate that the associated command has been run. Updates
         the output datasets based on stderr and stdout from the command, and
         the contents of the output files.
+
+        If the outputs are not visible yet (and ``retry_job_output_collection``
+        is set) finishing is postponed - the job is finished again, from one
+        of the runner's finish worker threads, after a delay.
         """
         stdout = unicodify( stdout )
         stderr = unicodify( stderr )
@@ -1041,6 +1044,23 @@ class JobWrapper( object ):
             # the tasks failed. So include the stderr, stdout, and exit code:
             return self.fail( job.info, stderr=stderr, stdout=stdout, exit_code=tool_exit_code )
 
+        # Outputs written on other hosts may not be visible here yet (e.g. due
+        # to NFS attribute caching), this is checked before anything is done
+        # with them so that finishing can simply start over later.
+        if output_collection_attempt < self.app.config.retry_job_output_collection:
+            missing_paths = self.__missing_output_paths()
+            if missing_paths:
+                if output_collection_attempt + 1 < self.app.config.retry_job_output_collection:
+                    delay = min( self.app.config.retry_job_output_collection_delay * 2 ** output_collection_attempt,
+                                 self.app.config.retry_job_output_collection_max_delay )
+                    log.info( "(%s) Outputs not visible yet (%s), will finish the job again in %s seconds" % ( job.id, ", ".join( missing_paths ), delay ) )
+                    deferred_finish = DeferredJobFinish( self, stdout, stderr, tool_exit_code=tool_exit_code,
+                                                         remote_working_directory=remote_working_directory,
+                                                         output_collection_attempt=output_collection_attempt + 1 )
+                    self.queue.dispatcher.defer_finish( self, deferred_finish, delay )
+                    return
+                log.warning( "(%s) Outputs still not visible (%s), finishing the job anyway" % ( job.id, ", ".join( missing_paths ) ) )
+
         # Check the tool's stdout, stderr, and exit code for errors, but only
         # if the job has not already been marked as having an error.
         # The job's stdout and stderr will be set accordingly.
@@ -1079,17 +1099,6 @@ class JobWrapper( object ):
             context = self.get_dataset_finish_context( job_context, dataset_assoc.dataset.dataset )
             #should this also be checking library associations? - can a library item be added from a history before the job has ended? - lets not allow this to occur
             for dataset in dataset_assoc.dataset.dataset.history_associations + dataset_assoc.dataset.dataset.library_associations:  # need to update all associated output hdas, i.e. history was shared with job running
-                trynum = 0
-                while trynum < self.app.config.retry_job_output_collection:
-                    try:
-                        # Attempt to short circuit NFS attribute caching
-                        os.stat( dataset.dataset.file_name )
-                        os.chown( dataset.dataset.file_name, os.getuid(), -1 )
-                        trynum = self.app.config.retry_job_output_collection
-                    except ( OSError, ObjectNotFound ), e:
-                        trynum += 1
-                        log.warning( 'Error accessing %s, will retry: %s', dataset.dataset.file_name, e )
-                        time.sleep( 2 )
                 if getattr( dataset, "hidden_beneath_collection_instance", None ):
                     dataset.visible = False
                 dataset.blurb = 'done'
@@ -1255,6 +1264,46 @@ class JobWrapper( object ):
     def check_tool_output( self, stdout, stderr, tool_exit_code, job ):
         return check_output( self.tool, stdout, stderr, tool_exit_code, job )
 
+    def __missing_output_paths( self ):
+        """
+        Return the paths of outputs that finish() needs which aren't visible
+        yet - the output datasets (where the tool wrote them, they may already
+        have been moved if the job is being finished again) and the files of
+        any primary datasets described in the tool provided metadata. The
+        extra files directories of outputs are listed to refresh them, they
+        are not required to exist.
+        """
+        missing = []
+        for dataset_path in self.get_output_fnames():
+            paths = [ p for p in [ dataset_path.false_path, dataset_path.real_path ] if p ]
+            for path in paths:
+                try:
+                    # Attempt to short circuit NFS attribute caching
+                    os.stat( path )
+                except OSError:
+                    continue
+                try:
+                    os.chown( path, os.getuid(), -1 )
+                except OSError:
+                    pass
+                break
+            else:
+                missing.append( paths[ 0 ] )
+        for dataset_assoc in self.get_job().output_datasets:
+            try:
+                extra_files_path = dataset_assoc.dataset.dataset.extra_files_path
+                if os.path.isdir( extra_files_path ):
+                    os.listdir( extra_files_path )
+            except ( OSError, ObjectNotFound ):
+                pass
+        self.tool_provided_job_metadata = None
+        for meta in self.get_tool_provided_job_metadata():
+            if meta[ 'type' ] == 'new_primary_dataset' and 'filename' in meta:
+                path = os.path.join( self.working_directory, meta[ 'filename' ] )
+                if not os.path.exists( path ):
+                    missing.append( path )
+        return missing
+
     def cleanup( self, delete_files=True ):
         # At least one of these tool cleanup actions (job import), is needed
         # for thetool to work properly, that is why one might want to run
@@ -1452,6 +1501,8 @@ class JobWrapper( object ):
             config_file = self.app.config.config_file
         if datatypes_config is None:
             datatypes_config = self.app.datatypes_registry.integrated_datatypes_configs
+        if 'parallel' not in kwds:
+            kwds[ 'parallel' ] = util.asbool( self.job_destination.params.get( "parallel_set_metadata", False ) )
         return self.external_output_metadata.setup_external_metadata( [ output_dataset_assoc.dataset for output_dataset_assoc in job.output_datasets + job.output_library_datasets ],
                                                                       self.sa_session,
                                                                       exec_dir=exec_dir,
@@ -1542,6 +1593,24 @@ class JobWrapper( object ):
         return False
 
 
+class DeferredJobFinish( object ):
+    """
+    A call of ``JobWrapper.finish`` postponed until the job's outputs may be
+    visible, run from the job runner's finish worker threads.
+    """
+
+    def __init__( self, job_wrapper, *args, **kwds ):
+        self.job_wrapper = job_wrapper
+        self.args = args
+        self.kwds = kwds
+
+    def get_id_tag( self ):
+        return self.job_wrapper.get_id_tag()
+
+    def __call__( self ):
+        return self.job_wrapper.finish( *self.args, **self.kwds )
+
+
 class TaskWrapper(JobWrapper):
     """
     Extension of JobWrapper intended for running tasks.
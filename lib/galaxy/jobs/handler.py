@@ -14,6 +14,7 @@ from galaxy import model
 from galaxy.util.sleeper import Sleeper
 from galaxy.jobs import JobWrapper, TaskWrapper, JobDestination
 from galaxy.jobs.mapper import JobNotReadyException
+from galaxy.jobs.rule_helper import get_job_count_snapshot
 
 log = logging.getLogger( __name__ )
 
@@ -169,12 +170,19 @@ class JobHandlerQueue( object ):
         Continually iterate the waiting jobs, checking is each is ready to
         run and dispatching if so.
         """
+        query_profiler = getattr( self.app, 'query_profiler', None )
         while self.running:
             try:
                 # If jobs are locked, there's nothing to monitor and we skip
                 # to the sleep.
                 if not self.app.job_manager.job_lock:
-                    self.__monitor_step()
+                    if query_profiler:
+                        query_profiler.start( "job handler cycle" )
+                    try:
+                        self.__monitor_step()
+                    finally:
+                        if query_profiler:
+                            query_profiler.finish()
             except:
                 log.exception( "Exception in monitor_step" )
             # Sleep
@@ -262,6 +270,7 @@ class JobHandlerQueue( object ):
             jw = self.job_wrapper( job )
             jw.job_runner_mapper.cached_job_destination = JobDestination( id=job.destination_id, runner=job.job_runner_name, params=job.destination_params )
             self.increase_running_job_count(job.user_id, jw.job_destination.id)
+            self.__count_dispatched_job( job, jw.job_destination.id )
             self.dispatcher.put( jw )
         # Iterate over new and waiting jobs and look for any that are
         # ready to run
@@ -344,6 +353,7 @@ class JobHandlerQueue( object ):
         if state == JOB_READY:
             # PASS.  increase usage by one job (if caching) so that multiple jobs aren't dispatched on this queue iteration
             self.increase_running_job_count(job.user_id, job_destination.id )
+            self.__count_dispatched_job( job, job_destination.id )
         return state
 
     def __verify_job_ready( self, job, job_wrapper ):
@@ -422,6 +432,9 @@ class JobHandlerQueue( object ):
         self.user_job_count = None
         self.user_job_count_per_destination = None
         self.total_job_count_per_destination = None
+        # Job rules counting jobs (e.g. to burst) share a snapshot of job
+        # counts, refresh it once per iteration.
+        get_job_count_snapshot( self.app ).invalidate()
 
     def get_user_job_count(self, user_id):
         self.__cache_user_job_count()
@@ -487,6 +500,13 @@ class JobHandlerQueue( object ):
         elif self.user_job_count_per_destination is None:
             self.user_job_count_per_destination = {}
 
+    def __count_dispatched_job( self, job, destination_id ):
+        # The job count snapshot read by job rules isn't refreshed until the
+        # next iteration, count the job as queued at its destination until
+        # then. Like the snapshot, only jobs of registered users are counted.
+        if job.user is not None:
+            get_job_count_snapshot( self.app ).increment( destination_id, model.Job.states.QUEUED, job.user.email, job.tool_id )
+
     def increase_running_job_count(self, user_id, destination_id):
         if self.app.job_config.limits.registered_user_concurrent_jobs or \
            self.app.job_config.limits.anonymous_user_concurrent_jobs or \
@@ -752,6 +772,14 @@ class DefaultJobDispatcher( object ):
             log.error( 'put(): (%s) Invalid job runner: %s' % ( job_wrapper.job_id, runner_name ) )
             job_wrapper.fail( DEFAULT_JOB_PUT_FAILURE_MESSAGE )
 
+    def defer_finish( self, job_wrapper, deferred_finish, delay ):
+        """
+        Finish the job (by calling ``deferred_finish``) from the job's runner
+        finish worker threads in ``delay`` seconds.
+        """
+        runner = self.job_runners[ self.__get_runner_name( job_wrapper ) ]
+        runner.defer( delay, runner.finish_deferred, deferred_finish )
+
     def stop( self, job ):
         """
         Stop the given job. The input variable job may be either a Job or a Task.
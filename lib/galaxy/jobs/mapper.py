@@ -2,6 +2,8 @@ import logging
 import inspect
 import os
 import sys
+import threading
+import time
 
 log = logging.getLogger( __name__ )
 
@@ -30,59 +32,138 @@ class JobNotReadyException( Exception ):
         self.message = message
 
 
-STOCK_RULES = dict(
-    choose_one=stock_rules.choose_one,
-    burst=stock_rules.burst,
-    docker_dispatch=stock_rules.docker_dispatch,
-)
+# How often (in seconds) a rules package is checked for added, removed and
+# modified rule modules.
+RULE_MODULES_CHECK_INTERVAL = 10
 
 
-class JobRunnerMapper( object ):
+class RuleModuleRegistry( object ):
     """
-    This class is responsible to managing the mapping of jobs
-    (in the form of job_wrappers) to job runner url strings.
+    The rule modules of a rules package, loaded once and reloaded when the
+    package's rule module files change, along with which of them defines
+    each rule function looked up. Shared by the mappers of all jobs - see
+    ``get_rule_module_registry``.
     """
 
-    def __init__( self, job_wrapper, url_to_destination, job_config ):
-        self.job_wrapper = job_wrapper
-        self.url_to_destination = url_to_destination
-        self.job_config = job_config
-
-        self.rules_module = galaxy.jobs.rules
-
-        if job_config.dynamic_params is not None:
-            rules_module_name = job_config.dynamic_params['rules_module']
-            __import__(rules_module_name)
-            self.rules_module = sys.modules[rules_module_name]
-
-    def __get_rule_modules( self ):
-        unsorted_module_names = self.__get_rule_module_names( )
+    def __init__( self, rules_module ):
+        self.rules_module = rules_module
+        self.lock = threading.Lock()
+        self.modules = []
+        self.module_mtimes = {}
+        self.function_modules = {}
+        self.last_checked = None
+        # function name -> [ evaluations, total seconds, max seconds ]
+        self.rule_timings = {}
+
+    def module_with_function( self, function_name ):
+        """
+        Return the last (by name, to allow hierarchical overrides i.e.
+        000_galaxy_rules.py, 100_site_rules.py, 200_instance_rules.py) rule
+        module defining ``function_name`` or None.
+        """
+        with self.lock:
+            self.__check_modules()
+            if function_name not in self.function_modules:
+                matching_module = None
+                for rule_module in self.modules:
+                    if hasattr( rule_module, function_name ):
+                        matching_module = rule_module
+                        break
+                self.function_modules[ function_name ] = matching_module
+            return self.function_modules[ function_name ]
+
+    def record_rule_timing( self, function_name, seconds ):
+        with self.lock:
+            timing = self.rule_timings.setdefault( function_name, [ 0, 0.0, 0.0 ] )
+            timing[ 0 ] += 1
+            timing[ 1 ] += seconds
+            timing[ 2 ] = max( timing[ 2 ], seconds )
+
+    def __check_modules( self ):
+        now = time.time()
+        if self.last_checked is not None and now - self.last_checked < RULE_MODULES_CHECK_INTERVAL:
+            return
+        self.last_checked = now
+        module_mtimes = self.__rule_module_mtimes()
+        if module_mtimes == self.module_mtimes:
+            return
+        if self.module_mtimes:
+            log.info( "Rule modules in %s changed, reloading them" % self.rules_module.__name__ )
         ## Load modules in reverse order to allow hierarchical overrides
         ## i.e. 000_galaxy_rules.py, 100_site_rules.py, 200_instance_rules.py
-        module_names = sorted( unsorted_module_names, reverse=True )
+        module_names = sorted( module_mtimes.keys(), reverse=True )
         modules = []
         for rule_module_name in module_names:
             try:
                 module = __import__( rule_module_name )
                 for comp in rule_module_name.split( "." )[1:]:
                     module = getattr( module, comp )
+                if rule_module_name in self.module_mtimes and self.module_mtimes[ rule_module_name ] != module_mtimes[ rule_module_name ]:
+                    module = reload( module )
                 modules.append( module )
             except BaseException, exception:
                 exception_str = str( exception )
                 message = "%s rule module could not be loaded: %s" % ( rule_module_name, exception_str )
                 log.debug( message )
                 continue
-        return modules
+        self.modules = modules
+        self.module_mtimes = module_mtimes
+        self.function_modules = {}
 
-    def __get_rule_module_names( self ):
+    def __rule_module_mtimes( self ):
         rules_dir = self.rules_module.__path__[0]
-        names = []
+        mtimes = {}
         for fname in os.listdir( rules_dir ):
             if not( fname.startswith( "_" ) ) and fname.endswith( ".py" ):
                 base_name = self.rules_module.__name__
                 rule_module_name = "%s.%s" % (base_name, fname[:-len(".py")])
-                names.append( rule_module_name )
-        return names
+                try:
+                    mtimes[ rule_module_name ] = os.path.getmtime( os.path.join( rules_dir, fname ) )
+                except OSError:
+                    # Removed since listed
+                    continue
+        return mtimes
+
+
+RULE_MODULE_REGISTRIES = {}
+RULE_MODULE_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_rule_module_registry( rules_module ):
+    with RULE_MODULE_REGISTRIES_LOCK:
+        if rules_module.__name__ not in RULE_MODULE_REGISTRIES:
+            RULE_MODULE_REGISTRIES[ rules_module.__name__ ] = RuleModuleRegistry( rules_module )
+        return RULE_MODULE_REGISTRIES[ rules_module.__name__ ]
+
+
+STOCK_RULES = dict(
+    choose_one=stock_rules.choose_one,
+    burst=stock_rules.burst,
+    docker_dispatch=stock_rules.docker_dispatch,
+)
+
+
+class JobRunnerMapper( object ):
+    """
+    This class is responsible to managing the mapping of jobs
+    (in the form of job_wrappers) to job runner url strings.
+    """
+
+    def __init__( self, job_wrapper, url_to_destination, job_config ):
+        self.job_wrapper = job_wrapper
+        self.url_to_destination = url_to_destination
+        self.job_config = job_config
+
+        self.rules_module = galaxy.jobs.rules
+
+        if job_config.dynamic_params is not None:
+            rules_module_name = job_config.dynamic_params['rules_module']
+            __import__(rules_module_name)
+            self.rules_module = sys.modules[rules_module_name]
+
+    @property
+    def rule_module_registry( self ):
+        return get_rule_module_registry( self.rules_module )
 
     def __invoke_expand_function( self, expand_function, destination_params ):
         function_arg_names = inspect.getargspec( expand_function ).args
@@ -188,12 +269,7 @@ class JobRunnerMapper( object ):
             raise Exception( message )
 
     def __last_rule_module_with_function( self, function_name ):
-        # self.rule_modules is sorted in reverse order, so find first
-        # wiht function
-        for rule_module in self.__get_rule_modules( ):
-            if hasattr( rule_module, function_name ):
-                return rule_module
-        return None
+        return self.rule_module_registry.module_with_function( function_name )
 
     def __handle_dynamic_job_destination( self, destination ):
         expand_type = destination.params.get('type', "python")
@@ -213,7 +289,11 @@ class JobRunnerMapper( object ):
         return self.__handle_rule( expand_function, destination )
 
     def __handle_rule( self, rule_function, destination ):
+        start = time.time()
         job_destination = self.__invoke_expand_function( rule_function, destination.params )
+        elapsed = time.time() - start
+        self.rule_module_registry.record_rule_timing( rule_function.__name__, elapsed )
+        log.debug( "(%s) Dynamic rule %s evaluated in %.3f ms" % ( self.job_wrapper.job_id, rule_function.__name__, elapsed * 1000 ) )
         if not isinstance(job_destination, galaxy.jobs.JobDestination):
             job_destination_rep = str(job_destination)  # Should be either id or url
             if '://' in job_destination_rep:
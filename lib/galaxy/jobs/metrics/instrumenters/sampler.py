@@ -0,0 +1,126 @@
+import os
+import shutil
+
+from ..instrumenters import InstrumentPlugin
+from ...metrics import formatting
+from ...metrics import proc_sampler
+
+from galaxy import util
+from galaxy.util import directory_hash
+
+import logging
+log = logging.getLogger( __name__ )
+
+DEFAULT_INTERVAL = "10"
+DEFAULT_MAX_SAMPLES = "360"  # Double interval every hour with the default interval.
+
+SERIES_FILE_NAME = "series"
+
+SAMPLER_SCRIPT_PATH = "%s.py" % os.path.splitext( proc_sampler.__file__ )[ 0 ]
+
+FORMATTED_TITLES = {
+    "samples": "Resource Samples Taken",
+    "max_rss_kb": "Peak Memory Usage (RSS)",
+    "mean_rss_kb": "Mean Memory Usage (RSS)",
+    "max_cpu_percent": "Peak Percent CPU Usage",
+    "mean_cpu_percent": "Mean Percent CPU Usage",
+    "read_bytes": "Bytes Read from Disk",
+    "write_bytes": "Bytes Written to Disk",
+    "max_open_files": "Peak Open Files",
+    "max_processes": "Peak Processes",
+    "raw_series_path": "Relative Path of Resource Samples",
+}
+
+
+class SamplerFormatter( formatting.JobMetricFormatter ):
+
+    def format( self, key, value ):
+        title = FORMATTED_TITLES.get( key, key )
+        if key.endswith( "_rss_kb" ):
+            value_str = util.nice_size( float( value ) * 1024 )
+        elif key.endswith( "_bytes" ):
+            value_str = util.nice_size( float( value ) )
+        elif key.endswith( "_cpu_percent" ):
+            value_str = "%.1f%%" % float( value )
+        elif key == "raw_series_path":
+            value_str = value
+        else:
+            value_str = "%d" % int( value )
+        return ( title, value_str )
+
+
+class SamplerPlugin( InstrumentPlugin ):
+    """ Sample the memory (RSS), CPU, disk I/O and open files of the job's
+    processes from /proc every ``interval`` seconds with a small Python
+    script run alongside the job - a dependency free (but Linux only)
+    alternative to the collectl plugin. Peak and mean values are recorded
+    as job metrics.
+    """
+    plugin_type = "sampler"
+    formatter = SamplerFormatter()
+
+    def __init__( self, **kwargs ):
+        self.interval = float( kwargs.get( "interval", DEFAULT_INTERVAL ) )
+        self.max_samples = int( kwargs.get( "max_samples", DEFAULT_MAX_SAMPLES ) )
+        self.python = kwargs.get( "python", "python" )
+        saved_series_path = kwargs.get( "saved_series_path", None )
+        if "app" in kwargs and saved_series_path:
+            saved_series_path = kwargs[ "app" ].config.resolve_path( saved_series_path )
+        self.saved_series_path = saved_series_path
+        self.sampler_source = open( SAMPLER_SCRIPT_PATH, "r" ).read()
+
+    def pre_execute_instrument( self, job_directory ):
+        # Sample descendants of the job script ($$) - the sampler exits along
+        # with it.
+        return '''%s - "$$" '%s' %s %d > /dev/null 2>&1 <<'EOF_GALAXY_SAMPLER' &\n%sEOF_GALAXY_SAMPLER''' % (
+            self.python,
+            self.__series_file( job_directory ),
+            self.interval,
+            self.max_samples,
+            self.sampler_source,
+        )
+
+    def job_properties( self, job_id, job_directory ):
+        series_file = self.__series_file( job_directory )
+        if not os.path.exists( series_file ):
+            return {}
+        series = proc_sampler.read_series( series_file )
+        properties = {}
+        if self.saved_series_path:
+            destination_rel_dir = os.path.join( *directory_hash.directory_hash_id( job_id ) )
+            destination_rel_path = os.path.join( destination_rel_dir, "%s.tsv" % job_id )
+            destination_path = os.path.join( self.saved_series_path, destination_rel_path )
+            destination_dir = os.path.dirname( destination_path )
+            if not os.path.isdir( destination_dir ):
+                os.makedirs( destination_dir )
+            shutil.copyfile( series_file, destination_path )
+            properties[ "raw_series_path" ] = destination_rel_path
+        if not series:
+            # Job did not run long enough to be sampled.
+            return properties
+        properties.update( summarize_series( series ) )
+        return properties
+
+    def __series_file( self, job_directory ):
+        return self._instrument_file_path( job_directory, SERIES_FILE_NAME )
+
+
+def summarize_series( series ):
+    rss_kb = [ s[ "rss_kb" ] for s in series ]
+    # First sample has no previous sample to compute CPU usage from.
+    cpu_percent = [ s[ "cpu_percent" ] for s in series[ 1: ] ] or [ 0.0 ]
+    return dict(
+        samples=len( series ),
+        max_rss_kb=max( rss_kb ),
+        mean_rss_kb=sum( rss_kb ) / len( rss_kb ),
+        max_cpu_percent=max( cpu_percent ),
+        mean_cpu_percent=sum( cpu_percent ) / len( cpu_percent ),
+        # Cumulative values, last sample holds the totals.
+        read_bytes=series[ -1 ][ "read_bytes" ],
+        write_bytes=series[ -1 ][ "write_bytes" ],
+        max_open_files=max( [ s[ "open_files" ] for s in series ] ),
+        max_processes=max( [ s[ "processes" ] for s in series ] ),
+    )
+
+
+__all__ = [ SamplerPlugin ]
@@ -0,0 +1,67 @@
+import json
+
+from ..instrumenters import InstrumentPlugin
+from ...metrics import formatting
+
+import logging
+log = logging.getLogger( __name__ )
+
+# scripts/set_metadata.py cannot import this module (it would pull in all of
+# galaxy.jobs), so it duplicates this file name - keep them in sync.
+TIMINGS_FILE_NAME = "timings"
+
+PROCESSES_KEY = "processes"
+TOTAL_SECONDS_KEY = "total_seconds"
+DATASET_SECONDS_KEY_PREFIX = "dataset_"
+DATASET_SECONDS_KEY_SUFFIX = "_seconds"
+
+
+class SetMetadataFormatter( formatting.JobMetricFormatter ):
+
+    def format( self, key, value ):
+        if key == PROCESSES_KEY:
+            return ( "Metadata Processes", "%d" % int( value ) )
+        elif key == TOTAL_SECONDS_KEY:
+            return ( "Metadata Time (Wall Clock)", formatting.seconds_to_str( int( value ) ) )
+        elif key.startswith( DATASET_SECONDS_KEY_PREFIX ):
+            dataset_id = key[ len( DATASET_SECONDS_KEY_PREFIX ):-len( DATASET_SECONDS_KEY_SUFFIX ) ]
+            return ( "Metadata Time (Dataset %s)" % dataset_id, "%.2f seconds" % float( value ) )
+        return ( key, value )
+
+
+class SetMetadataPlugin( InstrumentPlugin ):
+    """ Plugin recording the time spent setting metadata for each output of a
+    job when metadata is set externally by set_metadata.sh (and how many
+    processes were used to do so - see the ``parallel_set_metadata``
+    destination parameter).
+    """
+    plugin_type = "set_metadata"
+    formatter = SetMetadataFormatter()
+
+    def __init__( self, **kwargs ):
+        pass
+
+    def job_properties( self, job_id, job_directory ):
+        timings_file = self._instrument_file_path( job_directory, TIMINGS_FILE_NAME )
+        try:
+            timings = json.load( open( timings_file, "r" ) )
+        except IOError:
+            # Metadata not set externally or not yet set (e.g. it is set
+            # after the job by the runner).
+            return {}
+        except ValueError:
+            log.debug( "Failed to parse set_metadata timings for job %s" % job_id )
+            return {}
+
+        properties = {}
+        properties[ PROCESSES_KEY ] = timings[ PROCESSES_KEY ]
+        properties[ TOTAL_SECONDS_KEY ] = timings[ TOTAL_SECONDS_KEY ]
+        for dataset_id, seconds in timings[ "outputs" ]:
+            if dataset_id is None:
+                # Dataset could not be loaded, set_metadata.py reported the error.
+                continue
+            key = "%s%s%s" % ( DATASET_SECONDS_KEY_PREFIX, dataset_id, DATASET_SECONDS_KEY_SUFFIX )
+            properties[ key ] = seconds
+        return properties
+
+__all__ = [ SetMetadataPlugin ]
@@ -0,0 +1,173 @@
+""" Sample the resource use of a job's processes from /proc at a fixed interval.
+
+This module is embedded in job scripts by the sampler job metrics plugin (see
+``galaxy.jobs.metrics.instrumenters.sampler``) and runs on the compute node
+alongside the tool command, so it must only depend on the Python standard
+library (and run on Python 2.6+). It is run as::
+
+    python - <pid> <series_path> <interval> <max_samples>
+
+and appends a line to ``series_path`` for every sample of the processes
+descending from ``pid`` (the job script) until that process exits. The
+interval is doubled every ``max_samples`` samples to keep the series compact
+for long running jobs. The Galaxy server summarizes the series with
+``read_series``.
+"""
+import os
+import sys
+import time
+
+COLUMNS = [
+    "elapsed_seconds",
+    "rss_kb",
+    "cpu_percent",
+    "read_bytes",
+    "write_bytes",
+    "open_files",
+    "processes",
+]
+
+
+def _read( path ):
+    try:
+        f = open( path, "r" )
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        # Process exited or (for io) is not readable.
+        return None
+
+
+def _process_parents():
+    parents = {}
+    for name in os.listdir( "/proc" ):
+        if not name.isdigit():
+            continue
+        stat = _read( "/proc/%s/stat" % name )
+        if stat is None:
+            continue
+        # Command name (in parentheses) may contain spaces.
+        fields = stat[ stat.rfind( ")" ) + 2: ].split()
+        parents[ int( name ) ] = int( fields[ 1 ] )
+    return parents
+
+
+def _descendants( pid, parents, exclude ):
+    children = {}
+    for child, parent in parents.items():
+        children.setdefault( parent, [] ).append( child )
+    pids = []
+    to_visit = [ pid ]
+    while to_visit:
+        current = to_visit.pop()
+        if current == exclude:
+            continue
+        pids.append( current )
+        to_visit.extend( children.get( current, [] ) )
+    return pids
+
+
+def _sample_process( pid ):
+    """ Return rss (kB), cpu time (clock ticks), bytes read and written and
+    number of open files of process ``pid`` or None if it has exited.
+    """
+    status = _read( "/proc/%d/status" % pid )
+    stat = _read( "/proc/%d/stat" % pid )
+    if status is None or stat is None:
+        return None
+    rss_kb = 0
+    for line in status.splitlines():
+        if line.startswith( "VmRSS:" ):
+            rss_kb = int( line.split()[ 1 ] )
+    fields = stat[ stat.rfind( ")" ) + 2: ].split()
+    cpu_ticks = int( fields[ 11 ] ) + int( fields[ 12 ] )
+    read_bytes = write_bytes = 0
+    io = _read( "/proc/%d/io" % pid )
+    if io is not None:
+        for line in io.splitlines():
+            if line.startswith( "read_bytes:" ):
+                read_bytes = int( line.split()[ 1 ] )
+            elif line.startswith( "write_bytes:" ):
+                write_bytes = int( line.split()[ 1 ] )
+    try:
+        open_files = len( os.listdir( "/proc/%d/fd" % pid ) )
+    except OSError:
+        open_files = 0
+    return rss_kb, cpu_ticks, read_bytes, write_bytes, open_files
+
+
+def sample( pid, series_path, interval, max_samples ):
+    clock_ticks = float( os.sysconf( "SC_CLK_TCK" ) )
+    own_pid = os.getpid()
+    start = time.time()
+    # Last cpu ticks and bytes read and written seen for every process, so
+    # the resources used by processes that already exited are still counted.
+    totals = {}
+    last_cpu_ticks = 0
+    last_time = start
+    samples = 0
+    series = open( series_path, "w" )
+    series.write( "%s\n" % "\t".join( COLUMNS ) )
+    while os.path.exists( "/proc/%d" % pid ):
+        now = time.time()
+        rss_kb = open_files = processes = 0
+        for process_pid in _descendants( pid, _process_parents(), own_pid ):
+            process_sample = _sample_process( process_pid )
+            if process_sample is None:
+                continue
+            process_rss_kb, cpu_ticks, read_bytes, write_bytes, process_open_files = process_sample
+            rss_kb += process_rss_kb
+            open_files += process_open_files
+            processes += 1
+            totals[ process_pid ] = ( cpu_ticks, read_bytes, write_bytes )
+        cpu_ticks = sum( [ total[ 0 ] for total in totals.values() ] )
+        if samples and now > last_time:
+            cpu_percent = max( 0, cpu_ticks - last_cpu_ticks ) / clock_ticks / ( now - last_time ) * 100
+        else:
+            cpu_percent = 0
+        last_cpu_ticks, last_time = cpu_ticks, now
+        values = [
+            "%.1f" % ( now - start ),
+            "%d" % rss_kb,
+            "%.1f" % cpu_percent,
+            "%d" % sum( [ total[ 1 ] for total in totals.values() ] ),
+            "%d" % sum( [ total[ 2 ] for total in totals.values() ] ),
+            "%d" % open_files,
+            "%d" % processes,
+        ]
+        series.write( "%s\n" % "\t".join( values ) )
+        series.flush()
+        samples += 1
+        if samples % max_samples == 0:
+            interval *= 2
+        time.sleep( interval )
+    series.close()
+
+
+def read_series( series_path ):
+    """ Parse a series written by ``sample`` into a list of dictionaries
+    (one per sample) keyed on ``COLUMNS``.
+    """
+    series = []
+    f = open( series_path, "r" )
+    try:
+        for line in f:
+            fields = line.strip().split( "\t" )
+            if len( fields ) != len( COLUMNS ) or fields[ 0 ] == COLUMNS[ 0 ]:
+                # Header or line truncated when job was killed.
+                continue
+            series.append( dict( zip( COLUMNS, [ float( field ) for field in fields ] ) ) )
+    finally:
+        f.close()
+    return series
+
+
+def main( argv ):
+    pid, series_path, interval, max_samples = argv[ 1: ]
+    sample( int( pid ), series_path, float( interval ), int( max_samples ) )
+
+
+if __name__ == "__main__":
+    main( sys.argv )
@@ -1,10 +1,21 @@
-from datetime import datetime
+from datetime import (
+    datetime,
+    timedelta
+)
 import hashlib
+import math
 import random
+import threading
+import time
+import weakref
 
 from sqlalchemy import (
     and_,
-    func
+    case,
+    distinct,
+    func,
+    or_,
+    select
 )
 
 from galaxy import model
@@ -15,6 +26,36 @@ log = logging.getLogger( __name__ )
 
 VALID_JOB_HASH_STRATEGIES = ["job", "user", "history", "workflow_invocation"]
 
+# Resources summarized per tool by ToolResourceStatistics and the job metric
+# plugin and name they are drawn from (see the core and collectl job metrics
+# instrumenters - memory is collectl's peak VmRSS, in KB, of the job's
+# processes so collectl must be configured to record process data).
+RESOURCE_METRICS = {
+    "runtime_seconds": ( "core", "runtime_seconds" ),
+    "cores": ( "core", "galaxy_slots" ),
+    "memory_kb": ( "collectl", "process_max_VmRSS" ),
+}
+RESOURCES_BY_METRIC = dict( ( metric, resource ) for resource, metric in RESOURCE_METRICS.items() )
+DEFAULT_TOOL_STATISTICS_REFRESH_INTERVAL = 600
+DEFAULT_TOOL_STATISTICS_WINDOW_DAYS = 30
+DEFAULT_TOOL_STATISTICS_MIN_JOBS = 5
+# Input sizes of 10^MAX_SIZE_BUCKET bytes and more share a size bucket.
+MAX_SIZE_BUCKET = 18
+
+# States of the jobs counted by JobCountSnapshot - job_count queries for
+# other states (or for jobs created or updated recently) are always run
+# against the database.
+SNAPSHOT_JOB_STATES = [
+    model.Job.states.NEW,
+    model.Job.states.RESUBMITTED,
+    model.Job.states.UPLOAD,
+    model.Job.states.WAITING,
+    model.Job.states.QUEUED,
+    model.Job.states.RUNNING,
+    model.Job.states.PAUSED,
+]
+DEFAULT_JOB_COUNT_SNAPSHOT_TTL = 5
+
 
 class RuleHelper( object ):
     """ Utility to allow job rules to interface cleanly with the rest of
@@ -27,6 +68,46 @@ class RuleHelper( object ):
     def __init__( self, app ):
         self.app = app
 
+    def tool_statistics( self, tool_or_id, tool_version=None, input_size=None, min_jobs=None ):
+        """ Summarize the resources used by past successful jobs of the
+        specified tool - optionally narrowed down to a tool version and/or
+        jobs with total input sizes of the same order of magnitude as
+        ``input_size`` (in bytes). Returns None if fewer than ``min_jobs``
+        such jobs have run recently.
+
+        The returned dictionary contains the number of jobs summarized
+        (``count``) and for each of ``runtime_seconds``, ``cores`` and
+        ``memory_kb`` that jobs recorded metrics for a dictionary with the
+        ``mean``, ``max`` and 95th percentile (``p95``) of that resource. For
+        instance a rule could request ``memory_kb[ "p95" ]`` plus some
+        headroom and a walltime of ``runtime_seconds[ "max" ]`` for a job.
+
+        These statistics are periodically computed for all tools at once in
+        a background thread (see ``tool_statistics_refresh_interval`` in
+        galaxy.ini) and shared by all rules so this lookup doesn't query the
+        database - until the first refresh completes it returns None.
+        """
+        if hasattr( tool_or_id, 'id' ):
+            tool_id = tool_or_id.id
+            if tool_version is None:
+                tool_version = getattr( tool_or_id, 'version', None )
+        else:
+            tool_id = tool_or_id
+        return get_tool_resource_statistics( self.app ).get( tool_id, tool_version, input_size, min_jobs=min_jobs )
+
+    def job_input_size( self, job ):
+        """ Total size (in bytes) of the input datasets of ``job`` (a job
+        or job wrapper) suitable for passing to ``tool_statistics``.
+        """
+        if hasattr( job, 'get_job' ):
+            job = job.get_job()
+        input_size = 0
+        for input_association in job.input_datasets:
+            dataset = input_association.dataset
+            if dataset is not None:
+                input_size += dataset.get_size() or 0
+        return input_size
+
     def supports_docker( self, job_or_tool ):
         """ Job rules can pass this function a job, job_wrapper, or tool and
         determine if the underlying tool believes it can be containered.
@@ -47,8 +128,20 @@ class RuleHelper( object ):
 
     def job_count(
         self,
+        strict=False,
         **kwds
     ):
+        """ Count jobs matching the supplied filters (see ``_filter_job_query``).
+
+        Counts of jobs in active states (see ``SNAPSHOT_JOB_STATES``) are
+        read from a snapshot of job counts shared by all rules and refreshed
+        once per job handler cycle (jobs dispatched by this handler during
+        the cycle are counted as queued at their destination), so they may
+        be a few seconds out of date - pass ``strict=True`` to count the jobs
+        in the database instead.
+        """
+        if not strict and JobCountSnapshot.can_count( **kwds ):
+            return get_job_count_snapshot( self.app ).count( **kwds )
         query = self.query( model.Job )
         return self._filter_job_query( query, **kwds ).count()
 
@@ -83,6 +176,7 @@ class RuleHelper( object ):
         for_destination=None,
         for_destinations=None,
         for_job_states=None,
+        for_tool_id=None,
         created_in_last=None,
         updated_in_last=None,
     ):
@@ -93,6 +187,9 @@ class RuleHelper( object ):
         if for_user_email is not None:
             query = query.filter( model.User.table.c.email == for_user_email )
 
+        if for_tool_id is not None:
+            query = query.filter( model.Job.table.c.tool_id == for_tool_id )
+
         if for_destinations is not None:
             if len( for_destinations ) == 1:
                 query = query.filter( model.Job.table.c.destination_id == for_destinations[ 0 ] )
@@ -120,10 +217,12 @@ class RuleHelper( object ):
 
         return query
 
-    def should_burst( self, destination_ids, num_jobs, job_states=None ):
+    def should_burst( self, destination_ids, num_jobs, job_states=None, strict=False ):
         """ Check if the specified destinations ``destination_ids`` have at
         least ``num_jobs`` assigned to it - send in ``job_state`` as ``queued``
-        to limit this check to number of jobs queued.
+        to limit this check to number of jobs queued. Jobs are counted using
+        the shared job count snapshot unless ``strict`` is set (see
+        ``job_count``).
 
         See stock_rules for an simple example of using this function - but to
         get the most out of it - it should probably be used with custom job
@@ -134,7 +233,8 @@ class RuleHelper( object ):
             job_states = "queued,running"
         from_destination_job_count = self.job_count(
             for_destinations=destination_ids,
-            for_job_states=util.listify( job_states )
+            for_job_states=util.listify( job_states ),
+            strict=strict,
         )
         # Would this job push us over maximum job count before requiring
         # bursting (roughly... very roughly given many handler threads may be
@@ -197,3 +297,345 @@ class RuleHelper( object ):
             return user and user.id
         elif hash_by == "job":
             return job.id
+
+
+class ToolResourceStatistics( object ):
+    """ Statistics of the runtime, cores and memory used by recent successful
+    jobs of each tool - per tool, tool version and order of magnitude of total
+    input size as well as aggregated across versions and input sizes.
+
+    Counts, means and maxima are aggregated by the database, grouped by tool,
+    version and input size - only the metric values needed for the 95th
+    percentiles are fetched (on PostgreSQL just the top 5% of each group,
+    elsewhere all of them). This is done every ``refresh_interval`` seconds
+    in a background thread, lookups in the meantime (and before the first
+    refresh completes) use the statistics of the previous refresh - see
+    ``RuleHelper.tool_statistics``.
+    """
+
+    def __init__( self, app ):
+        self.app = app
+        config = app.config
+        self.refresh_interval = int( getattr( config, "tool_statistics_refresh_interval", DEFAULT_TOOL_STATISTICS_REFRESH_INTERVAL ) )
+        self.window_days = int( getattr( config, "tool_statistics_window_days", DEFAULT_TOOL_STATISTICS_WINDOW_DAYS ) )
+        self.min_jobs = int( getattr( config, "tool_statistics_min_jobs", DEFAULT_TOOL_STATISTICS_MIN_JOBS ) )
+        self.statistics = {}
+        self.last_refreshed = None
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+
+    def get( self, tool_id, tool_version=None, input_size=None, min_jobs=None ):
+        self.__refresh_if_stale()
+        if min_jobs is None:
+            min_jobs = self.min_jobs
+        statistics = self.statistics
+        # Fall back to less specific statistics if there are too few jobs for
+        # this particular version and input size.
+        input_size_bucket = None if input_size is None else size_bucket( input_size )
+        for key in statistics_keys( tool_id, tool_version, input_size_bucket ):
+            tool_statistics = statistics.get( key, None )
+            if tool_statistics is not None and tool_statistics[ "count" ] >= min_jobs:
+                return tool_statistics
+        return None
+
+    def refresh( self ):
+        start = time.time()
+        since = datetime.now() - timedelta( days=self.window_days )
+        metrics = self.__metrics( since )
+        session = self.app.model.context
+
+        counts = {}
+        for tool_id, tool_version, input_size_bucket, job_count in session.execute( self.__job_counts( metrics ) ):
+            for key in statistics_keys( tool_id, tool_version, input_size_bucket ):
+                counts[ key ] = counts.get( key, 0 ) + job_count
+
+        # key -> resource -> [ count, total, max ]
+        aggregates = {}
+        for tool_id, tool_version, input_size_bucket, plugin, metric_name, count, total, maximum in session.execute( self.__aggregates( metrics ) ):
+            resource = RESOURCES_BY_METRIC[ ( plugin, metric_name ) ]
+            for key in statistics_keys( tool_id, tool_version, input_size_bucket ):
+                aggregate = aggregates.setdefault( key, {} ).setdefault( resource, [ 0, 0.0, None ] )
+                aggregate[ 0 ] += count
+                aggregate[ 1 ] += float( total )
+                aggregate[ 2 ] = float( maximum ) if aggregate[ 2 ] is None else max( aggregate[ 2 ], float( maximum ) )
+
+        # key -> resource -> values, including at least the largest values
+        # down to the 95th percentile.
+        values = {}
+        for tool_id, tool_version, input_size_bucket, plugin, metric_name, metric_value in session.execute( self.__percentile_values( metrics ) ):
+            resource = RESOURCES_BY_METRIC[ ( plugin, metric_name ) ]
+            for key in statistics_keys( tool_id, tool_version, input_size_bucket ):
+                values.setdefault( key, {} ).setdefault( resource, [] ).append( float( metric_value ) )
+
+        statistics = {}
+        for key, count in counts.items():
+            tool_statistics = { "count": count }
+            for resource, ( resource_count, total, maximum ) in aggregates.get( key, {} ).items():
+                largest_values = sorted( values[ key ][ resource ], reverse=True )
+                tool_statistics[ resource ] = dict(
+                    mean=total / resource_count,
+                    max=maximum,
+                    p95=largest_values[ resource_count - 1 - p95_index( resource_count ) ],
+                )
+            statistics[ key ] = tool_statistics
+        # Swap in the new statistics at once, lookups in progress keep using
+        # the old ones.
+        self.statistics = statistics
+        self.last_refreshed = time.time()
+        log.debug( "Computed resource statistics for %d jobs of %d tools in %.2f seconds" % ( sum( count for key, count in counts.items() if key[ 1: ] == ( None, None ) ), len( set( key[ 0 ] for key in statistics ) ), time.time() - start ) )
+
+    def __refresh_if_stale( self ):
+        if self.last_refreshed is not None and time.time() - self.last_refreshed < self.refresh_interval:
+            return
+        # Refresh in the background rather than stall the job handler thread
+        # doing this lookup, only one refresh runs at a time.
+        with self.refresh_lock:
+            if self.refresh_thread is not None and self.refresh_thread.isAlive():
+                return
+            self.refresh_thread = threading.Thread( name="ToolResourceStatistics.refresh_thread", target=self.__refresh )
+            self.refresh_thread.setDaemon( True )
+            self.refresh_thread.start()
+
+    def __refresh( self ):
+        try:
+            self.refresh()
+        except Exception:
+            log.exception( "Failed to compute tool resource statistics" )
+            # Don't retry for every lookup.
+            self.last_refreshed = time.time()
+        finally:
+            self.app.model.context.remove()
+
+    def __metrics( self, since ):
+        """ Resource metrics of the successful jobs since ``since`` along
+        with the job's tool and order of magnitude of input size.
+        """
+        job_table = model.Job.table
+        metric_table = model.JobMetricNumeric.table
+        input_sizes = self.__input_sizes( since )
+        input_size = func.coalesce( input_sizes.c.input_size, 0 )
+        from_obj = job_table.join( metric_table, metric_table.c.job_id == job_table.c.id )
+        from_obj = from_obj.outerjoin( input_sizes, input_sizes.c.job_id == job_table.c.id )
+        query = select(
+            [
+                job_table.c.id.label( "job_id" ),
+                job_table.c.tool_id,
+                job_table.c.tool_version,
+                size_bucket_expression( input_size ).label( "input_size_bucket" ),
+                metric_table.c.plugin,
+                metric_table.c.metric_name,
+                metric_table.c.metric_value,
+            ],
+            and_(
+                self.__successful_jobs( job_table, since ),
+                or_( *[ and_( metric_table.c.plugin == plugin, metric_table.c.metric_name == metric_name ) for plugin, metric_name in RESOURCE_METRICS.values() ] ),
+            ),
+            from_obj=[ from_obj ],
+        )
+        return query.alias( "job_resource_metric" )
+
+    def __input_sizes( self, since ):
+        job_table = model.Job.table.alias( "input_size_job" )
+        input_table = model.JobToInputDatasetAssociation.table
+        hda_table = model.HistoryDatasetAssociation.table
+        dataset_table = model.Dataset.table
+        query = select(
+            [ input_table.c.job_id, func.sum( dataset_table.c.file_size ).label( "input_size" ) ],
+            and_(
+                input_table.c.job_id == job_table.c.id,
+                input_table.c.dataset_id == hda_table.c.id,
+                hda_table.c.dataset_id == dataset_table.c.id,
+                self.__successful_jobs( job_table, since ),
+            ),
+        )
+        return query.group_by( input_table.c.job_id ).alias( "job_input_size" )
+
+    def __successful_jobs( self, job_table, since ):
+        return and_( job_table.c.state == model.Job.states.OK, job_table.c.update_time >= since )
+
+    def __job_counts( self, metrics ):
+        group_by = [ metrics.c.tool_id, metrics.c.tool_version, metrics.c.input_size_bucket ]
+        return select( group_by + [ func.count( distinct( metrics.c.job_id ) ) ] ).group_by( *group_by )
+
+    def __aggregates( self, metrics ):
+        group_by = [ metrics.c.tool_id, metrics.c.tool_version, metrics.c.input_size_bucket, metrics.c.plugin, metrics.c.metric_name ]
+        aggregates = [ func.count( metrics.c.metric_value ), func.sum( metrics.c.metric_value ), func.max( metrics.c.metric_value ) ]
+        return select( group_by + aggregates ).group_by( *group_by )
+
+    def __percentile_values( self, metrics ):
+        columns = [ metrics.c.tool_id, metrics.c.tool_version, metrics.c.input_size_bucket, metrics.c.plugin, metrics.c.metric_name, metrics.c.metric_value ]
+        if self.app.model.engine.name != "postgresql":
+            return select( columns )
+        # Rank the values within each group statistics are computed for (see
+        # statistics_keys) and only fetch those in the top 5% of any of them.
+        ranked_columns = list( columns )
+        in_top_values = []
+        for i, partition_by in enumerate( [ [ metrics.c.tool_id, metrics.c.tool_version, metrics.c.input_size_bucket ],
+                                            [ metrics.c.tool_id, metrics.c.input_size_bucket ],
+                                            [ metrics.c.tool_id, metrics.c.tool_version ],
+                                            [ metrics.c.tool_id ] ] ):
+            partition_by = partition_by + [ metrics.c.plugin, metrics.c.metric_name ]
+            ranked_columns.append( func.row_number().over( partition_by=partition_by, order_by=metrics.c.metric_value.desc() ).label( "rank_%d" % i ) )
+            ranked_columns.append( func.count().over( partition_by=partition_by ).label( "total_%d" % i ) )
+        ranked = select( ranked_columns ).alias( "ranked_job_resource_metric" )
+        for i in range( 4 ):
+            in_top_values.append( ranked.c[ "rank_%d" % i ] <= ranked.c[ "total_%d" % i ] * 0.05 + 1 )
+        return select( [ ranked.c[ column.name ] for column in columns ], or_( *in_top_values ) )
+
+
+class JobCountSnapshot( object ):
+    """ Number of jobs in each active state by destination, user and tool -
+    computed with a single aggregate query and reused by all job_count and
+    should_burst calls until it is invalidated at the start of the next job
+    handler cycle (see ``JobHandlerQueue``) or is older than
+    ``job_count_snapshot_ttl`` seconds. Jobs dispatched in the meantime are
+    added to it as they are assigned a destination (see ``increment``).
+    """
+
+    def __init__( self, app ):
+        self.app = app
+        self.ttl = float( getattr( app.config, "job_count_snapshot_ttl", DEFAULT_JOB_COUNT_SNAPSHOT_TTL ) )
+        self.lock = threading.Lock()
+        # ( destination_id, state ) -> [ ( user email, tool_id, count ) ]
+        self.counts = None
+        self.last_refreshed = None
+
+    @staticmethod
+    def can_count( for_job_states=None, created_in_last=None, updated_in_last=None, **kwds ):
+        if for_job_states is None or created_in_last is not None or updated_in_last is not None:
+            return False
+        return all( [ state in SNAPSHOT_JOB_STATES for state in for_job_states ] )
+
+    def invalidate( self ):
+        self.last_refreshed = None
+
+    def increment( self, destination_id, state, email, tool_id ):
+        """ Count a job dispatched since the snapshot was taken - like
+        ``JobHandlerQueue.increase_running_job_count`` does for job limits -
+        so rules mapping the following jobs of the same job handler cycle
+        account for it.
+        """
+        with self.lock:
+            if self.counts is None:
+                return
+            counts = self.counts.setdefault( ( destination_id, state ), [] )
+            for i, ( count_email, count_tool_id, count ) in enumerate( counts ):
+                if count_email == email and count_tool_id == tool_id:
+                    counts[ i ] = ( email, tool_id, count + 1 )
+                    return
+            counts.append( ( email, tool_id, 1 ) )
+
+    def count(
+        self,
+        for_user_email=None,
+        for_destination=None,
+        for_destinations=None,
+        for_job_states=None,
+        for_tool_id=None,
+        **kwds
+    ):
+        counts = self.__current_counts()
+        if for_destination is not None:
+            for_destinations = [ for_destination ]
+        if for_destinations is None:
+            keys = [ key for key in counts if key[ 1 ] in for_job_states ]
+        else:
+            keys = [ ( destination_id, state ) for destination_id in for_destinations for state in for_job_states ]
+        total = 0
+        for key in keys:
+            for email, tool_id, count in counts.get( key, [] ):
+                if for_user_email is not None and email != for_user_email:
+                    continue
+                if for_tool_id is not None and tool_id != for_tool_id:
+                    continue
+                total += count
+        return total
+
+    def __current_counts( self ):
+        with self.lock:
+            if self.last_refreshed is None or time.time() - self.last_refreshed >= self.ttl:
+                self.counts = self.__query_counts()
+                self.last_refreshed = time.time()
+            return self.counts
+
+    def __query_counts( self ):
+        job_table = model.Job.table
+        # Like RuleHelper._filter_job_query, only count jobs of registered
+        # users.
+        query = self.app.model.context.query(
+            job_table.c.destination_id,
+            job_table.c.state,
+            model.User.table.c.email,
+            job_table.c.tool_id,
+            func.count( job_table.c.id ),
+        )
+        query = query.filter( job_table.c.user_id == model.User.table.c.id )
+        query = query.filter( job_table.c.state.in_( SNAPSHOT_JOB_STATES ) )
+        query = query.group_by(
+            job_table.c.destination_id,
+            job_table.c.state,
+            model.User.table.c.email,
+            job_table.c.tool_id,
+        )
+        counts = {}
+        for destination_id, state, email, tool_id, count in query:
+            counts.setdefault( ( destination_id, state ), [] ).append( ( email, tool_id, count ) )
+        return counts
+
+
+JOB_COUNT_SNAPSHOTS = weakref.WeakKeyDictionary()
+JOB_COUNT_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_job_count_snapshot( app ):
+    """ Return the JobCountSnapshot shared by all rules of ``app``.
+    """
+    with JOB_COUNT_SNAPSHOTS_LOCK:
+        if app not in JOB_COUNT_SNAPSHOTS:
+            JOB_COUNT_SNAPSHOTS[ app ] = JobCountSnapshot( app )
+        return JOB_COUNT_SNAPSHOTS[ app ]
+
+
+TOOL_RESOURCE_STATISTICS = weakref.WeakKeyDictionary()
+TOOL_RESOURCE_STATISTICS_LOCK = threading.Lock()
+
+
+def get_tool_resource_statistics( app ):
+    """ Return the ToolResourceStatistics shared by all rules of ``app``.
+    """
+    with TOOL_RESOURCE_STATISTICS_LOCK:
+        if app not in TOOL_RESOURCE_STATISTICS:
+            TOOL_RESOURCE_STATISTICS[ app ] = ToolResourceStatistics( app )
+        return TOOL_RESOURCE_STATISTICS[ app ]
+
+
+def size_bucket( size ):
+    """ Order of magnitude of ``size`` (in bytes) - i.e. 0 for sizes below
+    10 bytes, 3 for 1000-9999 bytes, etc....
+    """
+    if not size or size < 1:
+        return 0
+    return min( int( math.log10( size ) ), MAX_SIZE_BUCKET )
+
+
+def size_bucket_expression( size ):
+    """ SQL expression for the ``size_bucket`` of ``size``.
+    """
+    whens = [ ( size < 10 ** ( bucket + 1 ), bucket ) for bucket in range( MAX_SIZE_BUCKET ) ]
+    return case( whens, else_=MAX_SIZE_BUCKET )
+
+
+def statistics_keys( tool_id, tool_version, input_size_bucket ):
+    """ Keys of the ToolResourceStatistics a job of this tool version and
+    input size contributes to, most specific first.
+    """
+    return [ ( tool_id, tool_version, input_size_bucket ),
+             ( tool_id, None, input_size_bucket ),
+             ( tool_id, tool_version, None ),
+             ( tool_id, None, None ) ]
+
+
+def p95_index( count ):
+    """ Index of the 95th percentile in ``count`` sorted values.
+    """
+    return min( count - 1, int( math.ceil( 0.95 * count ) ) - 1 )
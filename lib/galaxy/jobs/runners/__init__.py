@@ -4,12 +4,15 @@ Base classes for job runner plugins.
 
 import os
 import time
+import heapq
 import string
 import logging
 import datetime
+import itertools
 import threading
 import subprocess
 
+from collections import deque
 from Queue import Queue, Empty
 
 import galaxy.jobs
@@ -19,6 +22,7 @@ from galaxy.util import DATABASE_MAX_STRING_SIZE, shrink_stream_by_size
 from galaxy.util import in_directory
 from galaxy.util import ParamsWithSpecs
 from galaxy.util.bunch import Bunch
+from galaxy.util.odict import odict
 from galaxy.jobs.runners.util.job_script import job_script
 from galaxy.jobs.runners.util.env import env_to_statement
 
@@ -28,6 +32,17 @@ log = logging.getLogger( __name__ )
 
 STOP_SIGNAL = object()
 
+# Work put on a runner's work queue is run by a separate pool of threads per
+# kind of work (keyed by the name of the runner method queued), so that a
+# burst of finishing jobs cannot hold up the submission of new ones (or vice
+# versa). Anything else queued is run by the submit pool.
+WORK_POOLS = [ 'submit', 'finish', 'fail' ]
+WORK_POOL_BY_METHOD = dict( queue_job='submit', finish_job='finish', finish_deferred='finish', fail_job='fail' )
+DEFAULT_WORK_POOL = 'submit'
+# Number of most recent work items wait and run times are gauged over
+WORK_POOL_GAUGE_WINDOW = 100
+WORK_POOL_GAUGE_LOG_INTERVAL = 60
+
 
 JOB_RUNNER_PARAMETER_UNKNOWN_MESSAGE = "Invalid job runner parameter for this plugin: %s"
 JOB_RUNNER_PARAMETER_MAP_PROBLEM_MESSAGE = "Job runner parameter '%s' value '%s' could not be converted to the correct type"
@@ -46,8 +61,99 @@ class RunnerParams( ParamsWithSpecs ):
         raise Exception( JOB_RUNNER_PARAMETER_VALIDATION_FAILED_MESSAGE % name )
 
 
+class WorkerPool( object ):
+    """
+    Queue of ( method, arg ) work items and the threads running them, along
+    with gauges of the queue depth and of how long recent items waited in
+    the queue and took to run.
+    """
+
+    def __init__( self, name, nworkers ):
+        self.name = name
+        self.nworkers = nworkers
+        self.queue = Queue()
+        self.threads = []
+        self.busy = 0
+        self.processed = 0
+        self.waits = deque( maxlen=WORK_POOL_GAUGE_WINDOW )
+        self.runtimes = deque( maxlen=WORK_POOL_GAUGE_WINDOW )
+        self.lock = threading.Lock()
+
+    def put( self, method, arg ):
+        self.queue.put( ( method, arg, time.time() ) )
+
+    def get( self ):
+        """Block until a work item is available and return its method and
+        argument - the caller must call ``done()`` once it has been run.
+        """
+        method, arg, put_time = self.queue.get()
+        if method is not STOP_SIGNAL:
+            with self.lock:
+                self.busy += 1
+                self.waits.append( time.time() - put_time )
+        return method, arg
+
+    def done( self, runtime ):
+        with self.lock:
+            self.busy -= 1
+            self.processed += 1
+            self.runtimes.append( runtime )
+
+    def gauges( self ):
+        with self.lock:
+            waits = list( self.waits )
+            runtimes = list( self.runtimes )
+            busy = self.busy
+            processed = self.processed
+        return dict( workers=self.nworkers,
+                     queued=self.queue.qsize(),
+                     busy=busy,
+                     processed=processed,
+                     wait_mean=waits and sum( waits ) / len( waits ) or 0.0,
+                     wait_max=waits and max( waits ) or 0.0,
+                     runtime_mean=runtimes and sum( runtimes ) / len( runtimes ) or 0.0,
+                     runtime_max=runtimes and max( runtimes ) or 0.0 )
+
+
+class WorkQueue( object ):
+    """
+    A runner's work queue - routes each ( method, arg ) item put on it to the
+    worker pool for that kind of work (see ``WORK_POOL_BY_METHOD``).
+    """
+
+    def __init__( self, runner_name, pools ):
+        self.runner_name = runner_name
+        self.pools = pools
+        self.__last_gauge_log = time.time()
+
+    def put( self, item ):
+        method, arg = item
+        pool_name = WORK_POOL_BY_METHOD.get( getattr( method, '__name__', None ), DEFAULT_WORK_POOL )
+        self.pools[ pool_name ].put( method, arg )
+        if time.time() - self.__last_gauge_log > WORK_POOL_GAUGE_LOG_INTERVAL:
+            self.__last_gauge_log = time.time()
+            self.log_gauges()
+
+    def gauges( self ):
+        rval = odict()
+        for name, pool in self.pools.items():
+            rval[ name ] = pool.gauges()
+        return rval
+
+    def log_gauges( self ):
+        for name, gauges in self.gauges().items():
+            log.debug( "%s %s workers: %d queued, %d/%d busy, %d processed, wait mean/max %.2f/%.2fs, run mean/max %.2f/%.2fs" %
+                       ( self.runner_name, name, gauges[ 'queued' ], gauges[ 'busy' ], gauges[ 'workers' ], gauges[ 'processed' ],
+                         gauges[ 'wait_mean' ], gauges[ 'wait_max' ], gauges[ 'runtime_mean' ], gauges[ 'runtime_max' ] ) )
+
+
 class BaseJobRunner( object ):
-    DEFAULT_SPECS = dict( recheck_missing_job_retries=dict( map=int, valid=lambda x: x >= 0, default=0 ) )
+    DEFAULT_SPECS = dict( recheck_missing_job_retries=dict( map=int, valid=lambda x: x >= 0, default=0 ),
+                          # Number of threads finishing and failing jobs, the
+                          # plugin's "workers" threads submit jobs. The
+                          # finish pool defaults to the same size.
+                          finish_workers=dict( map=int, valid=lambda x: int( x ) > 0, default=None ),
+                          fail_workers=dict( map=int, valid=lambda x: int( x ) > 0, default=1 ) )
 
     def __init__( self, app, nworkers, **kwargs ):
         """Start the job runner
@@ -62,24 +168,41 @@ class BaseJobRunner( object ):
             log.debug( 'Loading %s with params: %s', self.runner_name, kwargs )
         self.runner_params = RunnerParams( specs=runner_param_specs, params=kwargs )
         self.runner_state_handlers = build_state_handlers()
+        # Heap of ( due time, sequence, method, arg ) work to put on the work
+        # queue later, see defer()
+        self.deferred_work = []
+        self.deferred_work_sequence = itertools.count()
+        self.deferred_work_condition = threading.Condition()
+        self.deferred_work_thread = None
+        self.deferred_work_stopped = False
 
     def _init_worker_threads(self):
-        """Start ``nworkers`` worker threads.
+        """Start the worker pools - ``nworkers`` threads submitting jobs and
+        the ``finish_workers`` and ``fail_workers`` runner params threads
+        finishing and failing them.
         """
-        self.work_queue = Queue()
+        pool_sizes = dict( submit=self.nworkers,
+                           finish=self.runner_params.finish_workers or self.nworkers,
+                           fail=self.runner_params.fail_workers )
+        pools = odict()
         self.work_threads = []
-        log.debug('Starting %s %s workers' % (self.nworkers, self.runner_name))
-        for i in range(self.nworkers):
-            worker = threading.Thread( name="%s.work_thread-%d" % (self.runner_name, i), target=self.run_next )
-            worker.setDaemon( True )
-            worker.start()
-            self.work_threads.append( worker )
-
-    def run_next(self):
-        """Run the next item in the work queue (a job waiting to run)
+        for name in WORK_POOLS:
+            pool = pools[ name ] = WorkerPool( name, pool_sizes[ name ] )
+            log.debug('Starting %s %s %s workers' % (pool.nworkers, self.runner_name, name))
+            for i in range(pool.nworkers):
+                worker = threading.Thread( name="%s.%s_work_thread-%d" % (self.runner_name, name, i), target=self.run_next, args=( pool, ) )
+                worker.setDaemon( True )
+                worker.start()
+                pool.threads.append( worker )
+                self.work_threads.append( worker )
+        self.work_queue = WorkQueue( self.runner_name, pools )
+
+    def run_next(self, pool):
+        """Run the next item in the given pool's queue (e.g. a job waiting to
+        run or to be finished)
         """
         while 1:
-            ( method, arg ) = self.work_queue.get()
+            ( method, arg ) = pool.get()
             if method is STOP_SIGNAL:
                 return
             # id and name are collected first so that the call of method() is the last exception.
@@ -92,10 +215,13 @@ class BaseJobRunner( object ):
                 name = method.__name__
             except:
                 name = 'unknown'
+            start = time.time()
             try:
                 method(arg)
             except:
                 log.exception( "(%s) Unhandled exception calling %s" % ( job_id, name ) )
+            finally:
+                pool.done( time.time() - start )
 
     # Causes a runner's `queue_job` method to be called from a worker thread
     def put(self, job_wrapper):
@@ -110,12 +236,53 @@ class BaseJobRunner( object ):
     def mark_as_queued(self, job_wrapper):
         self.work_queue.put( ( self.queue_job, job_wrapper ) )
 
+    def defer( self, delay, method, arg ):
+        """Put ``( method, arg )`` on the work queue in ``delay`` seconds -
+        rather than have a worker thread sleep until then.
+        """
+        with self.deferred_work_condition:
+            heapq.heappush( self.deferred_work, ( time.time() + delay, self.deferred_work_sequence.next(), method, arg ) )
+            if self.deferred_work_thread is None:
+                self.deferred_work_thread = threading.Thread( name="%s.deferred_work_thread" % self.runner_name, target=self.__queue_deferred_work )
+                self.deferred_work_thread.setDaemon( True )
+                self.deferred_work_thread.start()
+            self.deferred_work_condition.notify()
+
+    def __queue_deferred_work( self ):
+        while True:
+            with self.deferred_work_condition:
+                while not self.deferred_work_stopped:
+                    timeout = None
+                    if self.deferred_work:
+                        timeout = self.deferred_work[ 0 ][ 0 ] - time.time()
+                        if timeout <= 0:
+                            break
+                    self.deferred_work_condition.wait( timeout )
+                if self.deferred_work_stopped:
+                    return
+                ( due, sequence, method, arg ) = heapq.heappop( self.deferred_work )
+            self.work_queue.put( ( method, arg ) )
+
+    def finish_deferred( self, deferred_finish ):
+        """Finish a job whose finishing was postponed by
+        ``JobWrapper.finish`` until its outputs are visible.
+        """
+        try:
+            deferred_finish()
+        except:
+            log.exception( "(%s) Job wrapper finish method failed" % deferred_finish.get_id_tag() )
+            deferred_finish.job_wrapper.fail( "Unable to finish job", exception=True )
+
     def shutdown( self ):
         """Attempts to gracefully shut down the worker threads
         """
+        with self.deferred_work_condition:
+            self.deferred_work_stopped = True
+            self.deferred_work_condition.notify()
         log.info( "%s: Sending stop signal to %s worker threads" % ( self.runner_name, len( self.work_threads ) ) )
-        for i in range( len( self.work_threads ) ):
-            self.work_queue.put( ( STOP_SIGNAL, None ) )
+        for pool in self.work_queue.pools.values():
+            for i in range( len( pool.threads ) ):
+                pool.put( STOP_SIGNAL, None )
 
     # Most runners should override the legacy URL handler methods and destination param method
     def url_to_destination(self, url):
@@ -527,21 +694,20 @@ class AsynchronousJobRunner( BaseJobRunner ):
         # To ensure that files below are readable, ownership must be reclaimed first
         job_state.job_wrapper.reclaim_ownership()
 
-        # wait for the files to appear
-        which_try = 0
-        while which_try < (self.app.config.retry_job_output_collection + 1):
-            try:
-                stdout = shrink_stream_by_size( file( job_state.output_file, "r" ), DATABASE_MAX_STRING_SIZE, join_by="\n..\n", left_larger=True, beginning_on_size_error=True )
-                stderr = shrink_stream_by_size( file( job_state.error_file, "r" ), DATABASE_MAX_STRING_SIZE, join_by="\n..\n", left_larger=True, beginning_on_size_error=True )
-                which_try = (self.app.config.retry_job_output_collection + 1)
-            except Exception, e:
-                if which_try == self.app.config.retry_job_output_collection:
-                    stdout = ''
-                    stderr = 'Job output not returned from cluster'
-                    log.error( '(%s/%s) %s: %s' % ( galaxy_id_tag, external_job_id, stderr, str( e ) ) )
-                else:
-                    time.sleep(1)
-                which_try += 1
+        try:
+            stdout = shrink_stream_by_size( file( job_state.output_file, "r" ), DATABASE_MAX_STRING_SIZE, join_by="\n..\n", left_larger=True, beginning_on_size_error=True )
+            stderr = shrink_stream_by_size( file( job_state.error_file, "r" ), DATABASE_MAX_STRING_SIZE, join_by="\n..\n", left_larger=True, beginning_on_size_error=True )
+        except Exception, e:
+            output_collection_attempt = getattr( job_state, "output_collection_attempt", 0 )
+            if output_collection_attempt < self.app.config.retry_job_output_collection:
+                # wait for the files to appear - try again in a second rather
+                # than holding up this worker thread
+                job_state.output_collection_attempt = output_collection_attempt + 1
+                self.defer( 1, self.finish_job, job_state )
+                return
+            stdout = ''
+            stderr = 'Job output not returned from cluster'
+            log.error( '(%s/%s) %s: %s' % ( galaxy_id_tag, external_job_id, stderr, str( e ) ) )
 
         try:
             # This should be an 8-bit exit code, but read ahead anyway:
@@ -13,9 +13,10 @@ def choose_one( rule_helper, job, destination_ids, hash_by="job" ):
     return rule_helper.choose_one( destination_id_list, hash_value=job_hash )
 
 
-def burst( rule_helper, job, from_destination_ids, to_destination_id, num_jobs, job_states=None):
+def burst( rule_helper, job, from_destination_ids, to_destination_id, num_jobs, job_states=None, strict=False ):
     from_destination_ids = util.listify( from_destination_ids )
-    if rule_helper.should_burst( from_destination_ids, num_jobs=num_jobs, job_states=job_states ):
+    strict = util.asbool( strict )
+    if rule_helper.should_burst( from_destination_ids, num_jobs=num_jobs, job_states=job_states, strict=strict ):
         return to_destination_id
     else:
         return from_destination_ids[ 0 ]
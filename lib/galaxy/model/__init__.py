@@ -41,8 +41,10 @@ from galaxy.web.form_builder import (AddressField, CheckboxField, HistoryField,
         WorkflowMappingField)
 from sqlalchemy.orm import object_session
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql.expression import func
-from sqlalchemy import not_
+from sqlalchemy import and_, exists, not_, or_, select
 
 log = logging.getLogger( __name__ )
 
@@ -899,16 +901,34 @@ class History( object, Dictifiable, UsesAnnotations, HasName ):
     def empty( self ):
         return self.hid_counter == 1
 
-    def _next_hid( self ):
+    def _next_hid( self, n=1 ):
         # this is overriden in mapping.py db_next_hid() method
-        if len( self.datasets ) == 0:
-            return 1
-        else:
-            last_hid = 0
-            for dataset in self.datasets:
-                if dataset.hid > last_hid:
-                    last_hid = dataset.hid
-            return last_hid + 1
+        # Like it, reserve n hids by advancing hid_counter past them.
+        next_hid = self.hid_counter or 1
+        for dataset in self.datasets:
+            if dataset.hid >= next_hid:
+                next_hid = dataset.hid + 1
+        self.hid_counter = next_hid + n
+        return next_hid
+
+    def reserve_hids( self, n ):
+        """
+        Reserve a contiguous block of `n` hids at once, the reserved hids are
+        assigned to the next datasets and dataset collections added to this
+        history. Only reserve as many hids as will be used - unused hids are
+        skipped.
+        """
+        if n < 1:
+            return
+        start = self._next_hid( n=n )
+        # Stored in reverse so hids can be popped in order.
+        self._reserved_hids = range( start + n - 1, start - 1, -1 )
+
+    def __pop_next_hid( self ):
+        reserved_hids = getattr( self, '_reserved_hids', None )
+        if reserved_hids:
+            return reserved_hids.pop()
+        return self._next_hid()
 
     def add_galaxy_session( self, galaxy_session, association=None ):
         if association is None:
@@ -931,10 +951,10 @@ class History( object, Dictifiable, UsesAnnotations, HasName ):
                     break
             else:
                 if set_hid:
-                    dataset.hid = self._next_hid()
+                    dataset.hid = self.__pop_next_hid()
         else:
             if set_hid:
-                dataset.hid = self._next_hid()
+                dataset.hid = self.__pop_next_hid()
         if quota and self.user:
             self.user.total_disk_usage += dataset.quota_amount( self.user )
         dataset.history = self
@@ -943,9 +963,23 @@ class History( object, Dictifiable, UsesAnnotations, HasName ):
         self.datasets.append( dataset )
         return dataset
 
+    def add_datasets( self, sa_session, datasets, parent_id=None, genome_build=None, set_hid=True, quota=True, flush=False ):
+        """ Version of add_dataset above that reserves the hids of all the
+        datasets at once, minimizing database interactions (and the time the
+        history is locked) when adding many datasets to a history.
+        """
+        if set_hid and not parent_id and len( datasets ) > 1:
+            self.reserve_hids( len( datasets ) )
+        for dataset in datasets:
+            self.add_dataset( dataset, parent_id=parent_id, genome_build=genome_build, set_hid=set_hid, quota=quota )
+            sa_session.add( dataset )
+        if flush:
+            sa_session.flush()
+        return datasets
+
     def add_dataset_collection( self, history_dataset_collection, set_hid=True ):
         if set_hid:
-            history_dataset_collection.hid = self._next_hid()
+            history_dataset_collection.hid = self.__pop_next_hid()
         history_dataset_collection.history = self
         # TODO: quota?
         self.dataset_collections.append( history_dataset_collection )
@@ -983,7 +1017,12 @@ class History( object, Dictifiable, UsesAnnotations, HasName ):
             hdas = self.datasets
         else:
             hdas = self.active_datasets
+        orm_copy_hda_ids = self.__hda_ids_requiring_orm_copy( db_session, hdas )
+        bulk_copy_hdas = [ hda for hda in hdas if hda.id not in orm_copy_hda_ids ]
+        self.__bulk_copy_hdas( db_session, bulk_copy_hdas, new_history, target_user, quota )
         for hda in hdas:
+            if hda.id not in orm_copy_hda_ids:
+                continue
             # Copy HDA.
             new_hda = hda.copy( copy_children=True )
             new_history.add_dataset( new_hda, set_hid = False, quota=quota )
@@ -1007,8 +1046,128 @@ class History( object, Dictifiable, UsesAnnotations, HasName ):
         new_history.hid_counter = self.hid_counter
         db_session.add( new_history )
         db_session.flush()
+        if bulk_copy_hdas:
+            # Datasets copied in bulk are not in the loaded collections.
+            db_session.expire( new_history )
         return new_history
 
+    def __hda_ids_requiring_orm_copy( self, db_session, hdas ):
+        """
+        Return the ids of the HDAs (of this history) in ``hdas`` that can't
+        simply be cloned row by row and must be copied with
+        HistoryDatasetAssociation.copy - those with metadata files (which are
+        copied as well), children or peeks that must be regenerated, and those
+        whose dataset's (total) size hasn't been set yet.
+        """
+        hda_table = HistoryDatasetAssociation.table
+        ids = set()
+        for hda in hdas:
+            if hda.parent_id is not None or not hda.datatype.copy_safe_peek:
+                ids.add( hda.id )
+        metadata_file_table = MetadataFile.table
+        query = db_session.query( metadata_file_table.c.hda_id ).filter( and_(
+            metadata_file_table.c.hda_id == hda_table.c.id,
+            hda_table.c.history_id == self.id ) )
+        ids.update( [ row[ 0 ] for row in query ] )
+        child_table = hda_table.alias()
+        query = db_session.query( child_table.c.parent_id ).filter( and_(
+            child_table.c.parent_id == hda_table.c.id,
+            hda_table.c.history_id == self.id ) )
+        ids.update( [ row[ 0 ] for row in query ] )
+        dataset_table = Dataset.table
+        query = db_session.query( hda_table.c.id ).filter( and_(
+            hda_table.c.dataset_id == dataset_table.c.id,
+            hda_table.c.history_id == self.id,
+            or_( dataset_table.c.file_size == None, dataset_table.c.total_size == None ) ) )
+        ids.update( [ row[ 0 ] for row in query ] )
+        return ids
+
+    def __bulk_quota_amount( self, db_session, hdas, target_user ):
+        """
+        Return the sum of HistoryDatasetAssociation.quota_amount( target_user )
+        for ``hdas`` (without children and with their datasets' total size
+        set, see __hda_ids_requiring_orm_copy) with a single query.
+        """
+        hda_table = HistoryDatasetAssociation.table
+        dataset_table = Dataset.table
+        ldda_table = LibraryDatasetDatasetAssociation.table
+        owned_hda_table = hda_table.alias()
+        history_table = History.table
+        # Datasets in a library or that target_user already has another
+        # (unpurged) instance of don't count towards the quota.
+        in_library = exists( [ ldda_table.c.id ], ldda_table.c.dataset_id == dataset_table.c.id )
+        owned = exists( [ owned_hda_table.c.id ], and_(
+            owned_hda_table.c.dataset_id == dataset_table.c.id,
+            owned_hda_table.c.id != hda_table.c.id,
+            not_( owned_hda_table.c.purged ),
+            owned_hda_table.c.history_id == history_table.c.id,
+            history_table.c.user_id == target_user.id ) )
+        # Count each dataset once - HistoryDatasetAssociation.copy would only
+        # charge the first of several HDAs of a dataset, the target user
+        # owns an instance after that.
+        datasets = select( [ dataset_table.c.id, dataset_table.c.total_size ], and_(
+            hda_table.c.dataset_id == dataset_table.c.id,
+            hda_table.c.id.in_( [ hda.id for hda in hdas ] ),
+            not_( hda_table.c.purged ),
+            not_( dataset_table.c.purged ),
+            not_( in_library ),
+            not_( owned ) ), distinct=True ).alias( "quota_dataset" )
+        return db_session.query( func.sum( datasets.c.total_size ) ).scalar() or 0
+
+    def __bulk_copy_hdas( self, db_session, hdas, new_history, target_user, quota ):
+        """
+        Copy ``hdas`` (of this history) to ``new_history`` like
+        HistoryDatasetAssociation.copy would - but cloning their rows and
+        those of their annotations with a few bulk statements rather than
+        several flushes per dataset.
+        """
+        if not hdas:
+            return
+        if quota and target_user:
+            target_user.total_disk_usage += self.__bulk_quota_amount( db_session, hdas, target_user )
+        hda_table = HistoryDatasetAssociation.table
+        hda_ids = set( [ hda.id for hda in hdas ] )
+        new_rows = []
+        for row in db_session.execute( hda_table.select().where( hda_table.c.history_id == self.id ).order_by( hda_table.c.id ) ):
+            if row[ hda_table.c.id ] not in hda_ids:
+                continue
+            new_row = dict( [ ( column.key, row[ column ] ) for column in hda_table.c ] )
+            for key in [ "id", "create_time", "update_time" ]:
+                del new_row[ key ]
+            # Same attributes HistoryDatasetAssociation.copy leaves unset.
+            for key in [ "copied_from_library_dataset_dataset_association_id", "parent_id", "designation",
+                         "hidden_beneath_collection_instance_id", "extended_metadata_id" ]:
+                new_row[ key ] = None
+            new_row[ "history_id" ] = new_history.id
+            new_row[ "copied_from_history_dataset_association_id" ] = row[ hda_table.c.id ]
+            new_rows.append( new_row )
+        db_session.execute( hda_table.insert(), new_rows )
+
+        # Copy annotations.
+        if not self.user or not target_user:
+            return
+        query = db_session.query( hda_table.c.id, hda_table.c.copied_from_history_dataset_association_id ).filter(
+            hda_table.c.history_id == new_history.id )
+        new_hda_ids = dict( [ ( row[ 1 ], row[ 0 ] ) for row in query ] )
+        annotation_table = HistoryDatasetAssociationAnnotationAssociation.table
+        query = db_session.query( annotation_table.c.history_dataset_association_id, annotation_table.c.annotation ).filter( and_(
+            annotation_table.c.history_dataset_association_id == hda_table.c.id,
+            hda_table.c.history_id == self.id,
+            annotation_table.c.user_id == self.user.id ) ).order_by( annotation_table.c.id )
+        new_annotation_rows = []
+        annotated_hda_ids = set()
+        for hda_id, annotation in query:
+            if hda_id not in hda_ids or hda_id in annotated_hda_ids or not annotation:
+                continue
+            annotated_hda_ids.add( hda_id )
+            new_annotation_rows.append( dict(
+                history_dataset_association_id=new_hda_ids[ hda_id ],
+                user_id=target_user.id,
+                annotation=annotation,
+            ) )
+        if new_annotation_rows:
+            db_session.execute( annotation_table.insert(), new_annotation_rows )
+
     @property
     def activatable_datasets( self ):
         # This needs to be a list
@@ -2641,19 +2800,126 @@ class DatasetCollection( object, Dictifiable, UsesAnnotations ):
 
     @property
     def dataset_instances( self ):
-        instances = []
+        return [ element.dataset_instance for identifiers, element in self.flattened_elements() ]
+
+    def flattened_elements( self, depth=None ):
+        """ Return ( identifiers, element ) pairs for the elements ``depth``
+        levels down this (possibly nested) collection - by default the
+        elements holding its datasets - in order. ``identifiers`` are the
+        element identifiers on the path from this collection to the element.
+
+        Collections are immutable once persisted, so rather than lazy loading
+        every nested collection and dataset this is loaded with a query for
+        the elements and one for each type of object they hold, and cached.
+        """
+        if depth is None:
+            depth = len( self.collection_type.split( ":" ) )
+        db_session = object_session( self )
+        if db_session is None or self.id is None or self.__has_pending_elements():
+            return self.__walk_elements( depth, () )
+        flattened_elements = self.__dict__.setdefault( "_flattened_elements", {} )
+        if depth not in flattened_elements:
+            flattened_elements[ depth ] = self.__query_elements( db_session, depth )
+        return flattened_elements[ depth ]
+
+    def __has_pending_elements( self ):
+        # Only check elements already loaded, the collection is being built.
+        return "elements" in self.__dict__ and [ e for e in self.elements if e.id is None ]
+
+    def __walk_elements( self, depth, identifiers ):
+        elements = []
         for element in self.elements:
-            if element.is_collection:
-                instances.extend( element.child_collection.dataset_instances )
+            element_identifiers = identifiers + ( element.element_identifier, )
+            if depth > 1:
+                elements.extend( element.child_collection.__walk_elements( depth - 1, element_identifiers ) )
             else:
-                instance = element.dataset_instance
-                instances.append( instance )
-        return instances
+                elements.append( ( element_identifiers, element ) )
+        return elements
+
+    def __path_criteria( self, levels ):
+        # levels are aliases of the element table (or their columns), one
+        # per level of nesting, joined from this collection down.
+        path_criteria = [ levels[ 0 ].dataset_collection_id == self.id ]
+        for parent, child in zip( levels[ :-1 ], levels[ 1: ] ):
+            path_criteria.append( child.dataset_collection_id == parent.child_collection_id )
+        return path_criteria
+
+    def __query_elements( self, db_session, depth ):
+        levels = [ aliased( DatasetCollectionElement ) for i in range( depth ) ]
+        path_criteria = self.__path_criteria( levels )
+        element = levels[ -1 ]
+        query = db_session.query( element, *[ level.element_identifier for level in levels ] )
+        query = query.filter( and_( *path_criteria ) ).order_by( *[ level.element_index for level in levels ] )
+        elements = [ ( tuple( row[ 1: ] ), row[ 0 ] ) for row in query ]
+        # Load the objects held by these elements at once and set them on the
+        # elements so accessing them does not issue a query per element.
+        for attribute, model_class in ( ( "hda", HistoryDatasetAssociation ),
+                                        ( "ldda", LibraryDatasetDatasetAssociation ),
+                                        ( "child_collection", DatasetCollection ) ):
+            id_attribute = "%s_id" % attribute
+            unloaded = [ e for identifiers, e in elements if getattr( e, id_attribute ) is not None and attribute not in e.__dict__ ]
+            if not unloaded:
+                continue
+            query = db_session.query( model_class ).filter( and_( getattr( element, id_attribute ) == model_class.id, *path_criteria ) )
+            objects = dict( [ ( obj.id, obj ) for obj in query ] )
+            for e in unloaded:
+                set_committed_value( e, attribute, objects.get( getattr( e, id_attribute ) ) )
+        return elements
+
+    # A collection is in the first of these states any of its datasets is in
+    # - so it is reported as running until all its datasets are finished and
+    # then in error if any of them failed - and 'ok' otherwise.
+    state_precedence = ( Dataset.states.RUNNING,
+                         Dataset.states.SETTING_METADATA,
+                         Dataset.states.QUEUED,
+                         Dataset.states.UPLOAD,
+                         Dataset.states.NEW,
+                         Dataset.states.PAUSED,
+                         Dataset.states.ERROR,
+                         Dataset.states.FAILED_METADATA )
+
+    @property
+    def dataset_state_counts( self ):
+        """ Return a dictionary of the number of datasets in this (possibly
+        nested) collection in each state. For persisted collections this is
+        computed with a single aggregate query rather than by loading every
+        element and dataset, it is not cached as dataset states change.
+        """
+        db_session = object_session( self )
+        if db_session is None or self.id is None or self.__has_pending_elements():
+            counts = {}
+            for dataset_instance in self.dataset_instances:
+                counts[ dataset_instance.state ] = counts.get( dataset_instance.state, 0 ) + 1
+            return counts
+        depth = len( self.collection_type.split( ":" ) )
+        levels = [ DatasetCollectionElement.table.alias() for i in range( depth ) ]
+        element = levels[ -1 ]
+        hda = HistoryDatasetAssociation.table.alias()
+        hda_dataset = Dataset.table.alias()
+        ldda = LibraryDatasetDatasetAssociation.table.alias()
+        ldda_dataset = Dataset.table.alias()
+        # Elements hold either an hda or an ldda, whose state overrides that
+        # of its dataset when set.
+        state = func.coalesce( hda.c._state, hda_dataset.c.state, ldda.c._state, ldda_dataset.c.state )
+        elements = element.outerjoin( hda, element.c.hda_id == hda.c.id ) \
+                          .outerjoin( hda_dataset, hda.c.dataset_id == hda_dataset.c.id ) \
+                          .outerjoin( ldda, element.c.ldda_id == ldda.c.id ) \
+                          .outerjoin( ldda_dataset, ldda.c.dataset_id == ldda_dataset.c.id )
+        query = select( [ state, func.count() ],
+                        and_( *self.__path_criteria( [ level.c for level in levels ] ) ),
+                        from_obj=[ elements ] + levels[ :-1 ] ).group_by( state )
+        return dict( [ ( row[ 0 ], row[ 1 ] ) for row in db_session.execute( query ) ] )
 
     @property
     def state( self ):
-        # TODO: DatasetCollection state handling...
-        return 'ok'
+        return self.state_from_counts( self.dataset_state_counts )
+
+    @classmethod
+    def state_from_counts( cls, dataset_state_counts ):
+        for state in cls.state_precedence:
+            if dataset_state_counts.get( state ):
+                return state
+        return Dataset.states.OK
 
     def validate( self ):
         if self.collection_type is None:
@@ -2705,11 +2971,15 @@ class DatasetCollectionInstance( object, HasName ):
         return self.get_display_name()
 
     def _base_to_dict( self, view ):
+        dataset_state_counts = self.collection.dataset_state_counts
         return dict(
             id=self.id,
             name=self.name,
             collection_type=self.collection.collection_type,
             type="collection",  # contents type (distinguished from file or folder (in case of library))
+            state=DatasetCollection.state_from_counts( dataset_state_counts ),
+            dataset_state_counts=dataset_state_counts,
+            dataset_count=sum( dataset_state_counts.values() ),
         )
 
     def set_from_dict( self, new_data ):
@@ -3091,8 +3361,78 @@ class StoredWorkflowMenuEntry( object ):
 
 
 class WorkflowInvocation( object, Dictifiable ):
-    dict_collection_visible_keys = ( 'id', 'update_time', 'workflow_id' )
-    dict_element_visible_keys = ( 'id', 'update_time', 'workflow_id' )
+    dict_collection_visible_keys = ( 'id', 'update_time', 'workflow_id', 'history_id', 'uuid', 'state' )
+    dict_element_visible_keys = ( 'id', 'update_time', 'workflow_id', 'history_id', 'uuid', 'state' )
+    states = Bunch(
+        NEW='new',  # Brand new workflow invocation... maybe this should be same as READY
+        READY='ready',  # Workflow ready for another iteration of scheduling.
+        SCHEDULED='scheduled',  # Workflow has been scheduled.
+        CANCELLED='cancelled',
+        FAILED='failed',
+    )
+    non_terminal_states = [ states.NEW, states.READY ]
+
+    def __init__( self ):
+        self.state = self.states.NEW
+        self.output_datasets = []
+        self.output_dataset_collections = []
+        self.input_parameters = []
+        self.step_states = []
+
+    @property
+    def active( self ):
+        """ Indicates the workflow invocation is somehow active - and in
+        particular valid actions may be performed on its
+        ``WorkflowInvocationStep``s.
+        """
+        return self.state in self.non_terminal_states
+
+    @property
+    def scheduled_step_ids( self ):
+        """ Ids of the workflow steps that have already been scheduled (i.e.
+        have one or more ``WorkflowInvocationStep``s recorded).
+        """
+        return set( [ invocation_step.workflow_step_id for invocation_step in self.steps ] )
+
+    def add_output( self, workflow_step, output_name, output_object ):
+        if isinstance( output_object, HistoryDatasetAssociation ):
+            output_assoc = WorkflowInvocationOutputDatasetAssociation()
+            output_assoc.dataset = output_object
+            self.output_datasets.append( output_assoc )
+        elif isinstance( output_object, HistoryDatasetCollectionAssociation ):
+            output_assoc = WorkflowInvocationOutputDatasetCollectionAssociation()
+            output_assoc.dataset_collection = output_object
+            self.output_dataset_collections.append( output_assoc )
+        else:
+            log.warn( "Cannot record workflow output %s of unknown type %s" % ( output_name, type( output_object ) ) )
+            return
+        output_assoc.workflow_step = workflow_step
+        output_assoc.output_name = output_name
+
+    def get_outputs( self ):
+        """ Return a dict mapping workflow step ids to dicts of recorded outputs
+        (output name to HDA or HDCA).
+        """
+        outputs = {}
+        for output_assoc in self.output_datasets:
+            outputs.setdefault( output_assoc.workflow_step_id, {} )[ output_assoc.output_name ] = output_assoc.dataset
+        for output_assoc in self.output_dataset_collections:
+            outputs.setdefault( output_assoc.workflow_step_id, {} )[ output_assoc.output_name ] = output_assoc.dataset_collection
+        return outputs
+
+    def add_input_parameter( self, name, value, type ):
+        request_to_input = WorkflowRequestInputParameter( name=name, value=value, type=type )
+        self.input_parameters.append( request_to_input )
+
+    def get_input_parameters( self, type ):
+        return dict( [ ( p.name, p.value ) for p in self.input_parameters if p.type == type ] )
+
+    def add_step_state( self, workflow_step, value ):
+        step_state = WorkflowRequestStepState( workflow_step=workflow_step, value=value )
+        self.step_states.append( step_state )
+
+    def get_step_states( self ):
+        return dict( [ ( s.workflow_step_id, s.value ) for s in self.step_states ] )
 
     def to_dict( self, view='collection', value_mapper=None ):
         rval = super( WorkflowInvocation, self ).to_dict( view=view, value_mapper=value_mapper )
@@ -3105,7 +3445,7 @@ class WorkflowInvocation( object, Dictifiable ):
 
             inputs = {}
             for step in self.steps:
-                if step.workflow_step.type == 'tool':
+                if step.workflow_step.type == 'tool' and step.job:
                     for step_input in step.workflow_step.input_connections:
                         output_step_type = step_input.output_step.type
                         if output_step_type in [ 'data_input', 'data_collection_input' ]:
@@ -3124,8 +3464,50 @@ class WorkflowInvocationStep( object, Dictifiable ):
     def to_dict( self, view='collection', value_mapper=None ):
         rval = super( WorkflowInvocationStep, self ).to_dict( view=view, value_mapper=value_mapper )
         rval['order_index'] = self.workflow_step.order_index
+        rval['state'] = self.job and self.job.state
         return rval
 
+
+class WorkflowRequestInputParameter( object, Dictifiable ):
+    """ Workflow-related parameters not tied to steps or inputs.
+    """
+    dict_collection_visible_keys = ['id', 'name', 'value', 'type']
+    types = Bunch(
+        REPLACEMENT_PARAMETERS='replacements',
+        META_PARAMETERS='meta',  # copy_inputs_to_history, etc...
+    )
+
+    def __init__( self, name=None, value=None, type=None ):
+        self.name = name
+        self.value = value
+        self.type = type
+
+
+class WorkflowRequestStepState( object, Dictifiable ):
+    """ Workflow step value parameters (runtime parameter overrides supplied
+    with the request, keyed on workflow step).
+    """
+    dict_collection_visible_keys = ['id', 'value', 'workflow_step_id']
+
+    def __init__( self, workflow_step=None, value=None ):
+        self.workflow_step = workflow_step
+        self.value = value
+
+
+class WorkflowInvocationOutputDatasetAssociation( object, Dictifiable ):
+    """ Represents links to output datasets produced while scheduling a
+    workflow invocation.
+    """
+    dict_collection_visible_keys = ['id', 'workflow_invocation_id', 'workflow_step_id', 'dataset_id', 'output_name']
+
+
+class WorkflowInvocationOutputDatasetCollectionAssociation( object, Dictifiable ):
+    """ Represents links to output dataset collections produced while
+    scheduling a workflow invocation.
+    """
+    dict_collection_visible_keys = ['id', 'workflow_invocation_id', 'workflow_step_id', 'dataset_collection_id', 'output_name']
+
+
 class MetadataFile( object ):
 
     def __init__( self, dataset=None, name=None ):
@@ -3161,6 +3543,12 @@ class MetadataFile( object ):
             # Return filename inside hashed directory
             return os.path.abspath( os.path.join( path, "metadata_%d.dat" % self.id ) )
 
+    @property
+    def file_name_to_overwrite( self ):
+        # Persisted metadata files are overwritten in place (see
+        # galaxy.datatypes.metadata.MetadataTempFile).
+        return self.file_name
+
 
 class FormDefinition( object, Dictifiable ):
     # The following form_builder classes are supported by the FormDefinition class.
@@ -5,6 +5,7 @@ are encapsulated here.
 
 import logging
 import pkg_resources
+import time
 
 from sqlalchemy import and_, asc, Boolean, Column, DateTime, desc, ForeignKey, Integer, MetaData, not_, Numeric, select, String, Table, TEXT, Unicode, UniqueConstraint
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -73,7 +74,7 @@ model.History.table = Table( "history", metadata,
     Column( "create_time", DateTime, default=now ),
     Column( "update_time", DateTime, index=True, default=now, onupdate=now ),
     Column( "user_id", Integer, ForeignKey( "galaxy_user.id" ), index=True ),
-    Column( "name", TrimmedString( 255 ) ),
+    Column( "name", TrimmedString( 255 ), index=True ),
     Column( "hid_counter", Integer, default=1 ),
     Column( "deleted", Boolean, index=True, default=False ),
     Column( "purged", Boolean, index=True, default=False ),
@@ -99,7 +100,7 @@ model.HistoryDatasetAssociation.table = Table( "history_dataset_association", me
     Column( "copied_from_history_dataset_association_id", Integer, ForeignKey( "history_dataset_association.id" ), nullable=True ),
     Column( "copied_from_library_dataset_dataset_association_id", Integer, ForeignKey( "library_dataset_dataset_association.id" ), nullable=True ),
     Column( "hid", Integer ),
-    Column( "name", TrimmedString( 255 ) ),
+    Column( "name", TrimmedString( 255 ), index=True ),
     Column( "info", TrimmedString( 255 ) ),
     Column( "blurb", TrimmedString( 255 ) ),
     Column( "peek" , TEXT ),
@@ -728,7 +729,12 @@ model.WorkflowInvocation.table = Table( "workflow_invocation", metadata,
     Column( "id", Integer, primary_key=True ),
     Column( "create_time", DateTime, default=now ),
     Column( "update_time", DateTime, default=now, onupdate=now ),
-    Column( "workflow_id", Integer, ForeignKey( "workflow.id" ), index=True, nullable=False )
+    Column( "workflow_id", Integer, ForeignKey( "workflow.id" ), index=True, nullable=False ),
+    Column( "state", TrimmedString( 64 ), index=True ),
+    Column( "scheduler", TrimmedString( 255 ), index=True ),
+    Column( "handler", TrimmedString( 255 ), index=True ),
+    Column( 'uuid', UUIDType() ),
+    Column( "history_id", Integer, ForeignKey( "history.id" ), index=True )
     )
 
 model.WorkflowInvocationStep.table = Table( "workflow_invocation_step", metadata,
@@ -740,6 +746,37 @@ model.WorkflowInvocationStep.table = Table( "workflow_invocation_step", metadata
     Column( "job_id",  Integer, ForeignKey( "job.id" ), index=True, nullable=True )
     )
 
+model.WorkflowRequestInputParameter.table = Table( "workflow_request_input_parameters", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id", onupdate="CASCADE", ondelete="CASCADE" ), index=True ),
+    Column( "name", Unicode( 255 ) ),
+    Column( "value", TEXT ),
+    Column( "type", Unicode( 255 ) ),
+    )
+
+model.WorkflowRequestStepState.table = Table( "workflow_request_step_states", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id", onupdate="CASCADE", ondelete="CASCADE" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "value", JSONType ),
+    )
+
+model.WorkflowInvocationOutputDatasetAssociation.table = Table( "workflow_invocation_output_dataset_association", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "dataset_id", Integer, ForeignKey( "history_dataset_association.id" ), index=True ),
+    Column( "output_name", String( 255 ), nullable=True ),
+    )
+
+model.WorkflowInvocationOutputDatasetCollectionAssociation.table = Table( "workflow_invocation_output_dataset_collection_association", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "dataset_collection_id", Integer, ForeignKey( "history_dataset_collection_association.id" ), index=True ),
+    Column( "output_name", String( 255 ), nullable=True ),
+    )
+
 model.StoredWorkflowUserShareAssociation.table = Table( "stored_workflow_user_share_connection", metadata,
     Column( "id", Integer, primary_key=True ),
     Column( "stored_workflow_id", Integer, ForeignKey( "stored_workflow.id" ), index=True ),
@@ -1968,6 +2005,11 @@ mapper( model.StoredWorkflowMenuEntry, model.StoredWorkflowMenuEntry.table,
 
 mapper( model.WorkflowInvocation, model.WorkflowInvocation.table,
     properties=dict(
+        history=relation( model.History ),
+        input_parameters=relation( model.WorkflowRequestInputParameter, backref='workflow_invocation' ),
+        step_states=relation( model.WorkflowRequestStepState, backref='workflow_invocation' ),
+        output_datasets=relation( model.WorkflowInvocationOutputDatasetAssociation, backref='workflow_invocation' ),
+        output_dataset_collections=relation( model.WorkflowInvocationOutputDatasetCollectionAssociation, backref='workflow_invocation' ),
         steps=relation( model.WorkflowInvocationStep, backref='workflow_invocation', lazy=False ),
         workflow=relation( model.Workflow ) ) )
 
@@ -1976,6 +2018,25 @@ mapper( model.WorkflowInvocationStep, model.WorkflowInvocationStep.table,
         workflow_step = relation( model.WorkflowStep ),
         job = relation( model.Job, backref=backref( 'workflow_invocation_step', uselist=False ) ) ) )
 
+mapper( model.WorkflowRequestInputParameter, model.WorkflowRequestInputParameter.table )
+
+mapper( model.WorkflowRequestStepState, model.WorkflowRequestStepState.table,
+    properties=dict(
+        workflow_step=relation( model.WorkflowStep ),
+    ) )
+
+mapper( model.WorkflowInvocationOutputDatasetAssociation, model.WorkflowInvocationOutputDatasetAssociation.table,
+    properties=dict(
+        workflow_step=relation( model.WorkflowStep ),
+        dataset=relation( model.HistoryDatasetAssociation )
+    ) )
+
+mapper( model.WorkflowInvocationOutputDatasetCollectionAssociation, model.WorkflowInvocationOutputDatasetCollectionAssociation.table,
+    properties=dict(
+        workflow_step=relation( model.WorkflowStep ),
+        dataset_collection=relation( model.HistoryDatasetCollectionAssociation )
+    ) )
+
 mapper( model.MetadataFile, model.MetadataFile.table,
     properties=dict( history_dataset=relation( model.HistoryDatasetAssociation ), library_dataset=relation( model.LibraryDatasetDatasetAssociation ) ) )
 
@@ -2135,33 +2196,43 @@ class_mapper(model.HistoryDatasetCollectionAssociation).add_property( "creating_
 
 # Helper methods.
 
-def db_next_hid( self ):
+def db_next_hid( self, n=1 ):
     """
     db_next_hid( self )
 
     Override __next_hid to generate from the database in a concurrency safe way.
-    Loads the next history ID from the DB and returns it.
-    It also saves the future next_id into the DB.
+    Reserves a contiguous block of `n` history IDs by incrementing the counter
+    in the DB and returns the first of them. The counter is incremented before
+    it is read so the history row is locked only for the duration of the
+    increment - on PostgreSQL this is a single UPDATE ... RETURNING statement.
 
+    :type       n: int
+    :param      n: number of history ids to reserve
     :rtype:     int
-    :returns:   the next history id
+    :returns:   the first reserved history id
     """
     conn = object_session( self ).connection()
     table = self.table
+    start = time.time()
     trans = conn.begin()
     try:
-        next_hid = select( [table.c.hid_counter], table.c.id == self.id, for_update=True ).scalar()
-        table.update( table.c.id == self.id ).execute( hid_counter = ( next_hid + 1 ) )
+        increment = table.update( table.c.id == self.id ).values( hid_counter=( table.c.hid_counter + n ) )
+        if conn.dialect.name == 'postgresql':
+            next_hid = conn.execute( increment.returning( table.c.hid_counter ) ).scalar()
+        else:
+            conn.execute( increment )
+            next_hid = conn.execute( select( [table.c.hid_counter], table.c.id == self.id ) ).scalar()
         trans.commit()
-        return next_hid
     except:
         trans.rollback()
         raise
+    log.debug( "Reserved %d hid(s) for history %s, history row locked for %.3f ms", n, self.id, ( time.time() - start ) * 1000 )
+    return next_hid - n
 
 model.History._next_hid = db_next_hid
 
 
-def init( file_path, url, engine_options={}, create_tables=False, map_install_models=False, database_query_profiling_proxy=False, object_store=None, trace_logger=None, use_pbkdf2=True ):
+def init( file_path, url, engine_options={}, create_tables=False, map_install_models=False, database_query_profiling_proxy=False, object_store=None, trace_logger=None, use_pbkdf2=True, query_profiler=None ):
     """Connect mappings to the database"""
     # Connect dataset to the file path
     model.Dataset.file_path = file_path
@@ -2170,7 +2241,7 @@ def init( file_path, url, engine_options={}, create_tables=False, map_install_mo
     # Use PBKDF2 password hashing?
     model.User.use_pbkdf2 = use_pbkdf2
     # Load the appropriate db module
-    engine = build_engine( url, engine_options, database_query_profiling_proxy, trace_logger )
+    engine = build_engine( url, engine_options, database_query_profiling_proxy, trace_logger, query_profiler )
 
     # Connect the metadata to the database.
     metadata.bind = engine
@@ -0,0 +1,119 @@
+"""
+Migration script for workflow invocation scheduling - persists workflow
+invocation state, history, and request parameters so invocations can be
+scheduled in the background by job handlers.
+"""
+
+from sqlalchemy import *
+from sqlalchemy.orm import *
+from migrate import *
+from migrate.changeset import *
+from galaxy.model.custom_types import *
+
+import logging
+log = logging.getLogger( __name__ )
+
+metadata = MetaData()
+
+WorkflowRequestInputParameter_table = Table( "workflow_request_input_parameters", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id", onupdate="CASCADE", ondelete="CASCADE" ), index=True ),
+    Column( "name", Unicode( 255 ) ),
+    Column( "value", TEXT ),
+    Column( "type", Unicode( 255 ) ),
+)
+
+WorkflowRequestStepState_table = Table( "workflow_request_step_states", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id", onupdate="CASCADE", ondelete="CASCADE" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "value", JSONType ),
+)
+
+WorkflowInvocationOutputDatasetAssociation_table = Table( "workflow_invocation_output_dataset_association", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "dataset_id", Integer, ForeignKey( "history_dataset_association.id" ), index=True ),
+    Column( "output_name", String( 255 ), nullable=True ),
+)
+
+WorkflowInvocationOutputDatasetCollectionAssociation_table = Table( "workflow_invocation_output_dataset_collection_association", metadata,
+    Column( "id", Integer, primary_key=True ),
+    Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id" ), index=True ),
+    Column( "workflow_step_id", Integer, ForeignKey( "workflow_step.id" ) ),
+    Column( "dataset_collection_id", Integer, ForeignKey( "history_dataset_collection_association.id" ), index=True ),
+    Column( "output_name", String( 255 ), nullable=True ),
+)
+
+TABLES = [
+    WorkflowRequestInputParameter_table,
+    WorkflowRequestStepState_table,
+    WorkflowInvocationOutputDatasetAssociation_table,
+    WorkflowInvocationOutputDatasetCollectionAssociation_table,
+]
+
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    print __doc__
+    metadata.reflect()
+
+    workflow_invocation_table = Table( "workflow_invocation", metadata, autoload=True )
+    for column in __invocation_columns():
+        __add_column( column, workflow_invocation_table )
+
+    for table in TABLES:
+        __create(table)
+
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    for table in TABLES:
+        __drop(table)
+
+    workflow_invocation_table = Table( "workflow_invocation", metadata, autoload=True )
+    for column_name in [ "state", "scheduler", "handler", "uuid", "history_id" ]:
+        try:
+            getattr( workflow_invocation_table.c, column_name ).drop()
+        except Exception as e:
+            print str(e)
+            log.exception( "Dropping %s column from workflow_invocation table failed." % column_name )
+
+
+def __invocation_columns():
+    # Create fresh Column objects for each call, migrate binds them to the
+    # table they are created on.
+    return [
+        Column( "state", TrimmedString( 64 ), index=True ),
+        Column( "scheduler", TrimmedString( 255 ), index=True ),
+        Column( "handler", TrimmedString( 255 ), index=True ),
+        Column( "uuid", UUIDType(), nullable=True ),
+        Column( "history_id", Integer, ForeignKey( "history.id" ), nullable=True, index=True ),
+    ]
+
+
+def __add_column(column, table):
+    try:
+        column.create( table )
+    except Exception as e:
+        print str(e)
+        log.exception( "Adding column %s to %s table failed." % ( column.name, table.name ) )
+
+
+def __create(table):
+    try:
+        table.create()
+    except Exception as e:
+        print str(e)
+        log.exception("Creating %s table failed: %s" % (table.name, str( e ) ) )
+
+
+def __drop(table):
+    try:
+        table.drop()
+    except Exception as e:
+        print str(e)
+        log.exception("Dropping %s table failed: %s" % (table.name, str( e ) ) )
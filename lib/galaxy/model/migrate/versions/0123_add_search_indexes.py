@@ -0,0 +1,78 @@
+"""
+Migration script to add indexes for GQL searches (see galaxy.model.search) over
+the names of histories and history datasets and, on PostgreSQL, trigram indexes
+allowing "name like '%...%'" style searches to be answered without scanning the
+history, dataset, workflow and annotation tables.
+"""
+
+from sqlalchemy import *
+from sqlalchemy.orm import *
+from sqlalchemy.engine import reflection
+from migrate import *
+from migrate.changeset import *
+
+import logging
+log = logging.getLogger( __name__ )
+
+metadata = MetaData()
+
+indexes = (
+    ( "ix_history_dataset_association_name", 'history_dataset_association', 'name' ),
+    ( "ix_history_name", 'history', 'name' ),
+)
+
+# PostgreSQL only, these need the pg_trgm extension.
+trigram_indexes = (
+    ( "ix_hda_name_trgm", 'history_dataset_association', 'name' ),
+    ( "ix_ldda_name_trgm", 'library_dataset_dataset_association', 'name' ),
+    ( "ix_history_name_trgm", 'history', 'name' ),
+    ( "ix_stored_workflow_name_trgm", 'stored_workflow', 'name' ),
+    ( "ix_haa_annotation_trgm", 'history_annotation_association', 'annotation' ),
+)
+
+
+def upgrade(migrate_engine):
+    print __doc__
+    metadata.bind = migrate_engine
+    metadata.reflect()
+    insp = reflection.Inspector.from_engine(migrate_engine)
+    for ix, table, col in indexes:
+        try:
+            log.debug("Creating index '%s' on column '%s' in table '%s'" % (ix, col, table))
+            t = Table( table, metadata, autoload=True )
+            if ix not in [ins_ix.get('name', None) for ins_ix in insp.get_indexes(table)]:
+                Index( ix, t.c[col] ).create()
+        except Exception, e:
+            log.error("Unable to create index '%s': %s" % (ix, str(e)))
+
+    if migrate_engine.name not in [ 'postgresql', 'postgres' ]:
+        return
+    try:
+        migrate_engine.execute( "CREATE EXTENSION IF NOT EXISTS pg_trgm" )
+    except Exception, e:
+        log.error("Unable to enable the pg_trgm extension (requires PostgreSQL 9.1 and a user allowed to create extensions), trigram indexes will not be created: %s" % str(e))
+        return
+    for ix, table, col in trigram_indexes:
+        try:
+            log.debug("Creating trigram index '%s' on column '%s' in table '%s'" % (ix, col, table))
+            migrate_engine.execute( "CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)" % (ix, table, col) )
+        except Exception, e:
+            log.error("Unable to create index '%s': %s" % (ix, str(e)))
+
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    if migrate_engine.name in [ 'postgresql', 'postgres' ]:
+        for ix, table, col in trigram_indexes:
+            try:
+                migrate_engine.execute( "DROP INDEX IF EXISTS %s" % ix )
+            except Exception, e:
+                log.error("Unable to drop index '%s': %s" % (ix, str(e)))
+    for ix, table, col in indexes:
+        try:
+            t = Table( table, metadata, autoload=True )
+            Index( ix, t.c[col] ).drop()
+        except Exception, e:
+            log.error("Unable to drop index '%s': %s" % (ix, str(e)))
@@ -5,7 +5,7 @@ from sqlalchemy import create_engine
 from galaxy.model.orm import load_egg_for_url
 
 
-def build_engine(url, engine_options, database_query_profiling_proxy=False, trace_logger=None):
+def build_engine(url, engine_options, database_query_profiling_proxy=False, trace_logger=None, query_profiler=None):
     load_egg_for_url( url )
 
     # Should we use the logging proxy?
@@ -19,6 +19,11 @@ def build_engine(url, engine_options, database_query_profiling_proxy=False, trac
     else:
         proxy = None
 
+    # Record statements for sampled SQL profiles
+    if query_profiler:
+        from galaxy.model.orm.query_profiling import ProfilingProxy
+        proxy = ProfilingProxy( query_profiler, proxy )
+
     # Create the database engine
     engine = create_engine( url, proxy=proxy, **engine_options )
     return engine
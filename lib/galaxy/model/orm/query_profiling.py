@@ -0,0 +1,276 @@
+"""
+Structured profiling of the SQL issued while handling a unit of work (a web
+request or a job handler cycle).
+
+A `QueryProfiler` samples units of work, the `ProfilingProxy` installed on the
+database engine records each statement executed by the current thread into the
+active `QueryProfile`. Statements are grouped by shape (the SQL with literals
+and bound parameters normalized away) and by the Galaxy call site issuing them,
+so the same query repeated from one place - typically a lazy load in a loop,
+the N+1 pattern - stands out.
+"""
+import os
+import re
+import sys
+import time
+import heapq
+import random
+import logging
+import threading
+from collections import deque
+
+from galaxy.model.orm import ConnectionProxy
+
+log = logging.getLogger( __name__ )
+
+# Number of times a statement shape must be repeated from the same call site
+# within one profile to be flagged as a likely N+1 pattern.
+N_PLUS_ONE_THRESHOLD = 10
+# Number of slowest statements kept for each profile.
+SLOWEST_STATEMENTS = 10
+# Maximum number of distinct statement shapes tracked for each profile.
+MAX_STATEMENT_SHAPES = 500
+
+_STRING_LITERAL_RE = re.compile( r"'(?:[^']|'')*'" )
+_NUMBER_RE = re.compile( r"(?<![\w.])-?\d+(?:\.\d+)?\b" )
+_NAMED_PARAMETER_RE = re.compile( r"%\(\w+\)s|:\w+|%s|\$\d+" )
+_VALUE_LIST_RE = re.compile( r"\(\s*\?(?:\s*,\s*\?)*\s*\)" )
+_WHITESPACE_RE = re.compile( r"\s+" )
+
+# Statement -> shape, cleared when it reaches MAX_NORMALIZED_STATEMENTS.
+_normalized_statements = {}
+MAX_NORMALIZED_STATEMENTS = 1000
+
+wd = os.getcwd()
+# Frames from these files are not meaningful call sites.
+_IGNORED_SOURCES = [ os.path.splitext( __file__ )[ 0 ], os.sep + 'sqlalchemy' + os.sep ]
+
+
+def normalize_statement( statement ):
+    """
+    Reduce `statement` to its shape - literals and bound parameters are
+    replaced with ``?``, ``IN`` lists of any length collapse to ``(?)`` and
+    whitespace is collapsed.
+
+    >>> normalize_statement( "SELECT * FROM job WHERE id IN (%(id_1)s, %(id_2)s) AND state = 'new'" )
+    'SELECT * FROM job WHERE id IN (?) AND state = ?'
+    >>> normalize_statement( "SELECT id FROM dataset\\n  WHERE dataset.id = 42 LIMIT 1" )
+    'SELECT id FROM dataset WHERE dataset.id = ? LIMIT ?'
+    """
+    normalized = _normalized_statements.get( statement, None )
+    if normalized is None:
+        normalized = _STRING_LITERAL_RE.sub( "?", statement )
+        normalized = _NAMED_PARAMETER_RE.sub( "?", normalized )
+        normalized = _NUMBER_RE.sub( "?", normalized )
+        normalized = _VALUE_LIST_RE.sub( "(?)", normalized )
+        normalized = _WHITESPACE_RE.sub( " ", normalized ).strip()
+        if len( _normalized_statements ) >= MAX_NORMALIZED_STATEMENTS:
+            _normalized_statements.clear()
+        _normalized_statements[ statement ] = normalized
+    return normalized
+
+
+def call_site( frame=None ):
+    """
+    Return the innermost frame outside of SQLAlchemy and this module as
+    ``path:function@line`` (relative to the working directory).
+    """
+    if frame is None:
+        frame = sys._getframe( 1 )
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not [ source for source in _IGNORED_SOURCES if source in filename ]:
+            if filename.startswith( wd ):
+                filename = filename[ len( wd ): ].lstrip( os.sep )
+            return "%s:%s@%d" % ( filename, frame.f_code.co_name, frame.f_lineno )
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryProfile( object ):
+    """
+    SQL statements executed during a single unit of work.
+    """
+
+    def __init__( self, id, name, started=None ):
+        self.id = id
+        self.name = name
+        self.started = started or time.time()
+        self.duration = None
+        self.query_count = 0
+        self.query_time = 0.0
+        # ( shape, call site ) -> [ count, total time, max time, statement ]
+        self.shapes = {}
+        self.shapes_truncated = False
+        self.slowest = []
+
+    def record( self, statement, duration, site ):
+        self.query_count += 1
+        self.query_time += duration
+        shape = normalize_statement( statement )
+        key = ( shape, site )
+        stats = self.shapes.get( key, None )
+        if stats is None:
+            if len( self.shapes ) >= MAX_STATEMENT_SHAPES:
+                self.shapes_truncated = True
+            else:
+                self.shapes[ key ] = [ 1, duration, duration, statement ]
+        else:
+            stats[ 0 ] += 1
+            stats[ 1 ] += duration
+            stats[ 2 ] = max( stats[ 2 ], duration )
+        slowest_entry = ( duration, statement, site )
+        if len( self.slowest ) < SLOWEST_STATEMENTS:
+            heapq.heappush( self.slowest, slowest_entry )
+        elif duration > self.slowest[ 0 ][ 0 ]:
+            heapq.heapreplace( self.slowest, slowest_entry )
+
+    def finish( self ):
+        self.duration = time.time() - self.started
+
+    @property
+    def n_plus_one( self ):
+        """
+        Statement shapes repeated from a single call site often enough to
+        indicate an N+1 pattern, most repeated first.
+        """
+        return [ shape for shape in self.statement_shapes() if shape[ 'count' ] >= N_PLUS_ONE_THRESHOLD ]
+
+    def statement_shapes( self ):
+        shapes = []
+        for ( shape, site ), ( count, total, maximum, statement ) in self.shapes.iteritems():
+            shapes.append( dict(
+                statement=shape,
+                call_site=site,
+                count=count,
+                total_time=total,
+                max_time=maximum,
+                example=statement,
+            ) )
+        shapes.sort( key=lambda shape: ( shape[ 'count' ], shape[ 'total_time' ] ), reverse=True )
+        return shapes
+
+    def headers( self ):
+        """
+        Summary of this profile as HTTP response headers.
+        """
+        return [
+            ( 'X-Galaxy-SQL-Query-Count', str( self.query_count ) ),
+            ( 'X-Galaxy-SQL-Query-Time', "%.6f" % self.query_time ),
+            ( 'X-Galaxy-SQL-N-Plus-One', str( len( self.n_plus_one ) ) ),
+        ]
+
+    def to_dict( self, view='collection' ):
+        rval = dict(
+            id=self.id,
+            name=self.name,
+            started=self.started,
+            duration=self.duration,
+            query_count=self.query_count,
+            query_time=self.query_time,
+            n_plus_one_count=len( self.n_plus_one ),
+        )
+        if view == 'element':
+            rval[ 'n_plus_one' ] = self.n_plus_one
+            rval[ 'statements' ] = self.statement_shapes()
+            rval[ 'statements_truncated' ] = self.shapes_truncated
+            rval[ 'slowest' ] = [ dict( statement=statement, call_site=site, duration=duration )
+                                  for ( duration, statement, site ) in sorted( self.slowest, reverse=True ) ]
+        return rval
+
+
+class QueryProfiler( object ):
+    """
+    Samples units of work for SQL profiling and keeps the most recent
+    profiles. Profiles are tracked per thread, a unit of work is profiled
+    from `start` to `finish` in the thread performing it.
+    """
+
+    def __init__( self, sample_rate=1.0, keep=100, response_headers=False ):
+        self.sample_rate = sample_rate
+        self.response_headers = response_headers
+        self.recent = deque( maxlen=keep )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    @staticmethod
+    def from_config( config ):
+        if not config.database_query_profiling_sample_rate:
+            return None
+        return QueryProfiler( sample_rate=config.database_query_profiling_sample_rate,
+                              keep=config.database_query_profiling_keep,
+                              response_headers=config.database_query_profiling_headers )
+
+    def start( self, name ):
+        """
+        Begin profiling a unit of work in the current thread - if it is
+        sampled, return the new profile.
+        """
+        profile = None
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            self._lock.acquire()
+            try:
+                profile_id = self._next_id
+                self._next_id += 1
+            finally:
+                self._lock.release()
+            profile = QueryProfile( profile_id, name )
+        self._local.profile = profile
+        return profile
+
+    @property
+    def current( self ):
+        return getattr( self._local, 'profile', None )
+
+    def finish( self ):
+        """
+        Finish profiling the unit of work in the current thread and return
+        its profile (if it was sampled).
+        """
+        profile = self.current
+        self._local.profile = None
+        if profile is not None:
+            profile.finish()
+            self.recent.append( profile )
+            n_plus_one = profile.n_plus_one
+            if n_plus_one:
+                log.debug( "%s executed %d queries, %d statements repeated from a single call site (%s)",
+                           profile.name, profile.query_count, len( n_plus_one ),
+                           ", ".join( [ "%d x %s" % ( shape[ 'count' ], shape[ 'call_site' ] ) for shape in n_plus_one ] ) )
+        return profile
+
+    def get( self, id ):
+        for profile in list( self.recent ):
+            if profile.id == id:
+                return profile
+        return None
+
+
+class ProfilingProxy( ConnectionProxy ):
+    """
+    Records SQL statements into the `QueryProfile` active for the current
+    thread, optionally wrapping another proxy.
+    """
+
+    def __init__( self, profiler, proxy=None ):
+        self.profiler = profiler
+        self.proxy = proxy
+
+    def cursor_execute( self, execute, cursor, statement, parameters, context, executemany ):
+        if self.proxy is not None:
+            proxy = self.proxy
+
+            def execute_statement():
+                return proxy.cursor_execute( execute, cursor, statement, parameters, context, executemany )
+        else:
+            def execute_statement():
+                return execute( cursor, statement, parameters, context )
+        profile = self.profiler.current
+        if profile is None:
+            return execute_statement()
+        start = time.time()
+        try:
+            return execute_statement()
+        finally:
+            profile.record( statement, time.time() - start, call_site() )
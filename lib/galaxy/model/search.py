@@ -40,11 +40,16 @@ Page, PageRevision)
 from galaxy.model.tool_shed_install import ToolVersion
 
 from galaxy.util.json import dumps
-from sqlalchemy import and_
-from sqlalchemy.orm import aliased
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import aliased, class_mapper
 
 log = logging.getLogger( __name__ )
 
+# Matching rows are fetched (and yielded) this many at a time, so the caller
+# can stop reading - e.g. once a page of results is filled - without the whole
+# result set being loaded.
+RESULTS_BATCH_SIZE = 500
+
 
 class ViewField(object):
     """
@@ -131,7 +136,7 @@ class ViewQueryBaseClass(object):
 
     def get_results(self, force_query=False):
         if self.query is not None and (force_query or self.do_query):
-            for row in self.query.distinct().all():
+            for row in self._stream_query(self.query.distinct()):
                 selected = True
                 for f in self.post_filter:
                     if not f[0](row, f[1], f[2], f[3]):
@@ -139,6 +144,24 @@ class ViewQueryBaseClass(object):
                 if selected:
                     yield row
 
+    def _stream_query(self, query):
+        # Page through the results ordered by id (seeking past the last id seen
+        # rather than using an offset so each batch is an index range scan).
+        entity = query.column_descriptions[0]['type']
+        id_column = class_mapper(entity).primary_key[0]
+        query = query.order_by(id_column)
+        last_id = None
+        while True:
+            batch_query = query
+            if last_id is not None:
+                batch_query = batch_query.filter(id_column > last_id)
+            rows = batch_query.limit(RESULTS_BATCH_SIZE).all()
+            for row in rows:
+                yield row
+            if len(rows) < RESULTS_BATCH_SIZE:
+                return
+            last_id = rows[-1].id
+
 
 ##################
 #Library Dataset Searching
@@ -238,18 +261,35 @@ class LibraryFolderView(ViewQueryBaseClass):
 ##################
 #Library Dataset Searching
 ##################
-def library_dataset_name_filter(item, left, operator, right):
+def library_dataset_name_filter(view, left, operator, right):
+    view.do_query = True
+    # Mirror LibraryDataset.name in SQL instead of loading every library
+    # dataset (and its current ldda) to compare it in Python.
+    if 'ldda_joined' not in view.state:
+        view.state['ldda_joined'] = aliased(LibraryDatasetDatasetAssociation)
+        view.query = view.query.outerjoin(
+            view.state['ldda_joined'],
+            LibraryDataset.library_dataset_dataset_association_id == view.state['ldda_joined'].id
+        )
+    ldda = view.state['ldda_joined']
+    name = case(
+        [(ldda.id != None, ldda.name)],
+        else_=func.coalesce(LibraryDataset.table.c._name, 'Unnamed dataset')
+    )
     if operator == '=':
-        return item.name == right
-    if operator == '!=':
-        return item.name != right
-    raise GalaxyParseError("Invalid comparison operator: %s" % (operator))
+        view.query = view.query.filter( name == right )
+    elif operator == '!=':
+        view.query = view.query.filter( name != right )
+    elif operator == 'like':
+        view.query = view.query.filter( name.like(right) )
+    else:
+        raise GalaxyParseError("Invalid comparison operator: %s" % (operator))
 
 
 class LibraryDatasetView(ViewQueryBaseClass):
     VIEW_NAME = "library_dataset"
     FIELDS = {
-        'name': ViewField('name', post_filter=library_dataset_name_filter),
+        'name': ViewField('name', handler=library_dataset_name_filter),
         'id': ViewField('id', sqlalchemy_field=(LibraryDataset, "id"), id_decode=True),
         'folder_id': ViewField('folder_id', sqlalchemy_field=(LibraryDataset, "folder_id"), id_decode=True)
     }
@@ -658,17 +698,28 @@ class SearchQuery:
         return o
 
 
+def build_gql_parser():
+    return parsley.makeGrammar(gqlGrammar, {
+        're': re,
+        'GalaxyQuery': GalaxyQuery,
+        'GalaxyQueryComparison': GalaxyQueryComparison,
+        'GalaxyQueryAnd': GalaxyQueryAnd
+    })
+
+
+# Compiling the grammar takes far longer than parsing a query with it, so it
+# is compiled once and shared by all search engines (parsers are stateless).
+_gql_parser = []
+
+
 class GalaxySearchEngine:
     """
     Primary class for searching. Parses GQL (Galaxy Query Language) queries and returns a 'SearchQuery' class
     """
     def __init__(self):
-        self.parser = parsley.makeGrammar(gqlGrammar, {
-            're': re,
-            'GalaxyQuery': GalaxyQuery,
-            'GalaxyQueryComparison': GalaxyQueryComparison,
-            'GalaxyQueryAnd': GalaxyQueryAnd
-        })
+        if not _gql_parser:
+            _gql_parser.append(build_gql_parser())
+        self.parser = _gql_parser[0]
 
     def query(self, query_text):
         q = self.parser(query_text).expr()
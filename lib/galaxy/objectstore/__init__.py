@@ -119,6 +119,27 @@ class ObjectStore(object):
         """
         raise NotImplementedError()
 
+    def delete_many(self, objs, extra_dirs=None, **kwargs):
+        """
+        Deletes each of the objects in `objs`, returning a list of whether each
+        of them is gone (deleted or did not exist). Object stores with an
+        expensive round trip per object may override this to delete the
+        objects in bulk.
+        See `delete` method for the description of the other fields.
+
+        :type extra_dirs: list
+        :param extra_dirs: Optional list (matching `objs`) of extra_dir
+                           directories to delete entirely along with each
+                           object, None for objects without one.
+        """
+        results = []
+        for i, obj in enumerate(objs):
+            extra_dir = extra_dirs and extra_dirs[i]
+            if extra_dir and self.exists(obj, extra_dir=extra_dir, dir_only=True):
+                self.delete(obj, entire_dir=True, extra_dir=extra_dir, dir_only=True)
+            results.append(self.delete(obj, **kwargs) or not self.exists(obj, **kwargs))
+        return results
+
     def get_data(self, obj, start=0, count=-1, base_dir=None, extra_dir=None, extra_dir_at_root=False, alt_name=None):
         """
         Fetch `count` bytes of data starting at offset `start` from the
@@ -535,6 +556,23 @@ class DistributedObjectStore(NestedObjectStore):
                 log.debug("Using preferred backend '%s' for creation of %s %s" % (obj.object_store_id, obj.__class__.__name__, obj.id))
             self.backends[obj.object_store_id].create(obj, **kwargs)
 
+    def delete_many(self, objs, extra_dirs=None, **kwargs):
+        # Delete the objects of each backend together so they can delete them
+        # in bulk.
+        results = [True] * len(objs)
+        by_store_id = odict()
+        for i, obj in enumerate(objs):
+            object_store_id = self.__get_store_id_for(obj, **kwargs)
+            if object_store_id is not None:
+                by_store_id.setdefault(object_store_id, []).append(i)
+        for object_store_id, indexes in by_store_id.items():
+            store_objs = [objs[i] for i in indexes]
+            store_extra_dirs = extra_dirs and [extra_dirs[i] for i in indexes]
+            store_results = self.backends[object_store_id].delete_many(store_objs, extra_dirs=store_extra_dirs, **kwargs)
+            for i, result in zip(indexes, store_results):
+                results[i] = result
+        return results
+
     def __call_method(self, method, obj, default, default_is_exception, **kwargs):
         object_store_id = self.__get_store_id_for(obj, **kwargs)
         if object_store_id is not None:
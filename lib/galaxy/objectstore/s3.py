@@ -16,6 +16,7 @@ from galaxy.exceptions import ObjectNotFound
 from galaxy.util import umask_fix_perms
 from galaxy.util.directory_hash import directory_hash_id
 from galaxy.util.sleeper import Sleeper
+from galaxy.util.odict import odict
 from .s3_multipart_upload import multipart_upload
 from ..objectstore import ObjectStore, convert_bytes
 
@@ -27,6 +28,9 @@ try:
 except ImportError:
     boto = None
 
+# Maximum number of keys S3 accepts in a single multi-object delete request.
+MULTI_DELETE_MAX_KEYS = 1000
+
 NO_BOTO_ERROR_MESSAGE = "S3/Swift object store configured, but no boto dependency available. Please install and properly configure boto or modify object store configuration."
 
 log = logging.getLogger( __name__ )
@@ -39,6 +43,9 @@ class S3ObjectStore(ObjectStore):
     cache exists that is used as an intermediate location for files between
     Galaxy and S3.
     """
+    # Delete objects in bulk with S3 multi-object delete requests.
+    multi_delete = True
+
     def __init__(self, config, config_xml):
         if boto is None:
             raise Exception(NO_BOTO_ERROR_MESSAGE)
@@ -465,6 +472,56 @@ class S3ObjectStore(ObjectStore):
             log.error('%s delete error %s' % (self._get_filename(obj, **kwargs), ex))
         return False
 
+    def delete_many(self, objs, extra_dirs=None, entire_dir=False, **kwargs):
+        if entire_dir or not self.multi_delete:
+            return super(S3ObjectStore, self).delete_many(objs, extra_dirs=extra_dirs, entire_dir=entire_dir, **kwargs)
+        rel_paths = [self._construct_path(obj, **kwargs) for obj in objs]
+        for rel_path in rel_paths:
+            cache_path = self._get_cache_path(rel_path)
+            if os.path.exists(cache_path):
+                try:
+                    os.unlink(cache_path)
+                except OSError, ex:
+                    log.error('%s delete error %s' % (cache_path, ex))
+        # The keys to delete for each object - extra files are found with a
+        # single listing of each hashed directory the objects are in.
+        obj_keys = [[rel_path] for rel_path in rel_paths]
+        failed_objs = set()
+        extra_prefixes = odict()
+        for i, obj in enumerate(objs):
+            extra_dir = extra_dirs and extra_dirs[i]
+            if extra_dir:
+                extra_prefix = self._construct_path(obj, extra_dir=extra_dir, dir_only=True)
+                shutil.rmtree(self._get_cache_path(extra_prefix), ignore_errors=True)
+                extra_prefixes.setdefault(self._construct_path(obj, dir_only=True), {})[extra_prefix] = i
+        for dir_prefix, prefixes in extra_prefixes.items():
+            try:
+                for key in self.bucket.list(prefix=dir_prefix):
+                    extra_prefix = "%s%s/" % (dir_prefix, key.name[len(dir_prefix):].split('/')[0])
+                    if extra_prefix in prefixes:
+                        obj_keys[prefixes[extra_prefix]].append(key.name)
+            except S3ResponseError, ex:
+                log.error("Could not list keys under '%s' in S3: %s" % (dir_prefix, ex))
+                failed_objs.update(prefixes.values())
+        key_objs = {}
+        for i, keys in enumerate(obj_keys):
+            for key in keys:
+                key_objs[key] = i
+        keys = key_objs.keys()
+        # Unlike delete, keys that do not exist in S3 are reported as deleted.
+        for start in range(0, len(keys), MULTI_DELETE_MAX_KEYS):
+            batch = keys[start:start + MULTI_DELETE_MAX_KEYS]
+            try:
+                result = self.bucket.delete_keys(batch, quiet=True)
+            except S3ResponseError, ex:
+                log.error("Could not delete %d keys from S3: %s" % (len(batch), ex))
+                failed_objs.update([key_objs[key] for key in batch])
+                continue
+            for error in result.errors:
+                log.error("Could not delete key '%s' from S3: %s" % (error.key, error.message))
+                failed_objs.add(key_objs[error.key])
+        return [i not in failed_objs for i in range(len(objs))]
+
     def get_data(self, obj, start=0, count=-1, **kwargs):
         rel_path = self._construct_path(obj, **kwargs)
         # Check cache first and get file if not there
@@ -552,6 +609,8 @@ class SwiftObjectStore(S3ObjectStore):
     cache exists that is used as an intermediate location for files between
     Galaxy and Swift.
     """
+    # Not every Swift S3 middleware supports multi-object delete requests.
+    multi_delete = False
 
     def _configure_connection(self):
         log.debug("Configuring Swift Connection")
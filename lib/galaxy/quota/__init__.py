@@ -3,10 +3,20 @@ Galaxy Quotas
 
 """
 import logging
+import threading
+import time
+
+from sqlalchemy import func
+
 import galaxy.util
 
 log = logging.getLogger(__name__)
 
+# How often (in seconds) QuotaAgent checks whether quotas or their
+# associations with users and groups changed (e.g. in other Galaxy
+# processes) and reloads them.
+QUOTA_CHANGES_CHECK_INTERVAL = 10
+
 class NoQuotaAgent( object ):
     """Base quota agent, always returns no quota"""
     def __init__( self, model ):
@@ -32,9 +42,25 @@ class NoQuotaAgent( object ):
         return None
     def get_user_quotas( self, user ):
         return []
+    def get_quotas( self, users, nice_size=False ):
+        return dict( [ ( user.id, None ) for user in users ] )
+    def invalidate( self ):
+        pass
 
 class QuotaAgent( NoQuotaAgent ):
     """Class that handles galaxy quotas"""
+    def __init__( self, model ):
+        super( QuotaAgent, self ).__init__( model )
+        # Quotas and the ids of the quotas associated with each user (directly
+        # or through groups) are loaded all at once and kept until they change
+        # - see __check_quotas.
+        self.lock = threading.Lock()
+        self.quotas = None
+        self.user_quota_ids = None
+        self.default_quotas = None
+        self.user_quotas = None
+        self.quotas_signature = None
+        self.quotas_checked = None
     def get_quota( self, user, nice_size=False ):
         """
         Calculated like so:
@@ -48,47 +74,112 @@ class QuotaAgent( NoQuotaAgent ):
                quotas.
         """
         if not user:
-            return self.default_unregistered_quota
-        quotas = []
-        for group in [ uga.group for uga in user.groups ]:
-            for quota in [ gqa.quota for gqa in group.quotas ]:
-                if quota not in quotas:
-                    quotas.append( quota )
-        for quota in [ uqa.quota for uqa in user.quotas ]:
-            if quota not in quotas:
-                quotas.append( quota )
+            rval = self.default_unregistered_quota
+            if nice_size:
+                rval = self.__nice_size( rval )
+            return rval
+        return self.get_quotas( [ user ], nice_size=nice_size )[ user.id ]
+    def get_quotas( self, users, nice_size=False ):
+        """
+        Return a dictionary mapping the ids of (registered) ``users`` to their
+        quota (see get_quota) - evaluated without querying the database for
+        each user.
+        """
+        rval = {}
+        with self.lock:
+            self.__check_quotas()
+            for user in users:
+                if user.id not in self.user_quotas:
+                    self.user_quotas[ user.id ] = self.__evaluate_quota( self.user_quota_ids.get( user.id, set() ) )
+                rval[ user.id ] = self.user_quotas[ user.id ]
+        if nice_size:
+            for user_id, quota in rval.items():
+                rval[ user_id ] = self.__nice_size( quota )
+        return rval
+    def invalidate( self ):
+        """
+        Reload quotas and their associations on next use, call after
+        modifying them.
+        """
+        with self.lock:
+            self.quotas_checked = None
+            self.quotas_signature = None
+    def __evaluate_quota( self, quota_ids ):
         use_default = True
         max = 0
         adjustment = 0
         rval = 0
-        for quota in quotas:
-            if quota.deleted:
+        for quota_id in quota_ids:
+            operation, bytes, deleted = self.quotas[ quota_id ]
+            if deleted:
                 continue
-            if quota.operation == '=' and quota.bytes == -1:
+            if operation == '=' and bytes == -1:
                 rval = None
                 break
-            elif quota.operation == '=':
+            elif operation == '=':
                 use_default = False
-                if quota.bytes > max:
-                    max = quota.bytes
-            elif quota.operation == '+':
-                adjustment += quota.bytes
-            elif quota.operation == '-':
-                adjustment -= quota.bytes
+                if bytes > max:
+                    max = bytes
+            elif operation == '+':
+                adjustment += bytes
+            elif operation == '-':
+                adjustment -= bytes
         if use_default:
-            max = self.default_registered_quota
+            max = self.default_quotas.get( self.model.DefaultQuotaAssociation.types.REGISTERED, None )
             if max is None:
                 rval = None
         if rval is not None:
             rval = max + adjustment
             if rval <= 0:
                 rval = 0
-        if nice_size:
-            if rval is not None:
-                rval = galaxy.util.nice_size( rval )
-            else:
-                rval = 'unlimited'
         return rval
+    def __nice_size( self, quota ):
+        if quota is not None:
+            return galaxy.util.nice_size( quota )
+        return 'unlimited'
+    def __check_quotas( self ):
+        now = time.time()
+        if self.quotas_checked is not None and now - self.quotas_checked < QUOTA_CHANGES_CHECK_INTERVAL:
+            return
+        self.quotas_checked = now
+        signature = self.__quotas_signature()
+        if signature == self.quotas_signature:
+            return
+        self.__load_quotas()
+        self.quotas_signature = signature
+    def __quotas_signature( self ):
+        # Number of rows and last update of each table quotas are evaluated
+        # from, rows being added, modified or removed changes these.
+        signature = []
+        for model_class in [ self.model.Quota, self.model.UserQuotaAssociation, self.model.GroupQuotaAssociation,
+                             self.model.DefaultQuotaAssociation, self.model.UserGroupAssociation ]:
+            table = model_class.table
+            signature.append( tuple( self.sa_session.query( func.count( table.c.id ), func.max( table.c.update_time ) ).first() ) )
+        return signature
+    def __load_quotas( self ):
+        quota_table = self.model.Quota.table
+        quotas = {}
+        for quota_id, operation, bytes, deleted in self.sa_session.query( quota_table.c.id, quota_table.c.operation, quota_table.c.bytes, quota_table.c.deleted ):
+            quotas[ quota_id ] = ( operation, bytes, deleted )
+        user_quota_ids = {}
+        uqa_table = self.model.UserQuotaAssociation.table
+        for user_id, quota_id in self.sa_session.query( uqa_table.c.user_id, uqa_table.c.quota_id ):
+            user_quota_ids.setdefault( user_id, set() ).add( quota_id )
+        uga_table = self.model.UserGroupAssociation.table
+        gqa_table = self.model.GroupQuotaAssociation.table
+        query = self.sa_session.query( uga_table.c.user_id, gqa_table.c.quota_id ).filter( uga_table.c.group_id == gqa_table.c.group_id )
+        for user_id, quota_id in query:
+            user_quota_ids.setdefault( user_id, set() ).add( quota_id )
+        dqa_table = self.model.DefaultQuotaAssociation.table
+        default_quotas = {}
+        for default_type, quota_id in self.sa_session.query( dqa_table.c.type, dqa_table.c.quota_id ):
+            bytes = quotas[ quota_id ][ 1 ]
+            default_quotas[ default_type ] = bytes if bytes >= 0 else None
+        self.quotas = quotas
+        self.user_quota_ids = user_quota_ids
+        self.default_quotas = default_quotas
+        # Evaluated lazily, per user.
+        self.user_quotas = {}
     @property
     def default_unregistered_quota( self ):
         return self._default_quota( self.model.DefaultQuotaAssociation.types.UNREGISTERED )
@@ -96,12 +187,9 @@ class QuotaAgent( NoQuotaAgent ):
     def default_registered_quota( self ):
         return self._default_quota( self.model.DefaultQuotaAssociation.types.REGISTERED )
     def _default_quota( self, default_type ):
-        dqa = self.sa_session.query( self.model.DefaultQuotaAssociation ).filter( self.model.DefaultQuotaAssociation.table.c.type==default_type ).first()
-        if not dqa:
-            return None
-        if dqa.quota.bytes < 0:
-            return None
-        return dqa.quota.bytes
+        with self.lock:
+            self.__check_quotas()
+            return self.default_quotas.get( default_type, None )
     def set_default_quota( self, default_type, quota ):
         # Unset the current default(s) associated with this quota, if there are any
         for dqa in quota.default:
@@ -120,6 +208,7 @@ class QuotaAgent( NoQuotaAgent ):
             dqa = self.model.DefaultQuotaAssociation( default_type, quota )
         self.sa_session.add( dqa )
         self.sa_session.flush()
+        self.invalidate()
 
     def get_percent( self, trans=None, user=False, history=False, usage=False, quota=False ):
         """
@@ -160,6 +249,7 @@ class QuotaAgent( NoQuotaAgent ):
                 gqa = self.model.GroupQuotaAssociation( group, quota )
                 self.sa_session.add( gqa )
             self.sa_session.flush()
+        self.invalidate()
     def get_user_quotas( self, user ):
         rval = []
         if not user:
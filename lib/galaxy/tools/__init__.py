@@ -2,6 +2,7 @@
 Classes encapsulating galaxy tools and tool configuration.
 """
 
+import base64
 import binascii
 import glob
 import json
@@ -18,6 +19,7 @@ import threading
 import traceback
 import types
 import urllib
+import zlib
 
 from math import isinf
 
@@ -89,6 +91,10 @@ log = logging.getLogger( __name__ )
 
 WORKFLOW_PARAMETER_REGULAR_EXPRESSION = re.compile( '''\$\{.+?\}''' )
 
+# Marks secure tool states as compressed, previously states were hex encoded
+# so this can never be the start of such a state.
+COMPRESSED_TOOL_STATE_PREFIX = "z"
+
 JOB_RESOURCE_CONDITIONAL_XML = """<conditional name="__job_resource">
     <param name="__job_resource__select" type="select" label="Job Resource Parameters">
         <option value="no">Use default job resource parameters</option>
@@ -1147,8 +1153,11 @@ class DefaultToolState( object ):
         value = json.dumps( value )
         # Make it secure
         if secure:
-            a = hmac_new( app.config.tool_secret, value )
-            b = binascii.hexlify( value )
+            # Compress the state - it is round tripped through the tool form
+            # on every refresh and for tools with large repeats or many
+            # selected datasets it is otherwise very large.
+            b = COMPRESSED_TOOL_STATE_PREFIX + base64.urlsafe_b64encode( zlib.compress( value ) )
+            a = hmac_new( app.config.tool_secret, b )
             return "%s:%s" % ( a, b )
         else:
             return value
@@ -1160,9 +1169,17 @@ class DefaultToolState( object ):
         if secure:
             # Extract and verify hash
             a, b = value.split( ":" )
-            value = binascii.unhexlify( b )
-            test = hmac_new( app.config.tool_secret, value )
-            assert a == test
+            if b.startswith( COMPRESSED_TOOL_STATE_PREFIX ):
+                # Verify before decompressing anything.
+                test = hmac_new( app.config.tool_secret, b )
+                assert a == test
+                value = zlib.decompress( base64.urlsafe_b64decode( b[ len( COMPRESSED_TOOL_STATE_PREFIX ): ] ) )
+            else:
+                # Hex encoded state from forms rendered by older Galaxy
+                # versions.
+                value = binascii.unhexlify( b )
+                test = hmac_new( app.config.tool_secret, value )
+                assert a == test
         # Restore from string
         values = json_fix( json.loads( value ) )
         self.page = values.pop( "__page__" )
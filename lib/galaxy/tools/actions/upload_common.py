@@ -236,8 +236,11 @@ def get_uploaded_datasets( trans, cntrller, params, precreated_datasets, dataset
     uploaded_datasets = []
     for dataset_upload_input in dataset_upload_inputs:
         uploaded_datasets.extend( dataset_upload_input.get_uploaded_datasets( trans, params ) )
-    for uploaded_dataset in uploaded_datasets:
-        data = get_precreated_dataset( precreated_datasets, uploaded_dataset.name )
+    precreated = [ get_precreated_dataset( precreated_datasets, uploaded_dataset.name ) for uploaded_dataset in uploaded_datasets ]
+    if not library_bunch:
+        # Reserve the hids of all the new history datasets at once.
+        ( history or trans.history ).reserve_hids( precreated.count( None ) )
+    for uploaded_dataset, data in zip( uploaded_datasets, precreated ):
         if not data:
             data = new_upload( trans, cntrller, uploaded_dataset, library_bunch=library_bunch, history=history )
         else:
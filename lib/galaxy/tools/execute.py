@@ -82,12 +82,18 @@ class ToolExecutionTracker( object ):
         collections = {}
 
         implicit_inputs = list(self.collection_info.collections.iteritems())
+        matched_outputs = []
         for output_name, outputs in self.outputs_by_output_name.iteritems():
             if not len( structure ) == len( outputs ):
                 # Output does not have the same structure, if all jobs were
                 # successfully submitted this shouldn't have happened.
                 log.warn( "Problem matching up datasets while attempting to create implicit dataset collections")
                 continue
+            matched_outputs.append( ( output_name, outputs ) )
+
+        # Reserve the hids of all the implicit collections at once.
+        history.reserve_hids( len( matched_outputs ) )
+        for output_name, outputs in matched_outputs:
             output = self.tool.outputs[ output_name ]
             element_identifiers = structure.element_identifiers_for_outputs( trans, outputs )
 
@@ -427,12 +427,12 @@ class JobExportHistoryArchiveWrapper( object, UsesHistoryMixin, UsesAnnotations
                 included_datasets.append( dataset )
         datasets_attrs_filename = tempfile.NamedTemporaryFile( dir=temp_output_dir ).name
         datasets_attrs_out = open( datasets_attrs_filename, 'w' )
-        datasets_attrs_out.write( dumps( datasets_attrs, cls=HistoryDatasetAssociationEncoder ) )
+        json.dump( datasets_attrs, datasets_attrs_out, cls=HistoryDatasetAssociationEncoder )
         datasets_attrs_out.close()
         jeha.datasets_attrs_filename = datasets_attrs_filename
 
         provenance_attrs_out = open( datasets_attrs_filename + ".provenance", 'w' )
-        provenance_attrs_out.write( dumps( provenance_attrs, cls=HistoryDatasetAssociationEncoder ) )
+        json.dump( provenance_attrs, provenance_attrs_out, cls=HistoryDatasetAssociationEncoder )
         provenance_attrs_out.close()
 
         #
@@ -509,7 +509,7 @@ class JobExportHistoryArchiveWrapper( object, UsesHistoryMixin, UsesAnnotations
 
         jobs_attrs_filename = tempfile.NamedTemporaryFile( dir=temp_output_dir ).name
         jobs_attrs_out = open( jobs_attrs_filename, 'w' )
-        jobs_attrs_out.write( dumps( jobs_attrs, cls=HistoryDatasetAssociationEncoder ) )
+        json.dump( jobs_attrs, jobs_attrs_out, cls=HistoryDatasetAssociationEncoder )
         jobs_attrs_out.close()
         jeha.jobs_attrs_filename = jobs_attrs_filename
 
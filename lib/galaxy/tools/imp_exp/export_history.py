@@ -4,11 +4,15 @@ Export a history to an archive file using attribute files.
 
 usage: %prog history_attrs dataset_attrs job_attrs out_file
     -G, --gzip: gzip archive file
+
+The archive is compressed with pigz (using $GALAXY_SLOTS threads) if it is
+on the PATH. Datasets shared by several HDAs are only added to the archive
+once.
 """
 
 from galaxy import eggs
 from galaxy.util.json import *
-import optparse, sys, os, tempfile, tarfile
+import optparse, sys, os, tempfile, tarfile, subprocess, json
 
 def get_dataset_filename( name, ext ):
     """
@@ -18,43 +22,64 @@ def get_dataset_filename( name, ext ):
     base = ''.join( c in valid_chars and c or '_' for c in name )
     return base + ".%s" % ext
 
+def find_pigz():
+    """
+    Returns the path of pigz (parallel gzip) if it is on the PATH.
+    """
+    for path in os.environ.get( 'PATH', '' ).split( os.pathsep ):
+        pigz_path = os.path.join( path, 'pigz' )
+        if os.path.isfile( pigz_path ) and os.access( pigz_path, os.X_OK ):
+            return pigz_path
+    return None
+
 def create_archive( history_attrs_file, datasets_attrs_file, jobs_attrs_file, out_file, gzip=False ):
     """ Create archive from the given attribute/metadata files and save it to out_file. """
     tarfile_mode = "w"
+    pigz_path = None
     if gzip:
-        tarfile_mode += ":gz"
+        pigz_path = find_pigz()
+        if not pigz_path:
+            tarfile_mode += ":gz"
     try:
 
-        history_archive = tarfile.open( out_file, tarfile_mode )
+        if pigz_path:
+            # Stream the (uncompressed) archive through pigz to compress it
+            # with several threads.
+            pigz_command = [ pigz_path, '-c' ]
+            if os.environ.get( 'GALAXY_SLOTS', None ):
+                pigz_command.extend( [ '-p', os.environ[ 'GALAXY_SLOTS' ] ] )
+            archive_out = open( out_file, 'wb' )
+            pigz = subprocess.Popen( pigz_command, stdin=subprocess.PIPE, stdout=archive_out )
+            history_archive = tarfile.open( fileobj=pigz.stdin, mode="w|" )
+        else:
+            history_archive = tarfile.open( out_file, tarfile_mode )
 
         # Read datasets attributes from file.
         datasets_attr_in = open( datasets_attrs_file, 'rb' )
-        datasets_attr_str = ''
-        buffsize = 1048576
-        try:
-            while True:
-                datasets_attr_str += datasets_attr_in.read( buffsize )
-                if not datasets_attr_str or len( datasets_attr_str ) % buffsize != 0:
-                    break
-        except OverflowError:
-            pass
+        datasets_attrs = json.load( datasets_attr_in )
         datasets_attr_in.close()
-        datasets_attrs = loads( datasets_attr_str )
 
         # Add datasets to archive and update dataset attributes.
         # TODO: security check to ensure that files added are in Galaxy dataset directory?
+        archive_names = {}
         for dataset_attrs in datasets_attrs:
             if dataset_attrs['exported']:
                 dataset_file_name = dataset_attrs[ 'file_name' ] # Full file name.
-                dataset_archive_name = os.path.join( 'datasets',
-                                                     get_dataset_filename( dataset_attrs[ 'name' ], dataset_attrs[ 'extension' ] ) )
-                history_archive.add( dataset_file_name, arcname=dataset_archive_name )
+                if dataset_file_name in archive_names:
+                    # Dataset shared with another HDA (e.g. a copy) - the
+                    # import handles several HDAs referencing the same file.
+                    dataset_archive_name = archive_names[ dataset_file_name ]
+                else:
+                    dataset_archive_name = os.path.join( 'datasets',
+                                                         get_dataset_filename( dataset_attrs[ 'name' ], dataset_attrs[ 'extension' ] ) )
+                    history_archive.add( dataset_file_name, arcname=dataset_archive_name )
+                    archive_names[ dataset_file_name ] = dataset_archive_name
                 # Update dataset filename to be archive name.
                 dataset_attrs[ 'file_name' ] = dataset_archive_name
 
         # Rewrite dataset attributes file.
         datasets_attrs_out = open( datasets_attrs_file, 'w' )
-        datasets_attrs_out.write( dumps( datasets_attrs ) )
+        json.dump( datasets_attrs, datasets_attrs_out )
         datasets_attrs_out.close()
 
         # Finish archive.
@@ -64,6 +89,12 @@ def create_archive( history_attrs_file, datasets_attrs_file, jobs_attrs_file, ou
             history_archive.add( datasets_attrs_file + ".provenance", arcname="datasets_attrs.txt.provenance" )            
         history_archive.add( jobs_attrs_file, arcname="jobs_attrs.txt" )
         history_archive.close()
+        if pigz_path:
+            pigz.stdin.close()
+            return_code = pigz.wait()
+            archive_out.close()
+            if return_code:
+                raise Exception( "pigz exited with code %d" % return_code )
 
         # Status.
         return 'Created history archive.'
@@ -21,6 +21,7 @@ import dynamic_options
 from ..parameters import history_query
 from .dataset_matcher import DatasetMatcher
 from .dataset_matcher import DatasetCollectionMatcher
+from .dataset_matcher import HistoryDatasetIndex
 # For BaseURLToolParameter
 from galaxy.web import url_for
 from galaxy.model.item_attrs import Dictifiable
@@ -1841,7 +1842,9 @@ class DataToolParameter( BaseDataToolParameter ):
         field_name = "%s%s" % ( self.name, suffix )
         field = form_builder.SelectField( field_name, multiple, None, self.refresh_on_change, refresh_on_change_values=self.refresh_on_change_values )
 
-        dataset_collector( history.active_datasets_children_and_roles, None )
+        # Only datasets of datatypes that could match are considered.
+        dataset_index = HistoryDatasetIndex.for_history( history )
+        dataset_collector( dataset_index.candidates( dataset_matcher ), None )
         self._ensure_selection( field )
         return field
 
@@ -1960,8 +1963,13 @@ class DataToolParameter( BaseDataToolParameter ):
             return value
         if isinstance(value, str) and value.find(",") > -1:
             values = value.split(",")
-            # TODO: Optimize. -John
-            return [ app.model.context.query( app.model.HistoryDatasetAssociation ).get( int( val ) ) for val in values if val not in none_values ]
+            ids = [ int( val ) for val in values if val not in none_values ]
+            # Fetch all selected datasets with a single query instead of one
+            # per dataset - tool states are decoded on every form refresh.
+            hda_class = app.model.HistoryDatasetAssociation
+            hdas = app.model.context.query( hda_class ).filter( hda_class.id.in_( ids ) )
+            hdas_by_id = dict( [ ( hda.id, hda ) for hda in hdas ] )
+            return [ hdas_by_id.get( id ) for id in ids ]
         # Not sure if following case is needed, if yes deduplicate with above code.
         elif str( value ).startswith( "__collection_reduce__|" ):
             # When coming from HTML this id would be encoded, in database it
@@ -22,6 +22,9 @@ class DatasetMatcher( object ):
         self.tool = param.tool
         self.value = value
         self.current_user_roles = ROLES_UNSET
+        # Datatype matching only depends on the datatype (one instance per
+        # extension) - so cache it instead of rechecking it for every HDA.
+        self.__datatype_matches = {}
         filter_value = None
         if param.options:
             try:
@@ -47,9 +50,10 @@ class DatasetMatcher( object ):
         if self.filter( hda ):
             return False
         formats = self.param.formats
-        if hda.datatype.matches_any( formats ):
+        direct_match, convertible = self.__datatype_match( hda )
+        if direct_match:
             return HdaDirectMatch( hda )
-        if not check_implicit_conversions:
+        if not check_implicit_conversions or not convertible:
             return False
         target_ext, converted_dataset = hda.find_conversion_destination( formats )
         if target_ext:
@@ -76,6 +80,36 @@ class DatasetMatcher( object ):
                 return False
             return self.valid_hda_match( hda, check_implicit_conversions=check_implicit_conversions )
 
+    def datatype_could_match( self, datatype, hda ):
+        """ Could datasets of the supplied datatype (``hda`` being one of
+        them) match this parameter directly or through an implicit
+        conversion. Used to skip whole groups of datasets without examining
+        each of them.
+        """
+        direct_match, convertible = self.__datatype_match( hda, datatype=datatype )
+        return direct_match or convertible
+
+    def __datatype_match( self, hda, datatype=None ):
+        """ Return pair describing whether datasets of ``hda``'s datatype
+        match this parameter directly and whether they could be implicitly
+        converted to a matching datatype - only the first dataset encountered
+        for each datatype is actually checked.
+        """
+        if datatype is None:
+            datatype = hda.datatype
+        if datatype not in self.__datatype_matches:
+            formats = self.param.formats
+            direct_match = datatype.matches_any( formats )
+            convertible = False
+            if not direct_match:
+                # The target extension (if any) only depends on the source
+                # extension, whether a converted dataset already exists is
+                # checked per HDA.
+                target_ext, _ = hda.find_conversion_destination( formats )
+                convertible = bool( target_ext )
+            self.__datatype_matches[ datatype ] = ( direct_match, convertible )
+        return self.__datatype_matches[ datatype ]
+
     def selected( self, hda ):
         """ Given value for DataToolParameter, is this HDA "selected".
         """
@@ -99,6 +133,43 @@ class DatasetMatcher( object ):
         return self.trans.app.security_agent.can_access_dataset( self.current_user_roles, dataset )
 
 
+class HistoryDatasetIndex( object ):
+    """ Index of a history's active datasets grouped by datatype.
+
+    Built once per history per request (and shared by all the data parameters
+    of a tool form), it allows a ``DatasetMatcher`` to check each datatype
+    once and then only examine the datasets of datatypes that could match -
+    instead of checking datatypes, conversions, and permissions for every
+    dataset in the history.
+    """
+
+    def __init__( self, hdas ):
+        self.hdas = hdas
+        self.entries_by_datatype = {}
+        for position, hda in enumerate( hdas ):
+            self.entries_by_datatype.setdefault( hda.datatype, [] ).append( ( position, hda ) )
+
+    @staticmethod
+    def for_history( history ):
+        hdas = history.active_datasets_children_and_roles
+        index = getattr( history, '_dataset_index', None )
+        if index is None or index.hdas is not hdas:
+            index = HistoryDatasetIndex( hdas )
+            history._dataset_index = index
+        return index
+
+    def candidates( self, dataset_matcher ):
+        """ Return datasets (in history order) whose datatype could match
+        the parameter described by ``dataset_matcher``.
+        """
+        entries = []
+        for datatype, datatype_entries in self.entries_by_datatype.iteritems():
+            if dataset_matcher.datatype_could_match( datatype, datatype_entries[ 0 ][ 1 ] ):
+                entries.extend( datatype_entries )
+        entries.sort( key=lambda entry: entry[ 0 ] )
+        return [ hda for _, hda in entries ]
+
+
 class HdaDirectMatch( object ):
     """ Supplied HDA was a valid option directly (did not need to find implicit
     conversion).
@@ -163,4 +234,4 @@ class DatasetCollectionMatcher( object ):
                 break
         return valid
 
-__all__ = [ DatasetMatcher, DatasetCollectionMatcher ]
+__all__ = [ DatasetMatcher, DatasetCollectionMatcher, HistoryDatasetIndex ]
@@ -1,13 +1,22 @@
 """
-A simple wrapper for writing tarballs as a stream.
+Simple wrappers for writing tarballs and zip archives as a stream.
 """
 import os
 import logging
+import struct
 import tarfile
+import time
+import zipfile
+import zlib
 from galaxy.exceptions import ObjectNotFound
 
 log = logging.getLogger( __name__ )
 
+CHUNK_SIZE = 2 ** 16
+
+# Members starting with these are already compressed and are stored as is.
+COMPRESSED_MAGIC_NUMBERS = [ '\x1f\x8b', 'BZh', 'PK\x03\x04' ]
+
 
 class StreamBall( object ):
     def __init__( self, mode, members=None ):
@@ -40,19 +49,193 @@ class StreamBall( object ):
         return []
 
 
-class ZipBall(object):
-    def __init__(self, tmpf, tmpd):
-        self._tmpf = tmpf
-        self._tmpd = tmpd
+class ZipStreamBall( object ):
+    """
+    Writes a zip archive of its members as a stream - members are read (and
+    compressed) a chunk at a time as the archive is written, so neither a
+    temporary archive nor whole members are kept on disk or in memory.
+
+    Since the archive can't be seeked, sizes and CRCs are written after each
+    member's data (in data descriptors). ZIP64 records are used for large
+    members and archives.
+    """
+
+    def __init__( self, compression=zipfile.ZIP_DEFLATED ):
+        """
+        :param compression: ``zipfile.ZIP_DEFLATED`` to compress members
+            (members that are already compressed are stored regardless) or
+            ``zipfile.ZIP_STORED`` to store all members as is.
+        """
+        self.compression = compression
+        self.members = []
+        self.wsgi_status = None
+        self.wsgi_headeritems = None
+
+    def add( self, file, relpath, check_file=False ):
+        if check_file and not os.path.isfile( file ):
+            raise ObjectNotFound
+        self.members.append( ( file, relpath ) )
 
-    def stream(self, environ, start_response):
+    def stream( self, environ, start_response ):
         response_write = start_response( self.wsgi_status, self.wsgi_headeritems )
-        tmpfh = open( self._tmpf )
-        response_write(tmpfh.read())
-        tmpfh.close()
-        try:
-            os.unlink( self._tmpf )
-            os.rmdir( self._tmpd )
-        except OSError:
-            log.exception( "Unable to remove temporary library download archive and directory" )
+        self.write_archive( response_write )
         return []
+
+    def write_archive( self, write ):
+        """
+        Write the archive by passing successive chunks of it to `write`.
+        """
+        writer = ZipStreamWriter( write )
+        for file, relpath in self.members:
+            writer.write_member( file, relpath, self.compression )
+        writer.close()
+
+
+class ZipStreamWriter( object ):
+    """
+    Writes zip archive members and the central directory to a stream.
+    """
+
+    def __init__( self, write ):
+        self.__write = write
+        self.offset = 0
+        self.entries = []
+
+    def write( self, data ):
+        self.__write( data )
+        self.offset += len( data )
+
+    def write_member( self, path, arcname, compression ):
+        stat = os.stat( path )
+        filename, flag_bits = _encode_filename( arcname )
+        # Sizes and CRC follow the data.
+        flag_bits |= 0x08
+        dostime, dosdate = _dos_date_time( stat.st_mtime )
+        # The compressed size isn't known in advance, allow for deflate
+        # expanding incompressible data slightly.
+        zip64 = stat.st_size + stat.st_size // 1000 + CHUNK_SIZE > zipfile.ZIP64_LIMIT
+        extract_version = 45 if zip64 else 20
+        header_offset = self.offset
+
+        fh = open( path, 'rb' )
+        try:
+            chunk = fh.read( CHUNK_SIZE )
+            compress_type = compression
+            if any( [ chunk.startswith( magic ) for magic in COMPRESSED_MAGIC_NUMBERS ] ):
+                compress_type = zipfile.ZIP_STORED
+            compressor = None
+            if compress_type == zipfile.ZIP_DEFLATED:
+                compressor = zlib.compressobj( zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15 )
+
+            if zip64:
+                extra = struct.pack( '<HHQQ', 1, 16, 0, 0 )
+                size_field = 0xFFFFFFFF
+            else:
+                extra = ''
+                size_field = 0
+            self.write( struct.pack( zipfile.structFileHeader, zipfile.stringFileHeader,
+                                     extract_version, 0, flag_bits, compress_type, dostime, dosdate,
+                                     0, size_field, size_field, len( filename ), len( extra ) ) )
+            self.write( filename + extra )
+
+            crc = 0
+            file_size = 0
+            compress_size = 0
+            while chunk:
+                crc = zlib.crc32( chunk, crc )
+                file_size += len( chunk )
+                if compressor:
+                    chunk = compressor.compress( chunk )
+                if chunk:
+                    compress_size += len( chunk )
+                    self.write( chunk )
+                chunk = fh.read( CHUNK_SIZE )
+            if compressor:
+                chunk = compressor.flush()
+                compress_size += len( chunk )
+                self.write( chunk )
+        finally:
+            fh.close()
+
+        crc = crc & 0xFFFFFFFF
+        descriptor_format = '<4sLQQ' if zip64 else '<4sLLL'
+        self.write( struct.pack( descriptor_format, 'PK\x07\x08', crc, compress_size, file_size ) )
+        self.entries.append( dict(
+            filename=filename,
+            flag_bits=flag_bits,
+            extract_version=extract_version,
+            compress_type=compress_type,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=crc,
+            compress_size=compress_size,
+            file_size=file_size,
+            header_offset=header_offset,
+            external_attr=( stat.st_mode & 0xFFFF ) << 16,
+        ) )
+
+    def close( self ):
+        """
+        Write the central directory and end of archive records.
+        """
+        central_directory_offset = self.offset
+        for entry in self.entries:
+            zip64_fields = []
+            values = []
+            for key in [ 'file_size', 'compress_size', 'header_offset' ]:
+                value = entry[ key ]
+                if value > zipfile.ZIP64_LIMIT:
+                    zip64_fields.append( value )
+                    value = 0xFFFFFFFF
+                values.append( value )
+            file_size, compress_size, header_offset = values
+            extract_version = entry[ 'extract_version' ]
+            extra = ''
+            if zip64_fields:
+                extra = struct.pack( '<HH' + 'Q' * len( zip64_fields ), 1, 8 * len( zip64_fields ), *zip64_fields )
+                extract_version = 45
+            self.write( struct.pack( zipfile.structCentralDir, zipfile.stringCentralDir,
+                                     extract_version, 3, extract_version, 0, entry[ 'flag_bits' ],
+                                     entry[ 'compress_type' ], entry[ 'dostime' ], entry[ 'dosdate' ],
+                                     entry[ 'crc' ], compress_size, file_size, len( entry[ 'filename' ] ),
+                                     len( extra ), 0, 0, 0, entry[ 'external_attr' ], header_offset ) )
+            self.write( entry[ 'filename' ] + extra )
+        central_directory_size = self.offset - central_directory_offset
+
+        count = len( self.entries )
+        if ( count > zipfile.ZIP_FILECOUNT_LIMIT or central_directory_offset > zipfile.ZIP64_LIMIT
+                or central_directory_size > zipfile.ZIP64_LIMIT ):
+            zip64_end_offset = self.offset
+            self.write( struct.pack( zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                                     44, 45, 45, 0, 0, count, count,
+                                     central_directory_size, central_directory_offset ) )
+            self.write( struct.pack( zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator,
+                                     0, zip64_end_offset, 1 ) )
+            count = min( count, 0xFFFF )
+            central_directory_size = min( central_directory_size, 0xFFFFFFFF )
+            central_directory_offset = min( central_directory_offset, 0xFFFFFFFF )
+        self.write( struct.pack( zipfile.structEndArchive, zipfile.stringEndArchive,
+                                 0, 0, count, count, central_directory_size, central_directory_offset, 0 ) )
+
+
+def _encode_filename( arcname ):
+    """
+    Return the archive name encoded for the zip archive and the general
+    purpose flag bits it requires (UTF-8 names are flagged).
+    """
+    if isinstance( arcname, unicode ):
+        try:
+            return arcname.encode( 'ascii' ), 0
+        except UnicodeEncodeError:
+            return arcname.encode( 'utf-8' ), 0x800
+    return arcname, 0
+
+
+def _dos_date_time( mtime ):
+    date_time = time.localtime( mtime )[ 0:6 ]
+    if date_time[ 0 ] < 1980:
+        # zip archives can't represent earlier dates
+        date_time = ( 1980, 1, 1, 0, 0, 0 )
+    dosdate = ( date_time[ 0 ] - 1980 ) << 9 | date_time[ 1 ] << 5 | date_time[ 2 ]
+    dostime = date_time[ 3 ] << 11 | date_time[ 4 ] << 5 | ( date_time[ 5 ] // 2 )
+    return dostime, dosdate
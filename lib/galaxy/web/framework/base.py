@@ -8,6 +8,9 @@ import os.path
 import socket
 import tarfile
 import types
+import uuid
+
+from email.utils import formatdate, mktime_tz, parsedate_tz
 
 import pkg_resources
 
@@ -70,6 +73,8 @@ class WebApplication( object ):
         self.transaction_factory = DefaultWebTransaction
         # Set if trace logging is enabled
         self.trace_logger = None
+        # Set if SQL profiling is enabled
+        self.query_profiler = None
 
     def add_ui_controller( self, controller_name, controller ):
         """
@@ -128,12 +133,35 @@ class WebApplication( object ):
         if self.trace_logger:
             self.trace_logger.context_set( "request_id", request_id )
         self.trace( message="Starting request" )
+        if self.query_profiler:
+            start_response = self.start_query_profile( environ, start_response )
         try:
             return self.handle_request( environ, start_response )
         finally:
             self.trace( message="Handle request finished" )
             if self.trace_logger:
                 self.trace_logger.context_remove( "request_id" )
+            if self.query_profiler:
+                self.query_profiler.finish()
+
+    def start_query_profile( self, environ, start_response ):
+        """
+        Start profiling the SQL issued handling this request and, if this
+        request is sampled and enabled, wrap `start_response` to add a
+        summary of the profile to the response headers.
+        """
+        name = "%s %s" % ( environ.get( 'REQUEST_METHOD', 'GET' ), environ.get( 'PATH_INFO', '' ) )
+        profile = self.query_profiler.start( name )
+        if profile is None or not self.query_profiler.response_headers:
+            return start_response
+
+        def profiled_start_response( status, headers, exc_info=None ):
+            headers = list( headers ) + profile.headers()
+            headers.append( ( 'X-Galaxy-SQL-Profile-Id', str( profile.id ) ) )
+            if exc_info is None:
+                return start_response( status, headers )
+            return start_response( status, headers, exc_info )
+        return profiled_start_response
 
     def handle_request( self, environ, start_response ):
         # Grab the request_id (should have been set by middleware)
@@ -407,6 +435,9 @@ class Response( object ):
 
 CHUNK_SIZE = 2**16
 
+# Requests for more ranges than this are answered with the whole file.
+MAX_BYTE_RANGES = 20
+
 def send_file( start_response, trans, body ):
     # If configured use X-Accel-Redirect header for nginx
     base = trans.app.config.nginx_x_accel_redirect_base
@@ -418,13 +449,135 @@ def send_file( start_response, trans, body ):
     elif apache_xsendfile:
         trans.response.headers['X-Sendfile'] = os.path.abspath( body.name )
         body = [ "" ]
-    # Fall back on sending the file in chunks
+    # Fall back on sending the file (or requested parts of it) in chunks
     else:
-        body = iterate_file( body )
+        body = serve_file( trans, body )
     start_response( trans.response.wsgi_status(),
                     trans.response.wsgi_headeritems() )
     return body
 
+def serve_file( trans, file ):
+    """
+    Set response headers and return an iterable over `file` for the request
+    in `trans` - answering conditional (If-None-Match/If-Modified-Since) and
+    byte range (Range/If-Range) requests when the response is otherwise OK.
+    """
+    response = trans.response
+    environ = trans.environ
+    if not response.wsgi_status().startswith( "200" ) or environ.get( 'REQUEST_METHOD', 'GET' ) not in [ 'GET', 'HEAD' ]:
+        return iterate_file( file )
+
+    stat = os.fstat( file.fileno() )
+    size = stat.st_size
+    last_modified = formatdate( stat.st_mtime, usegmt=True )
+    etag = '"%x-%x-%x"' % ( stat.st_ino, size, int( stat.st_mtime ) )
+    response.headers[ 'accept-ranges' ] = 'bytes'
+    response.headers[ 'etag' ] = etag
+    response.headers[ 'last-modified' ] = last_modified
+
+    if _not_modified( environ, etag, stat.st_mtime ):
+        response.status = "304 Not Modified"
+        file.close()
+        return []
+
+    ranges = None
+    if_range = environ.get( 'HTTP_IF_RANGE', None )
+    if if_range is None or if_range.strip() in [ etag, last_modified ]:
+        ranges = parse_byte_ranges( environ.get( 'HTTP_RANGE', None ), size )
+
+    if ranges is None:
+        response.headers[ 'content-length' ] = str( size )
+        file_wrapper = environ.get( 'wsgi.file_wrapper', None )
+        if file_wrapper:
+            # Let the server stream the file (e.g. with sendfile)
+            return file_wrapper( file, CHUNK_SIZE )
+        return iterate_file( file )
+    elif not ranges:
+        response.status = "416 Requested Range Not Satisfiable"
+        response.headers[ 'content-range' ] = 'bytes */%d' % size
+        response.headers[ 'content-length' ] = '0'
+        file.close()
+        return []
+
+    response.status = "206 Partial Content"
+    if len( ranges ) == 1:
+        start, end = ranges[ 0 ]
+        response.headers[ 'content-range' ] = 'bytes %d-%d/%d' % ( start, end, size )
+        response.headers[ 'content-length' ] = str( end - start + 1 )
+        return iterate_file_range( file, start, end - start + 1 )
+
+    boundary = uuid.uuid4().hex
+    content_type = response.get_content_type()
+    part_headers = [ '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % ( boundary, content_type, start, end, size )
+                     for start, end in ranges ]
+    closing = '\r\n--%s--\r\n' % boundary
+    content_length = sum( [ len( part_header ) + end - start + 1 for part_header, ( start, end ) in zip( part_headers, ranges ) ] ) + len( closing )
+    response.set_content_type( 'multipart/byteranges; boundary=%s' % boundary )
+    response.headers[ 'content-length' ] = str( content_length )
+
+    def iterate_parts():
+        for part_header, ( start, end ) in zip( part_headers, ranges ):
+            yield part_header
+            for chunk in iterate_file_range( file, start, end - start + 1, close=False ):
+                yield chunk
+        yield closing
+        file.close()
+    return iterate_parts()
+
+def _not_modified( environ, etag, mtime ):
+    if_none_match = environ.get( 'HTTP_IF_NONE_MATCH', None )
+    if if_none_match is not None:
+        etags = [ tag.strip() for tag in if_none_match.split( ',' ) ]
+        return etag in etags or '*' in etags
+    if_modified_since = environ.get( 'HTTP_IF_MODIFIED_SINCE', None )
+    if if_modified_since is not None:
+        parsed = parsedate_tz( if_modified_since )
+        if parsed:
+            return int( mtime ) <= mktime_tz( parsed )
+    return False
+
+def parse_byte_ranges( header, size ):
+    """
+    Parse the value of a Range header for a file of `size` bytes into a list
+    of ( first byte, last byte ) pairs (inclusive). Return None if the header
+    is missing or invalid (and so should be ignored) and an empty list if
+    none of the ranges can be satisfied.
+    """
+    if not header:
+        return None
+    units, _, range_set = header.partition( '=' )
+    if units.strip().lower() != 'bytes':
+        return None
+    specs = [ spec.strip() for spec in range_set.split( ',' ) if spec.strip() ]
+    if not specs or len( specs ) > MAX_BYTE_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.partition( '-' )
+        first, last = first.strip(), last.strip()
+        try:
+            if not sep or ( not first and not last ):
+                return None
+            if not first:
+                # suffix range - the last N bytes
+                suffix_length = int( last )
+                if suffix_length <= 0:
+                    continue
+                start, end = max( size - suffix_length, 0 ), size - 1
+            else:
+                start = int( first )
+                end = size - 1
+                if last:
+                    if int( last ) < start:
+                        return None
+                    end = min( int( last ), end )
+        except ValueError:
+            return None
+        if start < 0 or start >= size:
+            continue
+        ranges.append( ( start, end ) )
+    return ranges
+
 def iterate_file( file ):
     """
     Progressively return chunks from `file`.
@@ -435,6 +588,21 @@ def iterate_file( file ):
             break
         yield chunk
 
+def iterate_file_range( file, start, length, close=True ):
+    """
+    Progressively return chunks of the `length` bytes of `file` beginning at
+    `start`.
+    """
+    file.seek( start )
+    while length > 0:
+        chunk = file.read( min( CHUNK_SIZE, length ) )
+        if not chunk:
+            break
+        length -= len( chunk )
+        yield chunk
+    if close:
+        file.close()
+
 def flatten( seq ):
     """
     Flatten a possible nested set of iterables
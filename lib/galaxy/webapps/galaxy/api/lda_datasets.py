@@ -6,7 +6,6 @@ import os
 import os.path
 import string
 import sys
-import tempfile
 import zipfile
 from galaxy import exceptions
 from galaxy import util
@@ -15,7 +14,7 @@ from galaxy.exceptions import ObjectNotFound
 from galaxy.managers import folders, roles
 from galaxy.tools.actions import upload_common
 from galaxy.util.json import dumps
-from galaxy.util.streamball import StreamBall
+from galaxy.util.streamball import StreamBall, ZipStreamBall
 from galaxy.web import _future_expose_api as expose_api
 from galaxy.web import _future_expose_api_anonymous as expose_api_anonymous
 from galaxy.web.base.controller import BaseAPIController, UsesVisualizationMixin
@@ -576,15 +575,10 @@ class LibraryDatasetsController( BaseAPIController, UsesVisualizationMixin ):
                 try:
                     outext = 'zip'
                     if format == 'zip':
-                        # Can't use mkstemp - the file must not exist first
-                        tmpd = tempfile.mkdtemp()
-                        util.umask_fix_perms( tmpd, trans.app.config.umask, 0777, self.app.config.gid )
-                        tmpf = os.path.join( tmpd, 'library_download.' + format )
                         if trans.app.config.upstream_gzip:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_STORED, True )
+                            archive = ZipStreamBall( zipfile.ZIP_STORED )
                         else:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED, True )
-                        archive.add = lambda x, y: archive.write( x, y.encode( 'CP437' ) )
+                            archive = ZipStreamBall( zipfile.ZIP_DEFLATED )
                     elif format == 'tgz':
                         if trans.app.config.upstream_gzip:
                             archive = StreamBall( 'w|' )
@@ -679,10 +673,8 @@ class LibraryDatasetsController( BaseAPIController, UsesVisualizationMixin ):
                 lname = 'selected_dataset'
                 fname = lname.replace( ' ', '_' ) + '_files'
                 if format == 'zip':
-                    archive.close()
                     trans.response.set_content_type( "application/octet-stream" )
                     trans.response.headers[ "Content-Disposition" ] = 'attachment; filename="%s.%s"' % ( fname, outext )
-                    archive = util.streamball.ZipBall( tmpf, tmpd )
                     archive.wsgi_status = trans.response.wsgi_status()
                     archive.wsgi_headeritems = trans.response.wsgi_headeritems()
                     return archive.stream
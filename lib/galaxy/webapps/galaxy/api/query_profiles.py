@@ -0,0 +1,72 @@
+"""
+API operations on the SQL profiles of recent web requests and job handler
+cycles.
+
+.. seealso:: :class:`galaxy.model.orm.query_profiling.QueryProfiler`
+"""
+from galaxy import exceptions
+from galaxy import util
+from galaxy.web import _future_expose_api as expose_api
+from galaxy.web.base.controller import BaseAPIController
+
+import logging
+log = logging.getLogger( __name__ )
+
+
+class QueryProfilesController( BaseAPIController ):
+
+    @expose_api
+    def index( self, trans, n_plus_one=False, **kwd ):
+        """
+        GET /api/query_profiles
+
+        Summarize the recent SQL profiles, most recent first.
+
+        :type   n_plus_one: boolean
+        :param  n_plus_one: only return profiles in which statements were
+                            repeated from a single call site often enough to
+                            indicate an N+1 query pattern
+
+        :rtype:     list
+        :returns:   list of dictionaries summarizing profiles - query count,
+                    query time and number of repeated statements
+        """
+        profiler = self.__profiler( trans )
+        n_plus_one = util.asbool( n_plus_one )
+        rval = []
+        for profile in reversed( list( profiler.recent ) ):
+            if n_plus_one and not profile.n_plus_one:
+                continue
+            rval.append( profile.to_dict() )
+        return rval
+
+    @expose_api
+    def show( self, trans, id, **kwd ):
+        """
+        GET /api/query_profiles/{id}
+
+        :type   id: int
+        :param  id: the id of the profile (also sent in the
+                    ``X-Galaxy-SQL-Profile-Id`` header of sampled requests
+                    when ``database_query_profiling_headers`` is enabled)
+
+        :rtype:     dictionary
+        :returns:   the profile, including the slowest statements and the
+                    statements executed grouped by shape and call site
+        """
+        profiler = self.__profiler( trans )
+        try:
+            profile = profiler.get( int( id ) )
+        except ValueError:
+            raise exceptions.MalformedId( "Invalid profile id ( %s ) specified" % str( id ) )
+        if profile is None:
+            raise exceptions.ObjectNotFound( "Profile %s is no longer available" % str( id ) )
+        return profile.to_dict( view='element' )
+
+    def __profiler( self, trans ):
+        if not trans.user_is_admin():
+            raise exceptions.AdminRequiredException( "Only administrators can view SQL profiles." )
+        profiler = trans.app.query_profiler
+        if profiler is None:
+            raise exceptions.ConfigDoesNotAllowException( "SQL profiling is not enabled ( see database_query_profiling_sample_rate )." )
+        return profiler
@@ -16,9 +16,23 @@ class SearchController( BaseAPIController, SharableItemSecurityMixin ):
         """
         POST /api/search
         Do a search of the various elements of Galaxy.
+
+        :type   payload: dict
+        :param  payload: dictionary containing the GQL ``query`` and optionally
+                         ``limit`` (the maximum number of results to return)
+                         and ``offset`` (the number of results to skip) to page
+                         through the results.
         """
         query_txt = payload.get("query", None)
+        try:
+            limit = payload.get("limit", None)
+            if limit is not None:
+                limit = int(limit)
+            offset = int(payload.get("offset", 0))
+        except ValueError, e:
+            return {'error' : str(e)}
         out = []
+        skipped = 0
         if query_txt is not None:
             se = GalaxySearchEngine()
             try:
@@ -60,6 +74,12 @@ class SearchController( BaseAPIController, SharableItemSecurityMixin ):
                                 append = True
 
                     if append:
+                        if skipped < offset:
+                            skipped += 1
+                            continue
+                        if limit is not None and len( out ) >= limit:
+                            # Results are streamed, stop before fetching more.
+                            break
                         row = query.item_to_api_value(item)
                         out.append( self.encode_all_ids( trans, row, True) )
         return { 'results' : out }
@@ -17,6 +17,7 @@ from galaxy.web.base.controller import UsesHistoryMixin
 from galaxy.web.base.controller import SharableMixin
 from galaxy.workflow.extract import extract_workflow
 from galaxy.workflow.run import invoke
+from galaxy.workflow.run import queue_invoke
 from galaxy.workflow.run_request import build_workflow_run_config
 
 log = logging.getLogger(__name__)
@@ -123,7 +124,10 @@ class WorkflowsAPIController(BaseAPIController, UsesStoredWorkflowMixin, UsesHis
 
         If installed_repository_file or from_history_id is specified a new
         workflow will be created for this user. Otherwise, workflow_id must be
-        specified and this API method will cause a workflow to execute.
+        specified and this API method will cause a workflow to execute. If
+        Galaxy is configured to schedule workflows in the background, the
+        created workflow invocation (including its id, state and per-step
+        progress) is returned immediately instead of the workflow outputs.
 
         :param  installed_repository_file    The path of a workflow to import. Either workflow_id, installed_repository_file or from_history_id must be specified
         :type   installed_repository_file    str
@@ -222,6 +226,18 @@ class WorkflowsAPIController(BaseAPIController, UsesStoredWorkflowMixin, UsesHis
         run_config = build_workflow_run_config( trans, workflow, payload )
         history = run_config.target_history
 
+        if trans.app.config.schedule_workflows_in_background:
+            # Only input steps are scheduled now, a job handler schedules
+            # the rest - return the invocation so progress can be tracked.
+            workflow_invocation = queue_invoke(
+                trans=trans,
+                workflow=workflow,
+                workflow_run_config=run_config,
+            )
+            rval = self.__encode_invocation( trans, workflow_invocation )
+            rval['history'] = trans.security.encode_id( history.id )
+            return rval
+
         # invoke may throw MessageExceptions on tool erors, failure
         # to match up inputs, etc...
         outputs = invoke(
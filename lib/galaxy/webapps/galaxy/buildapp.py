@@ -171,6 +171,7 @@ def populate_api_routes( webapp, app ):
 
     webapp.mapper.resource( 'dataset', 'datasets', path_prefix='/api' )
     webapp.mapper.resource( 'tool_data', 'tool_data', path_prefix='/api' )
+    webapp.mapper.resource( 'query_profile', 'query_profiles', path_prefix='/api' )
     webapp.mapper.resource( 'dataset_collection', 'dataset_collections', path_prefix='/api/')
     webapp.mapper.resource( 'sample', 'samples', path_prefix='/api' )
     webapp.mapper.resource( 'request', 'requests', path_prefix='/api' )
@@ -407,6 +408,8 @@ def populate_api_routes( webapp, app ):
     # Connect logger from app
     if app.trace_logger:
         webapp.trace_logger = app.trace_logger
+    if app.query_profiler:
+        webapp.query_profiler = app.query_profiler
 
     # metrics logging API
     #webapp.mapper.connect( "index", "/api/metrics",
@@ -17,7 +17,7 @@ from galaxy.security import Action
 from galaxy.tools.actions import upload_common
 from galaxy.util import inflector
 from galaxy.util.json import dumps, loads
-from galaxy.util.streamball import StreamBall
+from galaxy.util.streamball import StreamBall, ZipStreamBall
 from galaxy.web.base.controller import BaseUIController, UsesFormDefinitionsMixin, UsesExtendedMetadataMixin, UsesLibraryMixinItems
 from galaxy.web.form_builder import AddressField, CheckboxField, SelectField, build_select_field
 from galaxy.model.orm import and_, eagerload_all
@@ -1845,15 +1845,10 @@ class LibraryCommon( BaseUIController, UsesFormDefinitionsMixin, UsesExtendedMet
                 try:
                     outext = 'zip'
                     if action == 'zip':
-                        # Can't use mkstemp - the file must not exist first
-                        tmpd = tempfile.mkdtemp()
-                        util.umask_fix_perms( tmpd, trans.app.config.umask, 0777, self.app.config.gid )
-                        tmpf = os.path.join( tmpd, 'library_download.' + action )
                         if trans.app.config.upstream_gzip:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_STORED, True )
+                            archive = ZipStreamBall( zipfile.ZIP_STORED )
                         else:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED, True )
-                        archive.add = lambda x, y: archive.write( x, y.encode('CP437') )
+                            archive = ZipStreamBall( zipfile.ZIP_DEFLATED )
                     elif action == 'tgz':
                         if trans.app.config.upstream_gzip:
                             archive = StreamBall( 'w|' )
@@ -1940,10 +1935,8 @@ class LibraryCommon( BaseUIController, UsesFormDefinitionsMixin, UsesExtendedMet
                             lname = 'selected_dataset'
                         fname = lname.replace( ' ', '_' ) + '_files'
                         if action == 'zip':
-                            archive.close()
                             trans.response.set_content_type( "application/x-zip-compressed" )
                             trans.response.headers[ "Content-Disposition" ] = 'attachment; filename="%s.%s"' % (fname,outext)
-                            archive = util.streamball.ZipBall(tmpf, tmpd)
                             archive.wsgi_status = trans.response.wsgi_status()
                             archive.wsgi_headeritems = trans.response.wsgi_headeritems()
                             return archive.stream
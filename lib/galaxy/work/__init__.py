@@ -0,0 +1,4 @@
+"""
+Abstractions for performing Galaxy work (executing tools, scheduling
+workflows, etc...) outside of a web request.
+"""
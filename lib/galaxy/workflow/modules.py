@@ -663,7 +663,7 @@ class ToolModule( WorkflowModule ):
             param_combinations=param_combinations,
             history=invocation.history,
             collection_info=collection_info,
-            workflow_invocation_uuid=invocation.uuid
+            workflow_invocation_uuid=invocation.uuid.hex
         )
         if collection_info:
             step_outputs = dict( execution_tracker.created_collections )
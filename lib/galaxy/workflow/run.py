@@ -6,54 +6,81 @@ from galaxy import util
 from galaxy.util.odict import odict
 from galaxy.workflow import modules
 from galaxy.workflow.run_request import WorkflowRunConfig
+from galaxy.workflow.run_request import workflow_run_config_to_request
+from galaxy.workflow.run_request import INPUT_STEP_TYPES
 
 import logging
 log = logging.getLogger( __name__ )
 
 
-def invoke( trans, workflow, workflow_run_config, populate_state=False ):
+def invoke( trans, workflow, workflow_run_config, workflow_invocation=None, populate_state=False, max_steps=None ):
     """ Run the supplied workflow in the supplied target_history.
+
+    If ``workflow_invocation`` is supplied, scheduling of a previously queued
+    (see ``queue_invoke``) invocation is resumed - only steps not yet
+    scheduled are run and at most ``max_steps`` of them are run per call.
     """
     if populate_state:
         modules.populate_module_and_state( trans, workflow, workflow_run_config.param_map )
 
-    return WorkflowInvoker(
+    invoker = WorkflowInvoker(
         trans,
         workflow,
         workflow_run_config,
-    ).invoke()
+        workflow_invocation=workflow_invocation,
+    )
+    return invoker.invoke( max_steps=max_steps )
+
+
+def queue_invoke( trans, workflow, workflow_run_config, populate_state=True ):
+    """ Persist an invocation of the supplied workflow and hand it off to the
+    workflow scheduling manager - only input steps are scheduled in this
+    request, remaining steps are scheduled in the background by a job
+    handler.
+    """
+    if populate_state:
+        modules.populate_module_and_state( trans, workflow, workflow_run_config.param_map )
+
+    workflow_invocation = workflow_run_config_to_request( trans, workflow_run_config, workflow )
+    invoker = WorkflowInvoker(
+        trans,
+        workflow,
+        workflow_run_config,
+        workflow_invocation=workflow_invocation,
+    )
+    input_steps = [ step for step in workflow.steps if step.type in INPUT_STEP_TYPES ]
+    invoker.invoke_steps( input_steps )
+    trans.sa_session.add( workflow_invocation )
+    return trans.app.workflow_scheduling_manager.queue( workflow_invocation )
 
 
 class WorkflowInvoker( object ):
 
-    def __init__( self, trans, workflow, workflow_run_config ):
+    def __init__( self, trans, workflow, workflow_run_config, workflow_invocation=None ):
         self.trans = trans
         self.workflow = workflow
-        workflow_invocation = model.WorkflowInvocation()
-        workflow_invocation.workflow = self.workflow
-        self.workflow_invocation = workflow_invocation
-        self.progress = WorkflowProgress( self.workflow_invocation, workflow_run_config.inputs )
-
-        invocation_uuid = uuid.uuid1().hex
+        if workflow_invocation is None:
+            workflow_invocation = model.WorkflowInvocation()
+            workflow_invocation.workflow = self.workflow
+            workflow_invocation.uuid = uuid.uuid1()
+            workflow_invocation.history = workflow_run_config.target_history
 
-        # In one way or another, following attributes will become persistent
-        # so they are available during delayed/revisited workflow scheduling.
-        self.workflow_invocation.uuid = invocation_uuid
-        self.workflow_invocation.history = workflow_run_config.target_history
+        self.workflow_invocation = workflow_invocation
+        # Not persisted - only needed by input steps which are always
+        # scheduled when the invocation is first created.
         self.workflow_invocation.copy_inputs_to_history = workflow_run_config.copy_inputs_to_history
         self.workflow_invocation.replacement_dict = workflow_run_config.replacement_dict
+        self.progress = WorkflowProgress( self.workflow_invocation, workflow_run_config.inputs )
 
-    def invoke( self ):
+    def invoke( self, max_steps=None ):
         workflow_invocation = self.workflow_invocation
         remaining_steps = self.progress.remaining_steps()
-        for step in remaining_steps:
-            jobs = self._invoke_step( step )
-            for job in util.listify( jobs ):
-                # Record invocation
-                workflow_invocation_step = model.WorkflowInvocationStep()
-                workflow_invocation_step.workflow_invocation = workflow_invocation
-                workflow_invocation_step.workflow_step = step
-                workflow_invocation_step.job = job
+        if max_steps is not None:
+            remaining_steps = remaining_steps[ :max_steps ]
+        self.invoke_steps( remaining_steps )
+
+        if not self.progress.remaining_steps():
+            workflow_invocation.state = model.WorkflowInvocation.states.SCHEDULED
 
         # All jobs ran successfully, so we can save now
         self.trans.sa_session.add( workflow_invocation )
@@ -62,6 +89,11 @@ class WorkflowInvoker( object ):
         # invocations.
         return self.progress.outputs
 
+    def invoke_steps( self, steps ):
+        for step in steps:
+            jobs = self._invoke_step( step )
+            self.progress.mark_step_scheduled( step, jobs )
+
     def _invoke_step( self, step ):
         jobs = step.module.execute( self.trans, self.progress, self.workflow_invocation, step )
         return jobs
@@ -73,11 +105,28 @@ class WorkflowProgress( object ):
         self.outputs = odict()
         self.workflow_invocation = workflow_invocation
         self.inputs_by_step_id = inputs_by_step_id
+        # Recover outputs of steps scheduled during previous scheduling
+        # iterations.
+        self.outputs.update( workflow_invocation.get_outputs() )
+        self.scheduled_step_ids = workflow_invocation.scheduled_step_ids
 
     def remaining_steps(self):
         steps = self.workflow_invocation.workflow.steps
 
-        return steps
+        return [ step for step in steps if step.id not in self.scheduled_step_ids ]
+
+    def mark_step_scheduled( self, step, jobs ):
+        """ Record a ``WorkflowInvocationStep`` for each job created for
+        ``step`` (or just one with no job if none were created) so step
+        scheduling progress is persisted with the invocation.
+        """
+        jobs = util.listify( jobs ) or [ None ]
+        for job in jobs:
+            workflow_invocation_step = model.WorkflowInvocationStep()
+            workflow_invocation_step.workflow_invocation = self.workflow_invocation
+            workflow_invocation_step.workflow_step = step
+            workflow_invocation_step.job = job
+        self.scheduled_step_ids.add( step.id )
 
     def replacement_for_tool_input( self, step, input, prefixed_name ):
         """ For given workflow 'step' that has had input_connections_by_name
@@ -110,6 +159,8 @@ class WorkflowProgress( object ):
 
     def set_step_outputs(self, step, outputs):
         self.outputs[ step.id ] = outputs
+        for output_name, output_object in outputs.iteritems():
+            self.workflow_invocation.add_output( step, output_name, output_object )
 
 
-__all__ = [ invoke, WorkflowRunConfig ]
+__all__ = [ invoke, queue_invoke, WorkflowRunConfig ]
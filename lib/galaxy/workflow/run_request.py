@@ -1,4 +1,8 @@
+import uuid
+
 from galaxy import exceptions
+from galaxy import model
+from galaxy import util
 
 from galaxy.managers import histories
 
@@ -231,6 +235,60 @@ def build_workflow_run_config( trans, workflow, payload ):
     return run_config
 
 
+def workflow_run_config_to_request( trans, run_config, workflow ):
+    """ Build a new (unsaved) ``WorkflowInvocation`` persisting everything
+    from ``run_config`` required to schedule the remaining (non-input) steps
+    of ``workflow`` later, outside of this request.
+    """
+    param_types = model.WorkflowRequestInputParameter.types
+
+    workflow_invocation = model.WorkflowInvocation()
+    workflow_invocation.uuid = uuid.uuid1()
+    workflow_invocation.history = run_config.target_history
+    workflow_invocation.workflow = workflow
+
+    def add_parameter( name, value, type ):
+        workflow_invocation.add_input_parameter( name, value, type )
+
+    for name, value in run_config.replacement_dict.iteritems():
+        add_parameter(
+            name=name,
+            value=value,
+            type=param_types.REPLACEMENT_PARAMETERS,
+        )
+
+    for step in workflow.steps:
+        step_state = run_config.param_map.get( step.id, None )
+        if step_state:
+            workflow_invocation.add_step_state( step, step_state )
+
+    add_parameter( "copy_inputs_to_history", "true" if run_config.copy_inputs_to_history else "false", param_types.META_PARAMETERS )
+    return workflow_invocation
+
+
+def workflow_request_to_run_config( work_request_context, workflow_invocation ):
+    """ Inverse of ``workflow_run_config_to_request`` - rebuild a
+    ``WorkflowRunConfig`` from a persisted ``WorkflowInvocation``.
+    """
+    param_types = model.WorkflowRequestInputParameter.types
+    replacement_dict = workflow_invocation.get_input_parameters( param_types.REPLACEMENT_PARAMETERS )
+    meta_parameters = workflow_invocation.get_input_parameters( param_types.META_PARAMETERS )
+    copy_inputs_to_history = util.string_as_bool( meta_parameters.get( "copy_inputs_to_history", "false" ) )
+    # Copy step states, populating module state may modify these in place.
+    param_map = dict( [ ( step_id, dict( state ) ) for step_id, state in workflow_invocation.get_step_states().iteritems() ] )
+
+    # Input steps were scheduled when the request was made, their outputs
+    # have been recorded on the invocation so no inputs are needed here.
+    workflow_run_config = WorkflowRunConfig(
+        target_history=workflow_invocation.history,
+        replacement_dict=replacement_dict,
+        copy_inputs_to_history=copy_inputs_to_history,
+        inputs={},
+        param_map=param_map,
+    )
+    return workflow_run_config
+
+
 def __decode_id( trans, workflow_id, model_type="workflow" ):
     try:
         return trans.security.decode_id( workflow_id )
@@ -0,0 +1,164 @@
+"""
+Background scheduling of workflow invocations.
+
+Web threads persist workflow invocations (see
+``galaxy.workflow.run.queue_invoke``) and assign them to a job handler. Each
+job handler runs a ``WorkflowSchedulingMonitor`` thread that picks up the
+invocations assigned to it and schedules their remaining steps incrementally
+- a bounded number of steps per invocation per iteration and a bounded number
+of invocations active at once.
+"""
+import os
+import threading
+
+from galaxy import model
+from galaxy.util.sleeper import Sleeper
+from galaxy.work import context
+from galaxy.workflow import run
+from galaxy.workflow import run_request
+
+import logging
+log = logging.getLogger( __name__ )
+
+DEFAULT_SCHEDULER_ID = "core"
+
+
+class WorkflowSchedulingManager( object ):
+    """ A workflow scheduling manager - queues workflow invocations to job
+    handlers and, in job handler processes, runs the monitor thread
+    scheduling them.
+    """
+
+    def __init__( self, app ):
+        self.app = app
+        if app.config.schedule_workflows_in_background and self.__is_handler():
+            self.monitor = WorkflowSchedulingMonitor( app )
+        else:
+            self.monitor = None
+
+    def start( self ):
+        if self.monitor:
+            self.monitor.start()
+
+    def shutdown( self ):
+        if self.monitor:
+            self.monitor.shutdown()
+
+    def queue( self, workflow_invocation ):
+        """ Mark ``workflow_invocation`` as new, assign it to a handler and
+        persist it - the handler will schedule it on its next iteration.
+        """
+        workflow_invocation.state = model.WorkflowInvocation.states.NEW
+        workflow_invocation.scheduler = DEFAULT_SCHEDULER_ID
+        workflow_invocation.handler = self.__assign_handler()
+
+        sa_session = self.app.model.context
+        sa_session.add( workflow_invocation )
+        sa_session.flush()
+        return workflow_invocation
+
+    def __assign_handler( self ):
+        if not self.app.config.track_jobs_in_database:
+            return self.app.config.server_name
+        return self.app.job_config.get_handler( None )
+
+    def __is_handler( self ):
+        config = self.app.config
+        return not config.track_jobs_in_database or self.app.job_config.is_handler( config.server_name )
+
+
+class WorkflowSchedulingMonitor( object ):
+    """ Thread scheduling the steps of workflow invocations assigned to this
+    job handler.
+    """
+
+    def __init__( self, app ):
+        self.app = app
+        self.sa_session = app.model.context
+        config = app.config
+        self.server_name = config.server_name
+        self.maximum_active_invocations = config.maximum_workflow_invocations_per_handler
+        self.steps_per_iteration = config.workflow_scheduling_steps_per_iteration or None
+        self.sleep_seconds = config.workflow_scheduling_sleep
+
+        # Keep track of the pid that started the monitor, only it has a
+        # valid thread.
+        self.parent_pid = os.getpid()
+        self.sleeper = Sleeper()
+        self.running = True
+        self.monitor_thread = threading.Thread( name="WorkflowSchedulingMonitor.monitor_thread", target=self.__monitor )
+        self.monitor_thread.setDaemon( True )
+
+    def start( self ):
+        self.monitor_thread.start()
+        log.info( "workflow scheduling monitor started" )
+
+    def shutdown( self ):
+        if self.parent_pid != os.getpid():
+            return
+        self.running = False
+        self.sleeper.wake()
+        log.info( "workflow scheduling monitor stopped" )
+
+    def __monitor( self ):
+        while self.running:
+            try:
+                self.__monitor_step()
+            except Exception:
+                log.exception( "Exception in workflow scheduling monitor_step" )
+            self.sleeper.sleep( self.sleep_seconds )
+
+    def __monitor_step( self ):
+        # Clear the session so invocation, job, and dataset states are fresh.
+        self.sa_session.expunge_all()
+        for workflow_invocation in self.__active_invocations():
+            if not self.running:
+                break
+            self.__schedule( workflow_invocation )
+
+    def __active_invocations( self ):
+        """ Return invocations assigned to this handler being scheduled,
+        promoting new invocations to ready while there are fewer than
+        ``maximum_workflow_invocations_per_handler`` active ones.
+        """
+        states = model.WorkflowInvocation.states
+        query = self.sa_session.query( model.WorkflowInvocation ).filter(
+            model.WorkflowInvocation.handler == self.server_name
+        ).order_by( model.WorkflowInvocation.id )
+        active = query.filter( model.WorkflowInvocation.state == states.READY ).all()
+
+        new_query = query.filter( model.WorkflowInvocation.state == states.NEW )
+        if self.maximum_active_invocations > 0:
+            open_slots = self.maximum_active_invocations - len( active )
+            if open_slots <= 0:
+                return active
+            new_query = new_query.limit( open_slots )
+        new_invocations = new_query.all()
+        for workflow_invocation in new_invocations:
+            workflow_invocation.state = states.READY
+        if new_invocations:
+            self.sa_session.flush()
+        return active + new_invocations
+
+    def __schedule( self, workflow_invocation ):
+        history = workflow_invocation.history
+        work_request_context = context.WorkRequestContext(
+            app=self.app,
+            history=history,
+            user=history.user,
+        )
+        try:
+            workflow_run_config = run_request.workflow_request_to_run_config( work_request_context, workflow_invocation )
+            run.invoke(
+                trans=work_request_context,
+                workflow=workflow_invocation.workflow,
+                workflow_run_config=workflow_run_config,
+                workflow_invocation=workflow_invocation,
+                populate_state=True,
+                max_steps=self.steps_per_iteration,
+            )
+        except Exception:
+            log.exception( "(%s) Failed to schedule workflow invocation, marking it as failed." % workflow_invocation.id )
+            workflow_invocation.state = model.WorkflowInvocation.states.FAILED
+        self.sa_session.add( workflow_invocation )
+        self.sa_session.flush()
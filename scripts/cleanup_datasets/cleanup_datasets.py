@@ -14,7 +14,7 @@ from galaxy import eggs
 import pkg_resources  
 pkg_resources.require( "SQLAlchemy >= 0.4" )
 
-import time, ConfigParser, shutil
+import time, ConfigParser, threading, Queue, json
 from datetime import datetime, timedelta
 from time import strftime
 from optparse import OptionParser
@@ -23,11 +23,14 @@ import galaxy.config
 import galaxy.model.mapping
 import sqlalchemy as sa
 from galaxy.model.orm import and_, eagerload
-from galaxy.objectstore import build_object_store_from_config
-from galaxy.exceptions import ObjectNotFound
+from galaxy.objectstore import build_object_store_from_config, DistributedObjectStore
+from galaxy.util.bunch import Bunch
+from galaxy.util.odict import odict
 
 assert sys.version_info[:2] >= ( 2, 4 )
 
+DEFAULT_BATCH_SIZE = 1000
+
 def main():
     """
     Managing library datasets is a bit complex, so here is a scenario that hopefully provides clarification.  The complexities
@@ -77,6 +80,9 @@ def main():
     parser.add_option( "-4", "--purge_libraries", action="store_true", dest="purge_libraries", default=False, help="purge deleted libraries" )
     parser.add_option( "-5", "--purge_folders", action="store_true", dest="purge_folders", default=False, help="purge deleted library folders" )
     parser.add_option( "-6", "--delete_datasets", action="store_true", dest="delete_datasets", default=False, help="mark deletable datasets as deleted and purge associated dataset instances" )
+    parser.add_option( "-b", "--batch_size", dest="batch_size", action="store", type="int", help="number of datasets to process per batch (%d)" % DEFAULT_BATCH_SIZE, default=DEFAULT_BATCH_SIZE )
+    parser.add_option( "-w", "--workers", dest="workers", action="store", type="int", help="number of threads removing dataset files from the object store (1)", default=1 )
+    parser.add_option( "-c", "--checkpoint", dest="checkpoint", action="store", help="file recording the progress of --purge_datasets, an interrupted run resumes from it", default=None )
 
     ( options, args ) = parser.parse_args()
     ini_file = args[0]
@@ -89,6 +95,9 @@ def main():
     
     if options.remove_from_disk and options.info_only:
         parser.error( "remove_from_disk and info_only are mutually exclusive" )
+
+    if options.batch_size < 1 or options.workers < 1:
+        parser.error( "batch_size and workers must be positive" )
     
     config_parser = ConfigParser.ConfigParser( {'here':os.getcwd()} )
     config_parser.read( ini_file )
@@ -117,13 +126,18 @@ def main():
     elif options.purge_histories:
         purge_histories( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry )
     elif options.purge_datasets:
-        purge_datasets( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry )
+        checkpoint = None
+        if options.checkpoint and not options.info_only:
+            checkpoint = CleanupCheckpoint( options.checkpoint )
+        purge_datasets( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry,
+                        batch_size = options.batch_size, workers = options.workers, checkpoint = checkpoint )
     elif options.purge_libraries:
         purge_libraries( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry )
     elif options.purge_folders:
         purge_folders( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry )
     elif options.delete_datasets:
-        delete_datasets( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry )
+        delete_datasets( app, cutoff_time, options.remove_from_disk, info_only = options.info_only, force_retry = options.force_retry,
+                         batch_size = options.batch_size )
     
     app.shutdown()
     sys.exit(0)
@@ -251,8 +265,9 @@ def purge_folders( app, cutoff_time, remove_from_disk, info_only = False, force_
     print "Elapsed time: ", stop - start
     print "##########################################" 
 
-def delete_datasets( app, cutoff_time, remove_from_disk, info_only = False, force_retry = False ):
+def delete_datasets( app, cutoff_time, remove_from_disk, info_only = False, force_retry = False, batch_size = DEFAULT_BATCH_SIZE ):
     # Marks datasets as deleted if associated items are all deleted.
+    metrics = PhaseMetrics( "delete_datasets" )
     start = time.time()
     if force_retry:
         history_dataset_ids_query = sa.select( ( app.model.Dataset.table.c.id,
@@ -281,7 +296,6 @@ def delete_datasets( app, cutoff_time, remove_from_disk, info_only = False, forc
                                                 from_obj = [ app.model.LibraryDataset.table ] )
     deleted_dataset_count = 0
     deleted_instance_count = 0
-    skip = []
     # Handle library datasets.  This is a bit tricky, so here's some clarification.  We have a list of all
     # LibraryDatasets that were marked deleted before our cutoff_time, but have not yet been marked purged.
     # A LibraryDataset object is marked purged when all of its LibraryDatasetDatasetAssociations have been
@@ -314,57 +328,86 @@ def delete_datasets( app, cutoff_time, remove_from_disk, info_only = False, forc
         app.sa_session.add( ld )
         print "Marked LibraryDataset id %d as purged" % ld.id
         app.sa_session.flush()
+    metrics.record( "library_datasets", len( library_dataset_ids ), start )
     # Add all datasets associated with Histories to our list
+    step_start = time.time()
     dataset_ids.extend( [ row.id for row in history_dataset_ids_query.execute() ] )
-    # Process each of the Dataset objects
-    for dataset_id in dataset_ids:
-        dataset = app.sa_session.query( app.model.Dataset ).get( dataset_id )
-        if dataset.id in skip:
-            continue
-        skip.append( dataset.id )
-        print "######### Processing dataset id:", dataset_id
-        if not _dataset_is_deletable( dataset ):
-            print "Dataset is not deletable (shared between multiple histories/libraries, at least one is not deleted)"
-            continue
-        deleted_dataset_count += 1
-        for dataset_instance in dataset.history_associations + dataset.library_associations:
-            # Mark each associated HDA as deleted
-            _purge_dataset_instance( dataset_instance, app, remove_from_disk, include_children=True, info_only=info_only, is_deletable=True )
-            deleted_instance_count += 1
+    # A dataset appears once per association, process each of them only once.
+    dataset_ids = sorted( set( dataset_ids ) )
+    metrics.record( "select", len( dataset_ids ), step_start )
+    # Process the Dataset objects in batches, loading each batch with a single query
+    for i in range( 0, len( dataset_ids ), batch_size ):
+        step_start = time.time()
+        batch_ids = dataset_ids[ i:i + batch_size ]
+        datasets = app.sa_session.query( app.model.Dataset ) \
+                                 .filter( app.model.Dataset.table.c.id.in_( batch_ids ) ) \
+                                 .order_by( app.model.Dataset.table.c.id )
+        for dataset in datasets:
+            print "######### Processing dataset id:", dataset.id
+            if not _dataset_is_deletable( dataset ):
+                print "Dataset is not deletable (shared between multiple histories/libraries, at least one is not deleted)"
+                continue
+            deleted_dataset_count += 1
+            for dataset_instance in dataset.history_associations + dataset.library_associations:
+                # Mark each associated HDA as deleted
+                _purge_dataset_instance( dataset_instance, app, remove_from_disk, include_children=True, info_only=info_only, is_deletable=True )
+                deleted_instance_count += 1
+        metrics.record( "delete", len( batch_ids ), step_start, verbose=True )
     stop = time.time()
-    print "Examined %d datasets, marked %d datasets and %d dataset instances (HDA) as deleted" % ( len( skip ), deleted_dataset_count, deleted_instance_count )
+    print "Examined %d datasets, marked %d datasets and %d dataset instances (HDA) as deleted" % ( len( dataset_ids ), deleted_dataset_count, deleted_instance_count )
+    metrics.report()
     print "Total elapsed time: ", stop - start
     print "##########################################" 
 
-def purge_datasets( app, cutoff_time, remove_from_disk, info_only = False, force_retry = False ):
+def purge_datasets( app, cutoff_time, remove_from_disk, info_only = False, force_retry = False, batch_size = DEFAULT_BATCH_SIZE, workers = 1, checkpoint = None ):
     # Purges deleted datasets whose update_time is older than cutoff_time.  Files may or may
-    # not be removed from disk.
+    # not be removed from disk.  Datasets are handled in batches of increasing id - the files
+    # of a batch are removed by a pool of worker threads, the batch is flushed at once and the
+    # last id of the batch is then recorded in the checkpoint (if any) for interrupted runs.
+    phase = "purge_datasets"
     dataset_count = 0
     disk_space = 0
+    metrics = PhaseMetrics( phase )
+    deleter = ObjectStoreDeleter( app.object_store, workers )
     start = time.time()
-    if force_retry:
+    last_id = 0
+    if checkpoint is not None:
+        last_id = checkpoint.last_id( phase )
+        if last_id:
+            print "Resuming after dataset id %d (from checkpoint %s)" % ( last_id, checkpoint.path )
+    criteria = [ app.model.Dataset.table.c.deleted==True,
+                 app.model.Dataset.table.c.purgable==True,
+                 app.model.Dataset.table.c.update_time < cutoff_time ]
+    if not force_retry:
+        criteria.append( app.model.Dataset.table.c.purged==False )
+    while True:
+        step_start = time.time()
         datasets = app.sa_session.query( app.model.Dataset ) \
-                                 .filter( and_( app.model.Dataset.table.c.deleted==True,
-                                                app.model.Dataset.table.c.purgable==True,
-                                                app.model.Dataset.table.c.update_time < cutoff_time ) )
-    else:
-        datasets = app.sa_session.query( app.model.Dataset ) \
-                                 .filter( and_( app.model.Dataset.table.c.deleted==True,
-                                                app.model.Dataset.table.c.purgable==True,
-                                                app.model.Dataset.table.c.purged==False,
-                                                app.model.Dataset.table.c.update_time < cutoff_time ) )
-    for dataset in datasets:
-        file_size = dataset.file_size
-        _purge_dataset( app, dataset, remove_from_disk, info_only = info_only )
-        dataset_count += 1
-        try:
-            disk_space += file_size
-        except:
-            pass
+                                 .filter( and_( app.model.Dataset.table.c.id > last_id, *criteria ) ) \
+                                 .order_by( app.model.Dataset.table.c.id ) \
+                                 .limit( batch_size ) \
+                                 .all()
+        metrics.record( "select", len( datasets ), step_start )
+        if not datasets:
+            break
+        last_id = datasets[ -1 ].id
+        purged_datasets = _purge_dataset_batch( app, datasets, remove_from_disk, deleter, metrics, info_only = info_only )
+        for dataset in purged_datasets:
+            dataset_count += 1
+            try:
+                disk_space += dataset.file_size
+            except:
+                pass
+        if checkpoint is not None:
+            checkpoint.update( phase, last_id )
+        print "Processed datasets up to id %d, purged %d datasets so far" % ( last_id, dataset_count )
+    if checkpoint is not None:
+        checkpoint.finish( phase )
     stop = time.time()
     print 'Purged %d datasets' % dataset_count
     if remove_from_disk:
         print 'Freed disk space: ', disk_space
+    metrics.report()
     print "Elapsed time: ", stop - start
     print "##########################################" 
 
@@ -445,46 +488,51 @@ def _delete_dataset( dataset, app, remove_from_disk, info_only=False, is_deletab
         else:
             print "Dataset %i will be deleted (without 'info_only' mode)" % ( dataset.id )
 
-def _purge_dataset( app, dataset, remove_from_disk, info_only = False ):
-    if dataset.deleted:
-        try:
-            if dataset.purgable and _dataset_is_deletable( dataset ):
-                if not info_only:
-                    # Remove files from disk and update the database
-                    if remove_from_disk:
-                        # TODO: should permissions on the dataset be deleted here?
-                        print "Removing disk, file ", dataset.file_name
-                        os.unlink( dataset.file_name )
-                        # Remove associated extra files from disk if they exist
-                        if dataset.extra_files_path and os.path.exists( dataset.extra_files_path ):
-                            shutil.rmtree( dataset.extra_files_path ) #we need to delete the directory and its contents; os.unlink would always fail on a directory
-                        usage_users = []
-                        for hda in dataset.history_associations:
-                            if not hda.purged and hda.history.user is not None and hda.history.user not in usage_users:
-                                usage_users.append( hda.history.user )
-                        for user in usage_users:
-                            user.total_disk_usage -= dataset.total_size
-                            app.sa_session.add( user )
-                    print "Purging dataset id", dataset.id
-                    dataset.purged = True
-                    app.sa_session.add( dataset )
-                    app.sa_session.flush()
-                else:
-                    print "Dataset %i will be purged (without 'info_only' mode)" % (dataset.id)
+def _purge_dataset_batch( app, datasets, remove_from_disk, deleter, metrics, info_only = False ):
+    # Purges a batch of deleted datasets, removing their files from disk (with the deleter's pool
+    # of worker threads) if requested, and returns the datasets that were purged.
+    step_start = time.time()
+    purgable_datasets = []
+    for dataset in datasets:
+        if not dataset.deleted:
+            print "Error: dataset %i has not previously been deleted, so it cannot be purged\n" % dataset.id
+        elif not ( dataset.purgable and _dataset_is_deletable( dataset ) ):
+            print "This dataset (%i) is not purgable, the file will not be removed.\n" % dataset.id
+        elif info_only:
+            print "Dataset %i will be purged (without 'info_only' mode)" % dataset.id
+        else:
+            purgable_datasets.append( dataset )
+    metrics.record( "check", len( datasets ), step_start )
+    if not purgable_datasets:
+        return []
+    purged_datasets = purgable_datasets
+    if remove_from_disk:
+        step_start = time.time()
+        removed = deleter.delete( purgable_datasets )
+        purged_datasets = []
+        for dataset in purgable_datasets:
+            if removed.get( dataset.id ):
+                purged_datasets.append( dataset )
             else:
-                print "This dataset (%i) is not purgable, the file (%s) will not be removed.\n" % ( dataset.id, dataset.file_name )
-        except OSError, exc:
-            print "Error, dataset file has already been removed: %s" % str( exc )
-            print "Purging dataset id", dataset.id
-            dataset.purged = True
-            app.sa_session.add( dataset )
-            app.sa_session.flush()
-        except ObjectNotFound:
-            print "Dataset %i cannot be found in the object store" % dataset.id
-        except Exception, exc:
-            print "Error attempting to purge data file: ", dataset.file_name, " error: ", str( exc )
-    else:
-        print "Error: '%s' has not previously been deleted, so it cannot be purged\n" % dataset.file_name
+                print "Error: files of dataset %i could not be removed, it will not be purged" % dataset.id
+        metrics.record( "remove", len( purgable_datasets ), step_start, verbose=True )
+    step_start = time.time()
+    for dataset in purged_datasets:
+        if remove_from_disk:
+            # TODO: should permissions on the dataset be deleted here?
+            usage_users = []
+            for hda in dataset.history_associations:
+                if not hda.purged and hda.history.user is not None and hda.history.user not in usage_users:
+                    usage_users.append( hda.history.user )
+            for user in usage_users:
+                user.total_disk_usage -= dataset.total_size
+                app.sa_session.add( user )
+        print "Purging dataset id", dataset.id
+        dataset.purged = True
+        app.sa_session.add( dataset )
+    app.sa_session.flush()
+    metrics.record( "update", len( purged_datasets ), step_start )
+    return purged_datasets
 
 def _purge_folder( folder, app, remove_from_disk, info_only = False ):
     """Purges a folder and its contents, recursively"""
@@ -502,6 +550,111 @@ def _purge_folder( folder, app, remove_from_disk, info_only = False ):
         app.sa_session.add( folder )
         app.sa_session.flush()
 
+class ObjectStoreDeleter( object ):
+    """
+    Removes the files (and extra files) of batches of datasets from the object store with
+    a pool of worker threads.  Each worker removes its share of a batch with the object
+    store's delete_many (a single multi-object delete request per 1000 datasets for S3).
+    """
+    def __init__( self, object_store, workers=1 ):
+        self.object_store = object_store
+        self.workers = workers
+
+    def delete( self, datasets ):
+        """
+        Returns a dictionary mapping the id of each dataset to whether its files were
+        removed (or were already gone).
+        """
+        if isinstance( self.object_store, DistributedObjectStore ):
+            for dataset in datasets:
+                if dataset.object_store_id not in self.object_store.backends:
+                    # Locating the dataset fixes (and flushes) its store id, which must
+                    # happen here rather than in the workers.
+                    self.object_store.exists( dataset )
+        # Workers must not touch the (thread local) SQLAlchemy session, so hand them
+        # detached copies of the attributes the object store uses.
+        objs = [ Bunch( id=dataset.id,
+                        object_store_id=dataset.object_store_id,
+                        extra_dir=dataset._extra_files_path or "dataset_%d_files" % dataset.id ) for dataset in datasets ]
+        chunk_size = max( 1, -( -len( objs ) // self.workers ) )
+        chunks = Queue.Queue()
+        for i in range( 0, len( objs ), chunk_size ):
+            chunks.put( objs[ i:i + chunk_size ] )
+        results = {}
+        threads = [ threading.Thread( target=self.__work, args=( chunks, results ) ) for i in range( chunks.qsize() ) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def __work( self, chunks, results ):
+        while True:
+            try:
+                chunk = chunks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                deleted = self.object_store.delete_many( chunk, extra_dirs=[ obj.extra_dir for obj in chunk ] )
+            except Exception, e:
+                print "Error removing %d datasets from the object store: %s" % ( len( chunk ), str( e ) )
+                deleted = [ False ] * len( chunk )
+            for obj, obj_deleted in zip( chunk, deleted ):
+                results[ obj.id ] = obj_deleted
+
+class CleanupCheckpoint( object ):
+    """
+    Records the id of the last dataset handled by each phase in a JSON file, so that an
+    interrupted run resumes after it.  The record of a phase is removed once it completes.
+    """
+    def __init__( self, path ):
+        self.path = path
+        self.progress = {}
+        if os.path.exists( path ):
+            self.progress = json.load( open( path ) )
+
+    def last_id( self, phase ):
+        return self.progress.get( phase, 0 )
+
+    def update( self, phase, last_id ):
+        self.progress[ phase ] = last_id
+        self.__save()
+
+    def finish( self, phase ):
+        if self.progress.pop( phase, None ) is not None:
+            self.__save()
+
+    def __save( self ):
+        # Write and rename, an interruption must never leave a truncated checkpoint.
+        temp_path = "%s.tmp" % self.path
+        temp = open( temp_path, "w" )
+        json.dump( self.progress, temp )
+        temp.close()
+        os.rename( temp_path, self.path )
+
+class PhaseMetrics( object ):
+    """Accumulates the number of items handled by, and time spent in, each step of a phase."""
+    def __init__( self, phase ):
+        self.phase = phase
+        self.steps = odict()
+
+    def record( self, step, items, start, verbose=False ):
+        seconds = time.time() - start
+        totals = self.steps.setdefault( step, [ 0, 0.0 ] )
+        totals[ 0 ] += items
+        totals[ 1 ] += seconds
+        if verbose:
+            print "%s %s: %d items in %.2f seconds (%s)" % ( self.phase, step, items, seconds, self.__rate( items, seconds ) )
+
+    def report( self ):
+        for step, ( items, seconds ) in self.steps.items():
+            print "%s %s: %d items in %.2f seconds (%s)" % ( self.phase, step, items, seconds, self.__rate( items, seconds ) )
+
+    def __rate( self, items, seconds ):
+        if not seconds:
+            return "n/a"
+        return "%.1f per second" % ( items / seconds )
+
 class CleanupDatasetsApplication( object ):
     """Encapsulates the state of a Universe application"""
     def __init__( self, config ):
@@ -1,9 +1,12 @@
 """
-Execute an external process to set_meta() on a provided list of pickled datasets.
+Execute an external process to set_meta() on a provided list of datasets (described as JSON).
 
 This should not be called directly!  Use the set_metadata.sh script in Galaxy's
 top level directly.
 
+If the first argument is --parallel, the datasets are processed by a pool of up
+to $GALAXY_SLOTS processes instead of one after another.
+
 """
 
 import logging
@@ -12,8 +15,11 @@ log = logging.getLogger( __name__ )
 
 import cPickle
 import json
+import multiprocessing
 import os
 import sys
+import time
+from functools import partial
 
 # ensure supported version
 from check_python import check_python
@@ -37,6 +43,10 @@ from galaxy import config
 import ConfigParser
 from galaxy.util.properties import load_app_properties
 
+# Read by the set_metadata job metrics plugin
+# (galaxy.jobs.metrics.instrumenters.set_metadata).
+TIMINGS_FILE_NAME = "__instrument_set_metadata_timings"
+
 
 def set_meta_with_tool_provided( dataset_instance, file_dict, set_meta_kwds ):
     # This method is somewhat odd, in that we set the metadata attributes from tool,
@@ -50,7 +60,78 @@ def set_meta_with_tool_provided( dataset_instance, file_dict, set_meta_kwds ):
     for metadata_name, metadata_value in file_dict.get( 'metadata', {} ).iteritems():
         setattr( dataset_instance.metadata, metadata_name, metadata_value )
 
+
+def load_set_meta_kwds( filename_kwds ):
+    return stringify_dictionary_keys( json.load( open( filename_kwds ) ) )  # load kwds; need to ensure our keywords are not unicode
+
+
+def load_dataset( filename_in ):
+    try:
+        dataset_dict = json.load( open( filename_in ) )
+    except ValueError:
+        # Jobs set up before datasets were described in JSON pickled them
+        return cPickle.load( open( filename_in ) )
+    return galaxy.datatypes.metadata.dataset_from_JSON( dataset_dict )
+
+
+def set_metadata_for_output( filenames, tool_job_working_directory, existing_job_metadata_dict ):
+    """
+    Set metadata for the dataset described by one comma-separated command-line
+    argument and return the dataset id and the time taken in seconds - this
+    may run in a pool process so it cannot modify any state of __main__().
+    """
+    start = time.time()
+    dataset_id = None
+    fields = filenames.split( ',' )
+    filename_in = fields.pop( 0 )
+    filename_kwds = fields.pop( 0 )
+    filename_out = fields.pop( 0 )
+    filename_results_code = fields.pop( 0 )
+    dataset_filename_override = fields.pop( 0 )
+    # Need to be careful with the way that these parameters are populated from the filename splitting,
+    # because if a job is running when the server is updated, any existing external metadata command-lines
+    #will not have info about the newly added override_metadata file
+    if fields:
+        override_metadata = fields.pop( 0 )
+    else:
+        override_metadata = None
+    set_meta_kwds = load_set_meta_kwds( filename_kwds )
+    try:
+        dataset = load_dataset( filename_in )  # load DatasetInstance
+        dataset_id = dataset.dataset.id
+        if dataset_filename_override:
+            dataset.dataset.external_filename = dataset_filename_override
+        files_path = os.path.abspath(os.path.join( tool_job_working_directory, "dataset_%s_files" % (dataset.dataset.id) ))
+        dataset.dataset.external_extra_files_path = files_path
+        if dataset.dataset.id in existing_job_metadata_dict:
+            dataset.extension = existing_job_metadata_dict[ dataset.dataset.id ].get( 'ext', dataset.extension )
+        # Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
+        if override_metadata:
+            override_metadata = json.load( open( override_metadata ) )
+            for metadata_name, metadata_file_override in override_metadata:
+                if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value( metadata_file_override ):
+                    metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON( metadata_file_override )
+                setattr( dataset.metadata, metadata_name, metadata_file_override )
+        file_dict = existing_job_metadata_dict.get( dataset.dataset.id, {} )
+        set_meta_with_tool_provided( dataset, file_dict, set_meta_kwds )
+        dataset.metadata.to_JSON_dict( filename_out )  # write out results of set_meta
+        json.dump( ( True, 'Metadata has been set successfully' ), open( filename_results_code, 'wb+' ) )  # setting metadata has succeeded
+    except Exception, e:
+        json.dump( ( False, str( e ) ), open( filename_results_code, 'wb+' ) )  # setting metadata has failed somehow
+    return ( dataset_id, time.time() - start )
+
+
+def _galaxy_slots():
+    try:
+        return max( int( os.environ.get( "GALAXY_SLOTS", 1 ) ), 1 )
+    except ValueError:
+        return 1
+
+
 def __main__():
+    parallel = len( sys.argv ) > 1 and sys.argv[ 1 ] == '--parallel'
+    if parallel:
+        sys.argv.pop( 1 )
     file_path = sys.argv.pop( 1 )
     tool_job_working_directory = tmp_dir = sys.argv.pop( 1 ) #this is also the job_working_directory now
     galaxy.model.Dataset.file_path = file_path
@@ -91,42 +172,28 @@ def __main__():
             except:
                 continue
 
-    for filenames in sys.argv[1:]:
-        fields = filenames.split( ',' )
-        filename_in = fields.pop( 0 )
-        filename_kwds = fields.pop( 0 )
-        filename_out = fields.pop( 0 )
-        filename_results_code = fields.pop( 0 )
-        dataset_filename_override = fields.pop( 0 )
-        # Need to be careful with the way that these parameters are populated from the filename splitting,
-        # because if a job is running when the server is updated, any existing external metadata command-lines
-        #will not have info about the newly added override_metadata file
-        if fields:
-            override_metadata = fields.pop( 0 )
-        else:
-            override_metadata = None
-        set_meta_kwds = stringify_dictionary_keys( json.load( open( filename_kwds ) ) )  # load kwds; need to ensure our keywords are not unicode
+    outputs = sys.argv[1:]
+    processes = 1
+    if parallel:
+        processes = min( _galaxy_slots(), len( outputs ) )
+    set_metadata = partial( set_metadata_for_output, tool_job_working_directory=tool_job_working_directory, existing_job_metadata_dict=existing_job_metadata_dict )
+    start = time.time()
+    if processes > 1:
+        pool = multiprocessing.Pool( processes )
         try:
-            dataset = cPickle.load( open( filename_in ) )  # load DatasetInstance
-            if dataset_filename_override:
-                dataset.dataset.external_filename = dataset_filename_override
-            files_path = os.path.abspath(os.path.join( tool_job_working_directory, "dataset_%s_files" % (dataset.dataset.id) ))
-            dataset.dataset.external_extra_files_path = files_path
-            if dataset.dataset.id in existing_job_metadata_dict:
-                dataset.extension = existing_job_metadata_dict[ dataset.dataset.id ].get( 'ext', dataset.extension )
-            # Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
-            if override_metadata:
-                override_metadata = json.load( open( override_metadata ) )
-                for metadata_name, metadata_file_override in override_metadata:
-                    if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value( metadata_file_override ):
-                        metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON( metadata_file_override )
-                    setattr( dataset.metadata, metadata_name, metadata_file_override )
-            file_dict = existing_job_metadata_dict.get( dataset.dataset.id, {} )
-            set_meta_with_tool_provided( dataset, file_dict, set_meta_kwds )
-            dataset.metadata.to_JSON_dict( filename_out )  # write out results of set_meta
-            json.dump( ( True, 'Metadata has been set successfully' ), open( filename_results_code, 'wb+' ) )  # setting metadata has succeeded
-        except Exception, e:
-            json.dump( ( False, str( e ) ), open( filename_results_code, 'wb+' ) )  # setting metadata has failed somehow
+            timings = pool.map( set_metadata, outputs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        timings = map( set_metadata, outputs )
+    with open( os.path.join( tool_job_working_directory, TIMINGS_FILE_NAME ), 'wb' ) as timings_fh:
+        json.dump( dict( processes=processes, total_seconds=time.time() - start, outputs=timings ), timings_fh )
+
+    # new primary datasets are set with the keywords of the last output
+    set_meta_kwds = {}
+    if outputs:
+        set_meta_kwds = load_set_meta_kwds( outputs[ -1 ].split( ',' )[ 1 ] )
 
     for i, ( filename, file_dict ) in enumerate( new_job_metadata_dict.iteritems(), start=1 ):
         new_dataset = galaxy.model.Dataset( id=-i, external_filename=os.path.join( tool_job_working_directory, file_dict[ 'filename' ] ) )
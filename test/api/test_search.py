@@ -19,8 +19,21 @@ class SearchApiTestCase( api.ApiTestCase ):
         search_response = self.__search( "select * from workflow where deleted = False" )
         assert not self.__has_result_with_name( search_response, "test_for_search (imported from API)" ), search_response.json()
 
-    def __search( self, query ):
-        data = dict( query=query )
+    def test_search_paging( self ):
+        workflow_populator = WorkflowPopulator( self.galaxy_interactor )
+        workflow_populator.simple_workflow( "test_for_search_paging_1" )
+        workflow_populator.simple_workflow( "test_for_search_paging_2" )
+        query = "select * from workflow where name like 'test_for_search_paging%'"
+        all_results = self.__search( query ).json()[ "results" ]
+        assert len( all_results ) >= 2, all_results
+
+        first_page = self.__search( query, limit=1 ).json()[ "results" ]
+        assert first_page == all_results[ :1 ], first_page
+        second_page = self.__search( query, limit=1, offset=1 ).json()[ "results" ]
+        assert second_page == all_results[ 1:2 ], second_page
+
+    def __search( self, query, **kwds ):
+        data = dict( query=query, **kwds )
         search_response = self._post( "search", data=data )
         self._assert_status_code_is( search_response, 200 )
         return search_response
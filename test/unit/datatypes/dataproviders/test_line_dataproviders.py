@@ -81,6 +81,17 @@ class Test_FilteredLineDataProvider( test_base_dataproviders.Test_FilteredDataPr
             log.debug( 'limit_offset_combo: %s', ', '.join([ str( e ) for e in test ]) )
             limit_offset_combo( *test )
 
+    def test_offset_index( self ):
+        """should provide the same data when seeking to an offset using the line offset index
+        """
+        contents = ''.join([ '# comment %d\nline %d\n\n' % ( i, i ) for i in xrange( 2500 ) ])
+        filename = self.tmpfiles.create_tmpfile( contents )
+        for offset in [ 999, 1000, 2100, 1001, 2498 ]:
+            provider = self.provider_class( open( filename ), offset=offset, limit=2 )
+            data = list( provider )
+            self.assertEqual( data, [ 'line %d' % offset, 'line %d' % ( offset + 1 ) ] )
+            self.assertCounters( provider, ( offset + len( data ) ) * 3 - 1, offset + len( data ), len( data ) )
+
     def test_provide_blank( self ):
         """should return blank lines if ``provide_blank`` is true.
         """
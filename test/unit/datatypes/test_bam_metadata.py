@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+
+from galaxy.datatypes import binary
+from galaxy.datatypes.metadata import MetadataTempFile
+from galaxy.util.bunch import Bunch
+
+
+class MockPopen( object ):
+    commands = []
+
+    def __init__( self, args, **kwds ):
+        self.commands.append( args )
+
+    def wait( self ):
+        return 0
+
+
+def test_bam_reindex_does_not_copy_old_index():
+    tmp_dir = tempfile.mkdtemp()
+    original_popen = binary.subprocess.Popen
+    original_tmp_dir = MetadataTempFile.tmp_dir
+    try:
+        old_index = os.path.join( tmp_dir, "metadata_1.dat" )
+        open( old_index, "w" ).write( "old index" )
+        MetadataTempFile.tmp_dir = tmp_dir
+        # As set up by set_metadata.py for the existing bam_index.
+        index_file = MetadataTempFile.copy_of( Bunch( file_name=old_index, id=1 ) )
+        dataset = Bunch( file_name=os.path.join( tmp_dir, "dataset_1.dat" ), metadata=Bunch( bam_index=index_file ) )
+        binary.subprocess.Popen = MockPopen
+
+        binary.Bam().set_meta( dataset )
+
+        assert MockPopen.commands[ -1 ].endswith( " %s" % index_file.file_name )
+        assert open( index_file.file_name ).read() == ""
+        assert not index_file.is_unmodified_copy
+        # The new index is sent back rather than the existing file's id.
+        assert index_file.source_id is None
+    finally:
+        binary.subprocess.Popen = original_popen
+        MetadataTempFile.tmp_dir = original_tmp_dir
+        shutil.rmtree( tmp_dir )
+
+
+def test_temp_file_copied_when_read():
+    tmp_dir = tempfile.mkdtemp()
+    original_tmp_dir = MetadataTempFile.tmp_dir
+    try:
+        existing = os.path.join( tmp_dir, "metadata_1.dat" )
+        open( existing, "w" ).write( "existing" )
+        MetadataTempFile.tmp_dir = tmp_dir
+        metadata_file = MetadataTempFile.copy_of( Bunch( file_name=existing, id=1 ) )
+        assert metadata_file.is_unmodified_copy
+        assert open( metadata_file.file_name ).read() == "existing"
+        assert metadata_file.file_name_to_overwrite == metadata_file.file_name
+    finally:
+        MetadataTempFile.tmp_dir = original_tmp_dir
+        shutil.rmtree( tmp_dir )
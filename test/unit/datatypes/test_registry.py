@@ -0,0 +1,52 @@
+from galaxy.datatypes import binary
+from galaxy.datatypes import interval
+from galaxy.datatypes import tabular
+from galaxy.datatypes.registry import Registry
+from galaxy.util.bunch import Bunch
+from galaxy.util.odict import odict
+
+
+def _registry( converter_deps={} ):
+    registry = Registry()
+    registry.datatypes_by_extension = dict(
+        sam=tabular.Sam(),
+        bam=binary.Bam(),
+        bigwig=binary.BigWig(),
+        interval=interval.Interval(),
+        bed=interval.Bed(),
+        bedstrict=interval.BedStrict(),
+    )
+    for source_ext, target_ext in [ ( "sam", "bam" ), ( "bam", "bigwig" ), ( "interval", "bedstrict" ) ]:
+        registry.datatype_converters.setdefault( source_ext, odict() )[ target_ext ] = Bunch( id="%s_to_%s" % ( source_ext, target_ext ) )
+    registry.converter_deps = converter_deps
+    return registry
+
+
+def _ids( path ):
+    return [ ( target_ext, converter.id ) for target_ext, converter in path ]
+
+
+def test_converters_by_datatype():
+    registry = _registry()
+    # Converters of parent datatypes apply.
+    assert registry.get_converters_by_datatype( "bed" ).keys() == [ "bedstrict" ]
+    assert registry.get_converter_by_target_type( "sam", "bam" ).id == "sam_to_bam"
+    assert registry.get_converter_by_target_type( "sam", "bigwig" ) is None
+    assert registry.get_converters_by_datatype( "bigwig" ).keys() == []
+
+
+def test_conversion_paths():
+    registry = _registry()
+    assert _ids( registry.get_conversion_path( "sam", "bigwig" ) ) == [ ( "bam", "sam_to_bam" ), ( "bigwig", "bam_to_bigwig" ) ]
+    assert registry.get_conversion_paths( "sam" ).keys() == [ "bam", "bigwig" ]
+    assert registry.get_conversion_path( "bigwig", "sam" ) is None
+
+    dataset = Bunch( ext="sam", get_converted_files_by_type=lambda ext: None )
+    assert registry.find_conversion_destination_for_dataset_by_extensions( dataset, [ binary.BigWig() ] ) == ( "bigwig", None )
+    assert registry.find_conversion_destination_for_dataset_by_extensions( dataset, [ interval.Bed() ] ) == ( None, None )
+
+
+def test_converters_with_dependencies_not_chained():
+    registry = _registry( converter_deps={ "bam": { "bigwig": [ "bai" ] } } )
+    assert registry.get_conversion_path( "sam", "bigwig" ) is None
+    assert _ids( registry.get_conversion_path( "bam", "bigwig" ) ) == [ ( "bigwig", "bam_to_bigwig" ) ]
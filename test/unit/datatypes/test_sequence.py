@@ -0,0 +1,111 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from galaxy.datatypes import sequence
+from galaxy.util.bunch import Bunch
+
+
+def _fastq_records( count ):
+    return [ "@read%d\nACGTACGTAC\n+\n#!@ABCDEFG\n" % i for i in range( count ) ]
+
+
+def _gzip( contents ):
+    compressed = StringIO()
+    gzip_file = gzip.GzipFile( fileobj=compressed, mode="wb" )
+    gzip_file.write( contents )
+    gzip_file.close()
+    return compressed.getvalue()
+
+
+class TestSequenceCounting( object ):
+
+    def setUp( self ):
+        self.temp_directory = tempfile.mkdtemp()
+        self.records = _fastq_records( 250 )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_directory )
+
+    def _write( self, name, contents ):
+        path = os.path.join( self.temp_directory, name )
+        open( path, "wb" ).write( contents )
+        return path
+
+    def test_count_fasta( self ):
+        path = self._write( "1.fasta", "#comment\n>seq1\nACGT\n>seq2\nAC\nGT\n>seq3\nA" )
+        counts = sequence.count_sequences( path, record_marker=">" )
+        assert counts.sequences == 3
+        assert counts.data_lines == 7
+
+    def test_fastq_index( self ):
+        path = self._write( "1.fastq", "#comment\n" + "".join( self.records ) )
+        counts = sequence.count_sequences( path, lines_per_record=4, build_index=True, index_section_size=100 )
+        assert counts.sequences == 250
+        assert counts.data_lines == 1000
+        assert [ section[ "sequences" ] for section in counts.sections ] == [ 100, 100, 50 ]
+        contents = open( path ).read()
+        for section in counts.sections:
+            assert contents[ section[ "start" ]: ].startswith( "@read" )
+        self._check_split( path, counts.sections, False )
+
+    def test_compressed_fastq_index( self ):
+        members = [ _gzip( "".join( self.records[ i:i + 30 ] ) ) for i in range( 0, 250, 30 ) ]
+        path = self._write( "1.fastq.gz", "".join( members ) )
+        counts = sequence.count_sequences( path, lines_per_record=4, build_index=True, index_section_size=100 )
+        assert counts.sequences == 250
+        # Sections are made up of whole members.
+        assert [ section[ "sequences" ] for section in counts.sections ] == [ 120, 120, 10 ]
+        assert counts.sections[ -1 ][ "end" ] == os.path.getsize( path )
+        self._check_split( path, counts.sections, True )
+
+    def test_compressed_fastq_unaligned_members_not_indexed( self ):
+        contents = "".join( self.records[ :10 ] )
+        path = self._write( "2.fastq.gz", _gzip( contents[ :-5 ] ) + _gzip( contents[ -5: ] ) )
+        counts = sequence.count_sequences( path, lines_per_record=4, build_index=True )
+        assert counts.sequences == 10
+        assert counts.sections is None
+
+    def test_large_fastq_indexed_and_split_fast( self ):
+        path = self._write( "1.fastq", "".join( self.records ) )
+        index_path = os.path.join( self.temp_directory, "index.fqtoc" )
+        index_file = Bunch( file_name=index_path, file_name_to_overwrite=index_path )
+        dataset = Bunch(
+            file_name=path,
+            get_size=lambda: os.path.getsize( path ),
+            metadata=Bunch( sequence_index=index_file ),
+            get_converted_files_by_type=lambda ext: None,
+            copied_from_library_dataset_dataset_association=None,
+        )
+        fastq = sequence.Fastq()
+        original_max_filesize = sequence.Fastq._max_optional_metadata_filesize
+        try:
+            # Larger than max_optional_metadata_filesize, still counted and indexed.
+            fastq.max_optional_metadata_filesize = 100
+            fastq.set_meta( dataset )
+        finally:
+            sequence.Fastq._max_optional_metadata_filesize = original_max_filesize
+        assert dataset.metadata.sequences == 250
+        assert dataset.metadata.sequence_index is index_file
+
+        split_params = dict( split_mode="number_of_parts", split_size="2" )
+        directories = sequence.Fastq.split( [ dataset ], lambda: tempfile.mkdtemp( dir=self.temp_directory ), split_params )
+        assert len( directories ) == 2
+        split_info = json.load( open( os.path.join( directories[ 0 ], "split_info_1.fastq.json" ) ) )
+        # Split with the index (do_fast_split).
+        assert split_info[ "args" ][ "toc_file" ] == index_path
+
+    def _check_split( self, path, sections, compressed ):
+        toc = dict( sections=sections )
+        for start, count in [ ( 0, 250 ), ( 110, 95 ), ( 249, 1 ) ]:
+            output = os.path.join( self.temp_directory, "split_%d_%d" % ( start, count ) )
+            for command in sequence.Sequence.get_split_commands_with_toc( path, output, toc, start, count ):
+                assert os.system( command ) == 0
+            if compressed:
+                split = gzip.open( output ).read()
+            else:
+                split = open( output ).read()
+            assert split == "".join( self.records[ start:start + count ] )
@@ -74,6 +74,56 @@ class JobWrapperTestCase(BaseWrapperTestCase, TestCase):
         with self._prepared_wrapper() as wrapper:
             assert TEST_VERSION_COMMAND in wrapper.write_version_cmd, wrapper.write_version_cmd
 
+    def test_finish_deferred_until_outputs_visible(self):
+        wrapper = self._finishing_wrapper()
+        wrapper.finish("stdout", "stderr", tool_exit_code=0)
+        deferred_finish, delay = self.queue.dispatcher.deferred_finishes[-1]
+        assert delay == 1
+        assert deferred_finish.kwds["output_collection_attempt"] == 1
+
+        # Still missing, tried again after a longer delay.
+        deferred_finish()
+        deferred_finish, delay = self.queue.dispatcher.deferred_finishes[-1]
+        assert delay == 2
+        assert deferred_finish.kwds["output_collection_attempt"] == 2
+
+        open(self.output_path, "w").write("output")
+        self.assertRaises(OutputsCollected, deferred_finish)
+        assert len(self.queue.dispatcher.deferred_finishes) == 2
+
+    def test_finish_gives_up_waiting_for_outputs(self):
+        wrapper = self._finishing_wrapper()
+        wrapper.finish("stdout", "stderr", tool_exit_code=0)
+        for i in range(self.app.config.retry_job_output_collection - 2):
+            self.queue.dispatcher.deferred_finishes[-1][0]()
+        deferred_finish, delay = self.queue.dispatcher.deferred_finishes[-1]
+        # Capped at retry_job_output_collection_max_delay.
+        assert delay == 3
+        # Out of tries, finished although the output is still missing.
+        self.assertRaises(OutputsCollected, deferred_finish)
+        assert len(self.queue.dispatcher.deferred_finishes) == self.app.config.retry_job_output_collection - 1
+
+    def test_finish_not_deferred_if_outputs_visible(self):
+        wrapper = self._finishing_wrapper()
+        open(self.output_path, "w").write("output")
+        self.assertRaises(OutputsCollected, wrapper.finish, "stdout", "stderr", tool_exit_code=0)
+        assert not self.queue.dispatcher.deferred_finishes
+
+    def _finishing_wrapper(self):
+        self.app.config.external_chown_script = None
+        self.app.config.retry_job_output_collection = 4
+        self.app.config.retry_job_output_collection_delay = 1
+        self.app.config.retry_job_output_collection_max_delay = 3
+        self.output_path = os.path.join(self.test_directory, "dataset_1.dat")
+        wrapper = self._wrapper()
+        wrapper.get_output_fnames = lambda: [Bunch(false_path=None, real_path=self.output_path)]
+
+        # Stop finishing once the outputs are being collected.
+        def check_tool_output(*args):
+            raise OutputsCollected()
+        wrapper.check_tool_output = check_tool_output
+        return wrapper
+
 
 class TaskWrapperTestCase(BaseWrapperTestCase, TestCase):
 
@@ -114,10 +164,17 @@ class MockJobQueue(object):
         self.dispatcher = MockJobDispatcher(app)
 
 
+class OutputsCollected(Exception):
+    pass
+
+
 class MockJobDispatcher(object):
 
     def __init__(self, app):
-        pass
+        self.deferred_finishes = []
+
+    def defer_finish(self, job_wrapper, deferred_finish, delay):
+        self.deferred_finishes.append((deferred_finish, delay))
 
     def url_to_destination(self):
         pass
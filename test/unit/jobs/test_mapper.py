@@ -1,3 +1,7 @@
+import os
+import shutil
+import sys
+import tempfile
 import uuid
 
 import jobs.test_rules
@@ -6,6 +10,7 @@ from galaxy.jobs.mapper import (
     JobRunnerMapper,
     ERROR_MESSAGE_NO_RULE_FUNCTION,
     ERROR_MESSAGE_RULE_FUNCTION_NOT_FOUND,
+    get_rule_module_registry,
 )
 from galaxy.jobs import JobDestination
 
@@ -88,6 +93,44 @@ def test_dynamic_mapping_missing_function():
     __assert_mapper_errors_with_message( mapper, error_message )
 
 
+def test_rule_modules_shared_between_jobs():
+    mapper = __mapper( __dynamic_destination( dict( function="upload" ) ) )
+    mapper.get_job_destination( {} )
+    registry = __mapper().rule_module_registry
+    assert registry is mapper.rule_module_registry
+    assert registry.function_modules[ "upload" ] is not None
+    assert registry.rule_timings[ "upload" ][ 0 ] >= 1
+
+
+def test_rule_modules_reloaded_on_change():
+    temp_directory = tempfile.mkdtemp()
+    try:
+        package_directory = os.path.join( temp_directory, "reloaded_rules" )
+        os.mkdir( package_directory )
+        open( os.path.join( package_directory, "__init__.py" ), "w" ).close()
+        rule_path = os.path.join( package_directory, "10_site.py" )
+        open( rule_path, "w" ).write( "def tool1():\n    return 'first_dest_id'\n" )
+        sys.path.insert( 0, temp_directory )
+        __import__( "reloaded_rules" )
+        rules_module = sys.modules[ "reloaded_rules" ]
+        registry = get_rule_module_registry( rules_module )
+        assert registry.module_with_function( "tool1" ).tool1() == "first_dest_id"
+        assert registry.module_with_function( "tool2" ) is None
+
+        open( rule_path, "w" ).write( "def tool1():\n    return 'second_dest_id'\n\ndef tool2():\n    pass\n" )
+        os.utime( rule_path, ( 1, 1 ) )
+        open( os.path.join( package_directory, "20_instance.py" ), "w" ).write( "def tool3():\n    pass\n" )
+        # Not rechecked until RULE_MODULES_CHECK_INTERVAL has passed.
+        assert registry.module_with_function( "tool2" ) is None
+        registry.last_checked = None
+        assert registry.module_with_function( "tool1" ).tool1() == "second_dest_id"
+        assert registry.module_with_function( "tool2" ) is not None
+        assert registry.module_with_function( "tool3" ) is not None
+    finally:
+        sys.path.remove( temp_directory )
+        shutil.rmtree( temp_directory )
+
+
 def __assert_mapper_errors_with_message( mapper, message ):
     exception = None
     try:
@@ -0,0 +1,90 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from nose.plugins.skip import SkipTest
+
+from galaxy.jobs.metrics import proc_sampler
+from galaxy.jobs.metrics.instrumenters.sampler import summarize_series
+
+HEADER = "\t".join( proc_sampler.COLUMNS )
+
+
+def test_read_series():
+    series = __read_series( [
+        HEADER,
+        "0.0\t1000\t0.0\t0\t0\t3\t1",
+        "10.0\t3000\t150.0\t4096\t1024\t5\t2",
+        # Truncated when the job was killed.
+        "20.0\t2000",
+    ] )
+    assert len( series ) == 2
+    assert series[ 0 ] == dict( elapsed_seconds=0.0, rss_kb=1000.0, cpu_percent=0.0, read_bytes=0.0, write_bytes=0.0, open_files=3.0, processes=1.0 )
+    assert series[ 1 ][ "rss_kb" ] == 3000.0
+    assert series[ 1 ][ "cpu_percent" ] == 150.0
+
+
+def test_read_series_header_only():
+    assert __read_series( [ HEADER ] ) == []
+
+
+def test_summarize_series():
+    series = __read_series( [
+        HEADER,
+        "0.0\t1000\t0.0\t0\t0\t3\t1",
+        "10.0\t3000\t150.0\t4096\t1024\t5\t2",
+        "20.0\t2000\t50.0\t8192\t2048\t4\t1",
+    ] )
+    summary = summarize_series( series )
+    assert summary[ "samples" ] == 3
+    assert summary[ "max_rss_kb" ] == 3000.0
+    assert summary[ "mean_rss_kb" ] == 2000.0
+    # The first sample's CPU usage isn't counted.
+    assert summary[ "max_cpu_percent" ] == 150.0
+    assert summary[ "mean_cpu_percent" ] == 100.0
+    assert summary[ "read_bytes" ] == 8192.0
+    assert summary[ "write_bytes" ] == 2048.0
+    assert summary[ "max_open_files" ] == 5.0
+    assert summary[ "max_processes" ] == 2.0
+
+
+def test_summarize_single_sample():
+    summary = summarize_series( __read_series( [ HEADER, "0.0\t1000\t0.0\t0\t0\t3\t1" ] ) )
+    assert summary[ "samples" ] == 1
+    assert summary[ "mean_cpu_percent" ] == 0.0
+
+
+def test_sample():
+    if not os.path.isdir( "/proc/self" ):
+        raise SkipTest( "Sampling processes requires Linux /proc" )
+    temp_directory = tempfile.mkdtemp()
+    try:
+        series_path = os.path.join( temp_directory, "series" )
+        process = subprocess.Popen( [ "sleep", "1" ] )
+        # Reap the process as soon as it exits, the sampler stops once it is
+        # gone from /proc.
+        waiter = threading.Thread( target=process.wait )
+        waiter.start()
+        proc_sampler.sample( process.pid, series_path, 0.1, 100 )
+        waiter.join()
+
+        series = proc_sampler.read_series( series_path )
+        assert len( series ) > 1
+        assert series[ 0 ][ "processes" ] == 1
+        assert max( [ s[ "rss_kb" ] for s in series ] ) > 0
+        assert max( [ s[ "open_files" ] for s in series ] ) > 0
+        assert series[ -1 ][ "elapsed_seconds" ] < 5
+    finally:
+        shutil.rmtree( temp_directory )
+
+
+def __read_series( lines ):
+    temp_directory = tempfile.mkdtemp()
+    try:
+        series_path = os.path.join( temp_directory, "series" )
+        open( series_path, "w" ).write( "\n".join( lines ) + "\n" )
+        return proc_sampler.read_series( series_path )
+    finally:
+        shutil.rmtree( temp_directory )
@@ -1,10 +1,16 @@
+import threading
+import time
 import uuid
 
 from galaxy.util import bunch
 from galaxy import model
 from galaxy.model import mapping
 
-from galaxy.jobs.rule_helper import RuleHelper
+from galaxy.jobs.rule_helper import (
+    get_job_count_snapshot,
+    get_tool_resource_statistics,
+    RuleHelper,
+)
 
 USER_EMAIL_1 = "u1@example.com"
 USER_EMAIL_2 = "u2@example.com"
@@ -142,6 +148,106 @@ def test_should_burst( ):
     assert not rule_helper.should_burst( [ "cluster1" ], "6", job_states="queued" )
 
 
+def test_job_count_snapshot():
+    rule_helper = __rule_helper()
+    __setup_fixtures( rule_helper.app )
+    __assert_job_count_is( 3, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ] )
+
+    user1 = rule_helper.app.model.context.query( model.User ).filter( model.User.table.c.email == USER_EMAIL_1 ).first()
+    rule_helper.app.add( __new_job( user=user1, destination_id="cluster1", state="queued", tool_id="cat1" ) )
+
+    # Counts are read from the snapshot until it is invalidated (i.e. on the
+    # next job handler iteration) unless strict counts are requested.
+    __assert_job_count_is( 3, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ] )
+    __assert_job_count_is( 4, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ], strict=True )
+    assert not rule_helper.should_burst( [ "cluster1" ], "8" )
+    assert rule_helper.should_burst( [ "cluster1" ], "8", strict=True )
+
+    get_job_count_snapshot( rule_helper.app ).invalidate()
+    __assert_job_count_is( 4, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ] )
+    __assert_job_count_is( 1, rule_helper, for_tool_id="cat1", for_job_states=[ "queued", "running" ] )
+    __assert_job_count_is( 10, rule_helper, for_job_states=[ "queued", "running" ] )
+
+
+def test_job_count_snapshot_counts_dispatched_jobs():
+    rule_helper = __rule_helper()
+    __setup_fixtures( rule_helper.app )
+    __assert_job_count_is( 3, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ] )
+
+    # Jobs dispatched by the job handler are counted before the snapshot is
+    # refreshed.
+    snapshot = get_job_count_snapshot( rule_helper.app )
+    snapshot.increment( "cluster1", "queued", USER_EMAIL_1, "cat1" )
+    snapshot.increment( "cluster1", "queued", USER_EMAIL_1, "cat1" )
+    snapshot.increment( "cluster2", "queued", USER_EMAIL_2, "cat1" )
+    __assert_job_count_is( 5, rule_helper, for_destination="cluster1", for_user_email=USER_EMAIL_1, for_job_states=[ "queued" ] )
+    __assert_job_count_is( 2, rule_helper, for_destination="cluster1", for_tool_id="cat1", for_job_states=[ "queued" ] )
+    __assert_job_count_is( 1, rule_helper, for_destination="cluster2", for_job_states=[ "queued", "running" ] )
+
+
+def test_tool_statistics():
+    rule_helper = __rule_helper()
+    app = rule_helper.app
+    tool_resource_statistics = get_tool_resource_statistics( app )
+    tool_resource_statistics.refresh()
+    assert rule_helper.tool_statistics( "cat1" ) is None
+
+    for i in range( 4 ):
+        job = __new_job( tool_id="cat1", tool_version="1.0.0", state="ok" )
+        job.add_metric( "core", "runtime_seconds", 10 * ( i + 1 ) )
+        job.add_metric( "core", "galaxy_slots", 2 )
+        job.add_metric( "collectl", "process_max_VmRSS", 1000 )
+        app.add( job )
+    job = __new_job( tool_id="cat1", tool_version="1.0.1", state="ok" )
+    job.add_metric( "core", "runtime_seconds", 100 )
+    app.add( job )
+    # Failed jobs aren't summarized.
+    job = __new_job( tool_id="cat1", tool_version="1.0.1", state="error" )
+    job.add_metric( "core", "runtime_seconds", 1000 )
+    app.add( job )
+
+    # Statistics are only computed periodically.
+    assert rule_helper.tool_statistics( "cat1" ) is None
+    tool_resource_statistics.refresh()
+
+    statistics = rule_helper.tool_statistics( "cat1", min_jobs=5 )
+    assert statistics[ "count" ] == 5
+    assert statistics[ "runtime_seconds" ] == dict( mean=40.0, max=100.0, p95=100.0 )
+    assert statistics[ "memory_kb" ][ "max" ] == 1000.0
+    assert statistics[ "cores" ][ "mean" ] == 2.0
+
+    statistics = rule_helper.tool_statistics( "cat1", tool_version="1.0.0", min_jobs=2 )
+    assert statistics[ "count" ] == 4
+    assert statistics[ "runtime_seconds" ][ "max" ] == 40.0
+    # Too few jobs for this version, fall back to all versions.
+    statistics = rule_helper.tool_statistics( "cat1", tool_version="1.0.1", min_jobs=2 )
+    assert statistics[ "count" ] == 5
+    assert rule_helper.tool_statistics( "cat1", min_jobs=6 ) is None
+    assert rule_helper.tool_statistics( "cat2", min_jobs=1 ) is None
+
+
+def test_tool_statistics_refreshed_in_background():
+    rule_helper = __rule_helper()
+    tool_resource_statistics = get_tool_resource_statistics( rule_helper.app )
+    refreshing = threading.Event()
+    finish_refresh = threading.Event()
+
+    def refresh():
+        refreshing.set()
+        finish_refresh.wait()
+        tool_resource_statistics.statistics = { ( "cat1", None, None ): { "count": 1 } }
+        tool_resource_statistics.last_refreshed = time.time()
+    tool_resource_statistics.refresh = refresh
+
+    # Lookups don't wait for the refresh, they use the current statistics.
+    assert rule_helper.tool_statistics( "cat1", min_jobs=1 ) is None
+    assert refreshing.wait( 5 )
+    assert rule_helper.tool_statistics( "cat1", min_jobs=1 ) is None
+    finish_refresh.set()
+    tool_resource_statistics.refresh_thread.join()
+    assert rule_helper.tool_statistics( "cat1", min_jobs=1 ) == { "count": 1 }
+
+
 def __assert_same_hash( rule_helper, job1, job2, hash_by ):
     job1_hash = rule_helper.job_hash( job1, hash_by=hash_by )
     job2_hash = rule_helper.job_hash( job2, hash_by=hash_by )
@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from galaxy.jobs.runners import (
+    AsynchronousJobRunner,
+    BaseJobRunner,
+    STOP_SIGNAL,
+    WORK_POOLS,
+    WorkerPool,
+    WorkQueue,
+)
+from galaxy.util.bunch import Bunch
+from galaxy.util.odict import odict
+
+
+class MockRunner( object ):
+
+    def queue_job( self, arg ):
+        pass
+
+    def finish_job( self, arg ):
+        pass
+
+    def fail_job( self, arg ):
+        pass
+
+    def check_pid( self, arg ):
+        pass
+
+
+def _pools():
+    pools = odict()
+    for name in WORK_POOLS:
+        pools[ name ] = WorkerPool( name, 1 )
+    return pools
+
+
+def test_work_routed_by_method():
+    runner = MockRunner()
+    pools = _pools()
+    work_queue = WorkQueue( "mock", pools )
+    work_queue.put( ( runner.queue_job, 1 ) )
+    work_queue.put( ( runner.finish_job, 2 ) )
+    work_queue.put( ( runner.finish_job, 3 ) )
+    work_queue.put( ( runner.fail_job, 4 ) )
+    work_queue.put( ( runner.check_pid, 5 ) )
+
+    gauges = work_queue.gauges()
+    assert [ gauges[ name ][ "queued" ] for name in pools ] == [ 2, 2, 1 ]
+
+    method, arg = pools[ "finish" ].get()
+    assert method == runner.finish_job
+    assert arg == 2
+    gauges = pools[ "finish" ].gauges()
+    assert gauges[ "busy" ] == 1
+    assert gauges[ "queued" ] == 1
+    pools[ "finish" ].done( 0.5 )
+    gauges = pools[ "finish" ].gauges()
+    assert gauges[ "busy" ] == 0
+    assert gauges[ "processed" ] == 1
+    assert gauges[ "runtime_max" ] == 0.5
+
+
+def test_pools_run_independently():
+    runner = MockRunner()
+    pools = _pools()
+    work_queue = WorkQueue( "mock", pools )
+    finish_blocked = threading.Event()
+    submitted = threading.Event()
+
+    def run( pool ):
+        while True:
+            method, arg = pool.get()
+            if method is STOP_SIGNAL:
+                return
+            arg()
+            pool.done( 0 )
+
+    threads = [ threading.Thread( target=run, args=( pool, ) ) for pool in pools.values() ]
+    for thread in threads:
+        thread.start()
+    # A finishing job that never completes doesn't prevent submissions.
+    work_queue.put( ( runner.finish_job, lambda: finish_blocked.wait( 5 ) ) )
+    work_queue.put( ( runner.queue_job, submitted.set ) )
+    assert submitted.wait( 2 )
+    finish_blocked.set()
+    for pool in pools.values():
+        pool.put( STOP_SIGNAL, None )
+    for thread in threads:
+        thread.join()
+
+
+class DeferringJobRunner( BaseJobRunner ):
+    runner_name = "DeferringRunner"
+
+
+def test_defer():
+    runner = DeferringJobRunner( Bunch( model=Bunch( context=None ) ), 1 )
+    runner._init_worker_threads()
+    finished = threading.Event()
+    deferred_finish = lambda: finished.set()
+    runner.defer( 0.2, runner.finish_deferred, deferred_finish )
+    assert not finished.is_set()
+    assert finished.wait( 2 )
+    runner.shutdown()
+
+
+class MockJobWrapper( object ):
+
+    def __init__( self ):
+        self.finished = []
+
+    def get_id_tag( self ):
+        return "1"
+
+    def reclaim_ownership( self ):
+        pass
+
+    def finish( self, stdout, stderr, exit_code ):
+        self.finished.append( ( stdout, stderr, exit_code ) )
+
+
+class DeferringAsynchronousJobRunner( AsynchronousJobRunner ):
+    runner_name = "DeferringAsynchronousRunner"
+
+    def __init__( self, app ):
+        super( DeferringAsynchronousJobRunner, self ).__init__( app, 1 )
+        self.deferred = []
+
+    def defer( self, delay, method, arg ):
+        self.deferred.append( ( delay, method, arg ) )
+
+
+def _finishing_runner_and_job_state( directory ):
+    app = Bunch( model=Bunch( context=None ), config=Bunch( retry_job_output_collection=2, cleanup_job="never" ) )
+    runner = DeferringAsynchronousJobRunner( app )
+    job_state = Bunch(
+        job_wrapper=MockJobWrapper(),
+        job_id="external1",
+        output_file=os.path.join( directory, "galaxy_1.o" ),
+        error_file=os.path.join( directory, "galaxy_1.e" ),
+        exit_code_file=os.path.join( directory, "galaxy_1.ec" ),
+    )
+    return runner, job_state
+
+
+def test_finish_job_deferred_until_output_files_visible():
+    directory = tempfile.mkdtemp()
+    try:
+        runner, job_state = _finishing_runner_and_job_state( directory )
+        runner.finish_job( job_state )
+        assert not job_state.job_wrapper.finished
+        delay, method, arg = runner.deferred[ -1 ]
+        assert delay == 1
+        assert method == runner.finish_job
+        assert arg is job_state
+
+        open( job_state.output_file, "w" ).write( "out" )
+        open( job_state.error_file, "w" ).write( "" )
+        open( job_state.exit_code_file, "w" ).write( "0" )
+        runner.finish_job( job_state )
+        assert job_state.job_wrapper.finished == [ ( "out", "", 0 ) ]
+        assert len( runner.deferred ) == 1
+    finally:
+        shutil.rmtree( directory )
+
+
+def test_finish_job_gives_up_waiting_for_output_files():
+    directory = tempfile.mkdtemp()
+    try:
+        runner, job_state = _finishing_runner_and_job_state( directory )
+        for i in range( 3 ):
+            runner.finish_job( job_state )
+        assert len( runner.deferred ) == 2
+        assert job_state.job_wrapper.finished == [ ( "", "Job output not returned from cluster", 0 ) ]
+    finally:
+        shutil.rmtree( directory )
@@ -0,0 +1,81 @@
+import imp
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from galaxy import model
+from galaxy.model import mapping
+from galaxy.objectstore import DiskObjectStore
+from galaxy.util.bunch import Bunch
+
+SCRIPT_PATH = os.path.join( os.path.dirname( __file__ ), os.pardir, os.pardir, "scripts", "cleanup_datasets", "cleanup_datasets.py" )
+
+
+def _load_script():
+    # The script adjusts sys.path and the root logger when imported.
+    sys_path = sys.path
+    root_handlers = logging.getLogger().handlers[:]
+    root_level = logging.getLogger().level
+    try:
+        return imp.load_source( "cleanup_datasets", SCRIPT_PATH )
+    finally:
+        sys.path = sys_path
+        logging.getLogger().handlers = root_handlers
+        logging.getLogger().setLevel( root_level )
+
+cleanup_datasets = _load_script()
+
+
+def test_purge_datasets_in_batches_with_checkpoint():
+    file_path = mkdtemp()
+    try:
+        object_store = DiskObjectStore( Bunch( umask=077, job_working_directory=file_path, new_file_path=file_path, object_store_check_old_style=False ), file_path=file_path )
+        app_model = mapping.init( file_path, "sqlite:///:memory:", create_tables=True, object_store=object_store )
+        session = app_model.context
+        app = Bunch( model=app_model, sa_session=session, object_store=object_store )
+        datasets = [ model.Dataset( state="ok" ) for i in range( 5 ) ]
+        for dataset in datasets:
+            dataset.deleted = True
+        session.add_all( datasets )
+        session.flush()
+        paths = {}
+        for dataset in datasets:
+            object_store.create( dataset )
+            paths[ dataset.id ] = object_store.get_filename( dataset )
+        extra_dir = os.path.join( os.path.dirname( paths[ datasets[ -1 ].id ] ), "dataset_%d_files" % datasets[ -1 ].id )
+        os.makedirs( extra_dir )
+
+        # An interrupted run already handled the first two datasets.
+        checkpoint_path = os.path.join( file_path, "checkpoint.json" )
+        json.dump( { "purge_datasets": datasets[ 1 ].id }, open( checkpoint_path, "w" ) )
+        checkpoint = cleanup_datasets.CleanupCheckpoint( checkpoint_path )
+        cutoff_time = datetime.utcnow() + timedelta( days=1 )
+        cleanup_datasets.purge_datasets( app, cutoff_time, True, batch_size=2, workers=2, checkpoint=checkpoint )
+
+        session.expunge_all()
+        purged = [ session.query( model.Dataset ).get( dataset.id ).purged for dataset in datasets ]
+        assert purged == [ False, False, True, True, True ]
+        assert [ os.path.exists( paths[ dataset.id ] ) for dataset in datasets ] == [ True, True, False, False, False ]
+        assert not os.path.exists( extra_dir )
+        # The completed phase is removed from the checkpoint.
+        assert json.load( open( checkpoint_path ) ) == {}
+    finally:
+        rmtree( file_path )
+
+
+def test_checkpoint():
+    directory = mkdtemp()
+    try:
+        path = os.path.join( directory, "checkpoint.json" )
+        checkpoint = cleanup_datasets.CleanupCheckpoint( path )
+        assert checkpoint.last_id( "purge_datasets" ) == 0
+        checkpoint.update( "purge_datasets", 1000 )
+        assert cleanup_datasets.CleanupCheckpoint( path ).last_id( "purge_datasets" ) == 1000
+        checkpoint.finish( "purge_datasets" )
+        assert cleanup_datasets.CleanupCheckpoint( path ).last_id( "purge_datasets" ) == 0
+    finally:
+        rmtree( directory )
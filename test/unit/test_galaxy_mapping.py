@@ -208,6 +208,70 @@ class MappingTests( unittest.TestCase ):
         assert loaded_dataset_collection[ "left" ] == dce1
         assert loaded_dataset_collection[ "right" ] == dce2
 
+    def test_nested_collection_elements( self ):
+        model = self.model
+
+        u = model.User( email="nested@example.com", password="password" )
+        h1 = model.History( name="History 1", user=u )
+        hdas = [ model.HistoryDatasetAssociation( extension="txt", history=h1, create_dataset=True, sa_session=model.session ) for i in range( 4 ) ]
+        c1 = model.DatasetCollection( collection_type="list:paired" )
+        to_persist = [ u, h1, c1 ] + hdas
+        for i, sample in enumerate( [ "sample2", "sample1" ] ):
+            pair = model.DatasetCollection( collection_type="paired" )
+            to_persist.append( pair )
+            to_persist.append( model.DatasetCollectionElement( collection=c1, element=pair, element_index=i, element_identifier=sample ) )
+            for j, direction in enumerate( [ "forward", "reverse" ] ):
+                to_persist.append( model.DatasetCollectionElement( collection=pair, element=hdas[ 2 * i + j ], element_index=j, element_identifier=direction ) )
+        self.persist( *to_persist )
+        # Walked in memory while the collection is not yet loaded from the database.
+        assert c1.dataset_instances == hdas
+        hda_ids = [ hda.id for hda in hdas ]
+        c1_id = c1.id
+        self.expunge()
+
+        loaded_dataset_collection = self.query( model.DatasetCollection ).get( c1_id )
+        assert [ hda.id for hda in loaded_dataset_collection.dataset_instances ] == hda_ids
+        flattened_identifiers = [ identifiers for identifiers, element in loaded_dataset_collection.flattened_elements() ]
+        assert flattened_identifiers == [ ( "sample2", "forward" ), ( "sample2", "reverse" ), ( "sample1", "forward" ), ( "sample1", "reverse" ) ]
+        pairs = loaded_dataset_collection.flattened_elements( 1 )
+        assert [ ( identifiers, element.child_collection.collection_type ) for identifiers, element in pairs ] == [ ( ( "sample2", ), "paired" ), ( ( "sample1", ), "paired" ) ]
+
+    def test_collection_state( self ):
+        model = self.model
+
+        u = model.User( email="state@example.com", password="password" )
+        h1 = model.History( name="History 1", user=u )
+        hdas = [ model.HistoryDatasetAssociation( extension="txt", history=h1, create_dataset=True, sa_session=model.session ) for i in range( 4 ) ]
+        for hda, state in zip( hdas, [ "ok", "ok", "running", "error" ] ):
+            hda.dataset.state = state
+        c1 = model.DatasetCollection( collection_type="list:paired" )
+        to_persist = [ u, h1, c1 ] + hdas + [ hda.dataset for hda in hdas ]
+        for i in range( 2 ):
+            pair = model.DatasetCollection( collection_type="paired" )
+            to_persist.append( pair )
+            to_persist.append( model.DatasetCollectionElement( collection=c1, element=pair, element_index=i, element_identifier="sample%d" % i ) )
+            for j, direction in enumerate( [ "forward", "reverse" ] ):
+                to_persist.append( model.DatasetCollectionElement( collection=pair, element=hdas[ 2 * i + j ], element_index=j, element_identifier=direction ) )
+        hdca = model.HistoryDatasetCollectionAssociation( collection=c1, history=h1, name="HistoryCollectionTest1" )
+        self.persist( *( to_persist + [ hdca ] ) )
+        # An hda's own state (set while setting its metadata) overrides its dataset's.
+        hdas[ 0 ]._state = "failed_metadata"
+        dataset_ids = [ hda.dataset.id for hda in hdas ]
+        hdca_id = hdca.id
+        self.persist( hdas[ 0 ] )
+
+        loaded_hdca = self.query( model.HistoryDatasetCollectionAssociation ).get( hdca_id )
+        assert loaded_hdca.collection.dataset_state_counts == { "failed_metadata": 1, "ok": 1, "running": 1, "error": 1 }
+        assert loaded_hdca.state == "running"
+        as_dict = loaded_hdca.to_dict()
+        assert as_dict[ "state" ] == "running"
+        assert as_dict[ "dataset_count" ] == 4
+
+        running_dataset = self.query( model.Dataset ).get( dataset_ids[ 2 ] )
+        running_dataset.state = "ok"
+        self.persist( running_dataset )
+        assert self.query( model.HistoryDatasetCollectionAssociation ).get( hdca_id ).state == "error"
+
     def test_collections_in_library_folders(self):
         model = self.model
 
@@ -358,6 +422,76 @@ class MappingTests( unittest.TestCase ):
 
         assert contents_iter_names( ids=[ d1.id, d3.id ] ) == [ "1", "3" ]
 
+    def test_hid_reservation( self ):
+        model = self.model
+        u = model.User( email="hids@foo.bar.baz", password="password" )
+        h1 = model.History( name="HidHistory1", user=u )
+        self.persist( u, h1, expunge=False )
+
+        d1 = self.new_hda( h1, name="1" )
+        assert d1.hid == 1
+
+        new_hdas = [ model.HistoryDatasetAssociation( create_dataset=True, sa_session=self.model.session ) for i in range( 3 ) ]
+        h1.add_datasets( self.session(), new_hdas, flush=True )
+        assert [ hda.hid for hda in new_hdas ] == [ 2, 3, 4 ]
+
+        h1.reserve_hids( 2 )
+        c1 = model.HistoryDatasetCollectionAssociation( collection=model.DatasetCollection( collection_type="list" ) )
+        h1.add_dataset_collection( c1 )
+        d5 = self.new_hda( h1, name="5" )
+        assert c1.hid == 5
+        assert d5.hid == 6
+        # Reservation exhausted, hids come from the history again.
+        assert self.new_hda( h1, name="7" ).hid == 7
+
+    def test_history_copy( self ):
+        model = self.model
+        u1 = model.User( email="copy1@foo.bar.baz", password="password" )
+        u2 = model.User( email="copy2@foo.bar.baz", password="password" )
+        h1 = model.History( name="CopyHistory1", user=u1 )
+        self.persist( u1, u2, h1, expunge=False )
+
+        d1 = self.new_hda( h1, name="1", info="info1", extension="txt" )
+        d2 = self.new_hda( h1, name="2", visible=False )
+        d3 = self.new_hda( h1, name="3", deleted=True )
+        for hda in [ d1, d2, d3 ]:
+            hda.dataset.file_size = 10
+            hda.dataset.total_size = 10
+        self.session().flush()
+        h1.add_item_annotation( self.session(), u1, d1, "annotation1" )
+        self.session().flush()
+
+        h2 = h1.copy( target_user=u2 )
+        assert h2.id != h1.id
+        # Copied datasets count towards the new owner's quota.
+        assert u2.total_disk_usage == 20
+        copied = h2.datasets
+        assert [ hda.name for hda in copied ] == [ "1", "2" ]
+        assert [ hda.hid for hda in copied ] == [ d1.hid, d2.hid ]
+        assert [ hda.copied_from_history_dataset_association for hda in copied ] == [ d1, d2 ]
+        assert [ hda.dataset for hda in copied ] == [ d1.dataset, d2.dataset ]
+        assert copied[ 0 ].info == "info1"
+        assert not copied[ 1 ].visible
+        assert h2.get_item_annotation_str( self.session(), u2, copied[ 0 ] ) == "annotation1"
+        assert h2.get_item_annotation_str( self.session(), u2, copied[ 1 ] ) is None
+
+        h3 = h1.copy( all_datasets=True )
+        assert [ hda.name for hda in h3.datasets ] == [ "1", "2", "3" ]
+        assert h3.datasets[ 2 ].deleted
+
+        # A dataset with several HDAs in the source history is only charged
+        # once.
+        h4 = model.History( name="CopyHistory4", user=u1 )
+        self.persist( h4, expunge=False )
+        d4 = self.new_hda( h4, name="4" )
+        d4.dataset.file_size = 15
+        d4.dataset.total_size = 15
+        h4.add_dataset( model.HistoryDatasetAssociation( name="4 copy", dataset=d4.dataset, sa_session=self.model.session ) )
+        self.session().flush()
+        h4.copy( target_user=u2 )
+        assert [ hda.dataset for hda in h4.datasets ] == [ d4.dataset, d4.dataset ]
+        assert u2.total_disk_usage == 35
+
     def new_hda( self, history, **kwds ):
         return history.add_dataset( self.model.HistoryDatasetAssociation( create_dataset=True, sa_session=self.model.session, **kwds ) )
 
@@ -73,6 +73,95 @@ def test_disk_store():
         assert not os.path.exists(to_delete_real_path)
 
 
+
+def test_disk_store_delete_many():
+    with TestConfig(DISK_TEST_CONFIG) as (directory, object_store):
+        dataset_path = directory.write(b"data", "files1/000/dataset_6.dat")
+        extra_file_path = directory.write(b"extra", "files1/000/dataset_6_files/extra.txt")
+        other_dataset_path = directory.write(b"data", "files1/000/dataset_7.dat")
+        datasets = [MockDataset(6), MockDataset(7), MockDataset(8)]
+
+        # Dataset 8 does not exist, it is reported as gone.
+        assert object_store.delete_many(datasets, extra_dirs=["dataset_6_files", "dataset_7_files", None]) == [True, True, True]
+        assert not os.path.exists(dataset_path)
+        assert not os.path.exists(os.path.dirname(extra_file_path))
+        assert not os.path.exists(other_dataset_path)
+
+        # Without extra_dirs only the dataset files are removed.
+        directory.write(b"data", "files1/000/dataset_9.dat")
+        extra_file_path = directory.write(b"extra", "files1/000/dataset_9_files/extra.txt")
+        assert object_store.delete_many([MockDataset(9)]) == [True]
+        assert os.path.exists(extra_file_path)
+
+
+class MockS3Key(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class MockS3Bucket(object):
+
+    def __init__(self, key_names):
+        self.key_names = key_names
+        self.listed_prefixes = []
+        self.deleted_batches = []
+
+    def list(self, prefix=""):
+        self.listed_prefixes.append(prefix)
+        return [MockS3Key(name) for name in self.key_names if name.startswith(prefix)]
+
+    def delete_keys(self, keys, quiet=False):
+        self.deleted_batches.append(sorted(keys))
+        return MockS3DeleteResult([MockS3Error(key) for key in keys if key.endswith("locked.txt")])
+
+
+class MockS3DeleteResult(object):
+
+    def __init__(self, errors):
+        self.errors = errors
+
+
+class MockS3Error(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.message = "Access Denied"
+
+
+def test_s3_store_delete_many():
+    from galaxy.objectstore.s3 import S3ObjectStore
+    temp_directory = mkdtemp()
+    try:
+        # Skip connecting to S3.
+        object_store = S3ObjectStore.__new__(S3ObjectStore)
+        object_store.staging_path = temp_directory
+        object_store.bucket = MockS3Bucket([
+            "000/dataset_1.dat",
+            "000/dataset_1_files/",
+            "000/dataset_1_files/extra.txt",
+            "000/dataset_2.dat",
+            "000/dataset_2_files/locked.txt",
+            "000/dataset_3.dat",
+            "000/dataset_3_files/extra.txt",
+        ])
+        datasets = [MockDataset(1), MockDataset(2), MockDataset(4)]
+        extra_dirs = ["dataset_1_files", "dataset_2_files", "dataset_4_files"]
+        assert object_store.delete_many(datasets, extra_dirs=extra_dirs) == [True, False, True]
+        # Extra files are found with one listing and deleted along with the
+        # datasets in a single request.
+        assert object_store.bucket.listed_prefixes == ["000/"]
+        assert object_store.bucket.deleted_batches == [[
+            "000/dataset_1.dat",
+            "000/dataset_1_files/",
+            "000/dataset_1_files/extra.txt",
+            "000/dataset_2.dat",
+            "000/dataset_2_files/locked.txt",
+            "000/dataset_4.dat",
+        ]]
+    finally:
+        rmtree(temp_directory)
+
 HIERARCHICAL_TEST_CONFIG = """<?xml version="1.0"?>
 <object_store type="hierarchical">
     <backends>
@@ -149,6 +238,19 @@ def test_distributed_store():
         assert backend_1_count > backend_2_count
 
 
+def test_distributed_store_delete_many():
+    with TestConfig(DISTRIBUTED_TEST_CONFIG) as (directory, object_store):
+        paths = [directory.write("data", "files1/000/dataset_1.dat"),
+                 directory.write("data", "files2/000/dataset_2.dat"),
+                 directory.write("extra", "files2/000/dataset_2_files/extra.txt")]
+        datasets = [MockDataset(1), MockDataset(2)]
+        datasets[0].object_store_id = "files1"
+        datasets[1].object_store_id = "files2"
+        assert object_store.delete_many(datasets, extra_dirs=["dataset_1_files", "dataset_2_files"]) == [True, True]
+        for path in paths:
+            assert not os.path.exists(path)
+
+
 class TestConfig(object):
     def __init__(self, config_xml):
         self.temp_directory = mkdtemp()
@@ -0,0 +1,56 @@
+from galaxy.model.orm.engine_factory import build_engine
+from galaxy.model.orm import query_profiling
+
+
+def test_normalize_statement():
+    normalize = query_profiling.normalize_statement
+    assert normalize( "SELECT * FROM job WHERE job.id = %(id_1)s" ) == "SELECT * FROM job WHERE job.id = ?"
+    assert normalize( "SELECT * FROM job WHERE job.id = 4" ) == "SELECT * FROM job WHERE job.id = ?"
+    assert normalize( "SELECT * FROM job WHERE job.state = 'it''s'" ) == "SELECT * FROM job WHERE job.state = ?"
+    # IN lists of any length share a shape
+    assert normalize( "SELECT * FROM job WHERE job.id IN (?, ?, ?)" ) == normalize( "SELECT * FROM job WHERE job.id IN (?)" )
+    # Numbers in identifiers are left alone
+    assert normalize( "SELECT anon_1.id FROM job AS anon_1" ) == "SELECT anon_1.id FROM job AS anon_1"
+
+
+def test_profile_flags_repeated_statements():
+    profiler = query_profiling.QueryProfiler()
+    engine = build_engine( "sqlite:///:memory:", {}, query_profiler=profiler )
+    connection = engine.connect()
+    connection.execute( "CREATE TABLE job ( id INTEGER PRIMARY KEY, state VARCHAR(64) )" )
+    for i in range( 20 ):
+        connection.execute( "INSERT INTO job ( id, state ) VALUES ( %d, 'new' )" % i )
+
+    profile = profiler.start( "test" )
+    assert profiler.current is profile
+    connection.execute( "SELECT id, state FROM job" ).fetchall()
+    for i in range( 20 ):
+        connection.execute( "SELECT state FROM job WHERE id = %d" % i ).fetchall()
+    assert profiler.finish() is profile
+    assert profiler.current is None
+
+    assert profile.query_count == 21
+    assert profile.duration is not None
+    n_plus_one = profile.n_plus_one
+    assert len( n_plus_one ) == 1
+    assert n_plus_one[ 0 ][ "statement" ] == "SELECT state FROM job WHERE id = ?"
+    assert n_plus_one[ 0 ][ "count" ] == 20
+    assert "test_query_profiling.py:test_profile_flags_repeated_statements@" in n_plus_one[ 0 ][ "call_site" ]
+
+    as_dict = profile.to_dict( view="element" )
+    assert as_dict[ "n_plus_one_count" ] == 1
+    assert len( as_dict[ "statements" ] ) == 2
+    assert len( as_dict[ "slowest" ] ) == query_profiling.SLOWEST_STATEMENTS
+    assert dict( profile.headers() )[ "X-Galaxy-SQL-Query-Count" ] == "21"
+
+    assert profiler.get( profile.id ) is profile
+    assert list( profiler.recent ) == [ profile ]
+
+
+def test_unsampled_work_not_recorded():
+    profiler = query_profiling.QueryProfiler( sample_rate=0.0 )
+    engine = build_engine( "sqlite:///:memory:", {}, query_profiler=profiler )
+    assert profiler.start( "test" ) is None
+    engine.execute( "SELECT 1" )
+    assert profiler.finish() is None
+    assert not profiler.recent
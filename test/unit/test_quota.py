@@ -0,0 +1,46 @@
+from galaxy import model
+from galaxy.model import mapping
+from galaxy.quota import QuotaAgent
+
+GB = 1024 * 1024 * 1024
+
+
+def test_quotas():
+    app_model = mapping.init( "/tmp", "sqlite:///:memory:", create_tables=True )
+    session = app_model.context
+    quota_agent = QuotaAgent( app_model )
+
+    u1 = model.User( email="quota1@example.com", password="pass1" )
+    u2 = model.User( email="quota2@example.com", password="pass2" )
+    u3 = model.User( email="quota3@example.com", password="pass3" )
+    group = model.Group( name="quota_group" )
+    session.add_all( [ u1, u2, u3, group, model.UserGroupAssociation( u2, group ) ] )
+    session.flush()
+
+    # No quotas at all.
+    assert quota_agent.get_quota( u1 ) is None
+    assert quota_agent.get_quota( None ) is None
+
+    default_quota = model.Quota( name="default", description="default", amount=10 * GB, operation="=" )
+    session.add( default_quota )
+    quota_agent.set_default_quota( model.DefaultQuotaAssociation.types.REGISTERED, default_quota )
+    assert quota_agent.get_quota( u1 ) == 10 * GB
+    assert quota_agent.get_quota( u1, nice_size=True ) == "10.0 GB"
+    assert quota_agent.get_quota( None ) is None
+
+    more_quota = model.Quota( name="more", description="more", amount=5 * GB, operation="+" )
+    unlimited_quota = model.Quota( name="unlimited", description="unlimited", amount=None, operation="=" )
+    session.add_all( [ more_quota, unlimited_quota ] )
+    quota_agent.set_entity_quota_associations( quotas=[ more_quota ], users=[ u1 ], groups=[ group ] )
+    quota_agent.set_entity_quota_associations( quotas=[ unlimited_quota ], users=[ u3 ] )
+
+    assert quota_agent.get_quotas( [ u1, u2, u3 ] ) == { u1.id: 15 * GB, u2.id: 15 * GB, u3.id: None }
+    assert quota_agent.get_quotas( [ u3 ], nice_size=True ) == { u3.id: "unlimited" }
+
+    # Changes not made through the quota agent are picked up once it is
+    # invalidated (or after QUOTA_CHANGES_CHECK_INTERVAL seconds).
+    more_quota.deleted = True
+    session.flush()
+    assert quota_agent.get_quota( u2 ) == 15 * GB
+    quota_agent.invalidate()
+    assert quota_agent.get_quota( u2 ) == 10 * GB
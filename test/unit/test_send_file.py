@@ -0,0 +1,111 @@
+""" Tests for serving files (and parts of files) from the web framework.
+"""
+import os
+import tempfile
+
+from galaxy.util.bunch import Bunch
+from galaxy.web.framework import base
+
+CONTENTS = "".join( [ chr( ord( 'a' ) + ( i % 26 ) ) for i in range( 1000 ) ] )
+test_path = None
+
+
+def test_whole_file():
+    response, body = __serve()
+    assert response.status == "200 OK"
+    assert body == CONTENTS
+    assert response.headers[ "content-length" ] == "1000"
+    assert response.headers[ "accept-ranges" ] == "bytes"
+
+
+def test_single_range():
+    response, body = __serve( HTTP_RANGE="bytes=10-19" )
+    assert response.status == "206 Partial Content"
+    assert body == CONTENTS[ 10:20 ]
+    assert response.headers[ "content-range" ] == "bytes 10-19/1000"
+    assert response.headers[ "content-length" ] == "10"
+
+
+def test_open_and_suffix_ranges():
+    response, body = __serve( HTTP_RANGE="bytes=990-" )
+    assert body == CONTENTS[ 990: ]
+    response, body = __serve( HTTP_RANGE="bytes=-5" )
+    assert body == CONTENTS[ -5: ]
+    assert response.headers[ "content-range" ] == "bytes 995-999/1000"
+
+
+def test_multiple_ranges():
+    response, body = __serve( HTTP_RANGE="bytes=0-4,100-104" )
+    assert response.status == "206 Partial Content"
+    content_type = response.get_content_type()
+    assert content_type.startswith( "multipart/byteranges; boundary=" )
+    assert int( response.headers[ "content-length" ] ) == len( body )
+    assert "Content-Range: bytes 0-4/1000\r\n\r\n%s" % CONTENTS[ 0:5 ] in body
+    assert "Content-Range: bytes 100-104/1000\r\n\r\n%s" % CONTENTS[ 100:105 ] in body
+
+
+def test_unsatisfiable_range():
+    response, body = __serve( HTTP_RANGE="bytes=2000-3000" )
+    assert response.status.startswith( "416" )
+    assert response.headers[ "content-range" ] == "bytes */1000"
+    assert body == ""
+
+
+def test_invalid_range_ignored():
+    response, body = __serve( HTTP_RANGE="bytes=20-10" )
+    assert response.status == "200 OK"
+    assert body == CONTENTS
+
+
+def test_if_range():
+    response, _ = __serve()
+    etag = response.headers[ "etag" ]
+    response, body = __serve( HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag )
+    assert body == CONTENTS[ 0:10 ]
+    # File changed - send all of it.
+    response, body = __serve( HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"other"' )
+    assert response.status == "200 OK"
+    assert body == CONTENTS
+
+
+def test_conditional_get():
+    response, _ = __serve()
+    etag = response.headers[ "etag" ]
+    last_modified = response.headers[ "last-modified" ]
+    response, body = __serve( HTTP_IF_NONE_MATCH=etag )
+    assert response.status == "304 Not Modified"
+    assert body == ""
+    response, body = __serve( HTTP_IF_MODIFIED_SINCE=last_modified )
+    assert response.status == "304 Not Modified"
+    response, body = __serve( HTTP_IF_NONE_MATCH='"other"' )
+    assert response.status == "200 OK"
+    assert body == CONTENTS
+
+
+def test_parse_byte_ranges():
+    assert base.parse_byte_ranges( None, 100 ) is None
+    assert base.parse_byte_ranges( "items=0-1", 100 ) is None
+    assert base.parse_byte_ranges( "bytes=0-1,5-", 100 ) == [ ( 0, 1 ), ( 5, 99 ) ]
+    assert base.parse_byte_ranges( "bytes=50-200", 100 ) == [ ( 50, 99 ) ]
+    assert base.parse_byte_ranges( "bytes=-200", 100 ) == [ ( 0, 99 ) ]
+    assert base.parse_byte_ranges( "bytes=100-", 100 ) == []
+    assert base.parse_byte_ranges( "bytes=a-b", 100 ) is None
+
+
+def setup_module():
+    global test_path
+    fd, test_path = tempfile.mkstemp()
+    os.write( fd, CONTENTS )
+    os.close( fd )
+
+
+def teardown_module():
+    os.remove( test_path )
+
+
+def __serve( **environ ):
+    environ.setdefault( "REQUEST_METHOD", "GET" )
+    response = base.Response()
+    trans = Bunch( environ=environ, response=response )
+    body = "".join( base.serve_file( trans, open( test_path, "rb" ) ) )
+    return response, body
@@ -0,0 +1,81 @@
+""" Tests for writing archives as streams.
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+from StringIO import StringIO
+
+from galaxy.util import streamball
+
+test_directory = None
+
+
+def setup_module():
+    global test_directory
+    test_directory = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree( test_directory )
+
+
+def test_zip_stream():
+    text_path = __write( "text.txt", "Hello World!\n" * 10000 )
+    empty_path = __write( "empty.txt", "" )
+    archive = streamball.ZipStreamBall()
+    archive.add( text_path, "dir1/text.txt" )
+    archive.add( empty_path, u"dir2/\xe9mpty.txt" )
+
+    zip_file = __write_zip( archive )
+    assert zip_file.testzip() is None
+    assert zip_file.namelist() == [ "dir1/text.txt", u"dir2/\xe9mpty.txt" ]
+    assert zip_file.read( "dir1/text.txt" ) == "Hello World!\n" * 10000
+    assert zip_file.read( u"dir2/\xe9mpty.txt" ) == ""
+    text_info = zip_file.getinfo( "dir1/text.txt" )
+    assert text_info.compress_type == zipfile.ZIP_DEFLATED
+    assert text_info.compress_size < text_info.file_size
+
+
+def test_zip_stream_stores_compressed_members():
+    gzip_path = __write( "compressed.gz", "\x1f\x8b" + "moo" * 100 )
+    archive = streamball.ZipStreamBall()
+    archive.add( gzip_path, "compressed.gz" )
+
+    zip_file = __write_zip( archive )
+    info = zip_file.getinfo( "compressed.gz" )
+    assert info.compress_type == zipfile.ZIP_STORED
+    assert zip_file.read( "compressed.gz" ) == "\x1f\x8b" + "moo" * 100
+
+
+def test_zip_stream_store_only():
+    text_path = __write( "text.txt", "Hello World!\n" * 100 )
+    archive = streamball.ZipStreamBall( compression=zipfile.ZIP_STORED )
+    archive.add( text_path, "text.txt" )
+
+    zip_file = __write_zip( archive )
+    assert zip_file.getinfo( "text.txt" ).compress_type == zipfile.ZIP_STORED
+    assert zip_file.read( "text.txt" ) == "Hello World!\n" * 100
+
+
+def test_zip_stream_check_file():
+    archive = streamball.ZipStreamBall()
+    try:
+        archive.add( os.path.join( test_directory, "missing" ), "missing", check_file=True )
+    except streamball.ObjectNotFound:
+        pass
+    else:
+        raise AssertionError( "Missing file added to archive." )
+
+
+def __write_zip( archive ):
+    output = StringIO()
+    archive.write_archive( output.write )
+    output.seek( 0 )
+    return zipfile.ZipFile( output )
+
+
+def __write( name, contents ):
+    path = os.path.join( test_directory, name )
+    open( path, "wb" ).write( contents )
+    return path
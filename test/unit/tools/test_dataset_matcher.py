@@ -126,6 +126,23 @@ class DatasetMatcherTestCase( TestCase, tools_support.UsesApp ):
         hda_match = self.test_context.hda_match( self.mock_hda )
         assert hda_match
 
+    def test_history_dataset_index_candidates( self ):
+        hda1 = MockHistoryDatasetAssociation( id=1 )
+        hda2 = MockHistoryDatasetAssociation( id=2 )
+        hda3 = MockHistoryDatasetAssociation( id=3 )
+        hda4 = MockHistoryDatasetAssociation( id=4 )
+        # hda1 and hda3 share a datatype, only the first dataset of each
+        # datatype is consulted.
+        hda3.datatype = hda1.datatype
+        hda3.datatype_matches = False
+        hda2.datatype_matches = False
+        hda4.datatype_matches = False
+        hda4.conversion_destination = ( "tabular", None )
+
+        index = dataset_matcher.HistoryDatasetIndex( [ hda1, hda2, hda3, hda4 ] )
+        candidates = index.candidates( self.test_context )
+        assert candidates == [ hda1, hda3, hda4 ]
+
     def setUp( self ):
         self.setup_app()
         self.mock_hda = MockHistoryDatasetAssociation()
@@ -1,6 +1,7 @@
 """ Test Tool execution and state handling logic.
 """
 
+import binascii
 from unittest import TestCase
 
 import galaxy.model
@@ -9,6 +10,7 @@ from galaxy.tools.parameters import params_to_incoming
 from galaxy.util.bunch import Bunch
 from galaxy.util import string_to_object
 from galaxy.util import object_to_string
+from galaxy.util.hash_util import hmac_new
 from galaxy.util.odict import odict
 import tools_support
 
@@ -152,6 +154,40 @@ class ToolExecutionTestCase( TestCase, tools_support.UsesApp, tools_support.Uses
         state = self.__assert_rerenders_tool_without_errors( template, template_vars )
         assert len( state.inputs[ "repeat1" ] ) == 1
 
+    def test_large_repeat_state_encoding( self ):
+        self._init_tool( REPEAT_TOOL_CONTENTS )
+        repeat_values = [ dict( __index__=i, param2="value %d" % i ) for i in range( 500 ) ]
+        state = self.__inputs_to_state( dict( param1="moo", repeat1=repeat_values ) )
+        state.page = 0
+        encoded_state = state.encode( self.tool, self.app )
+
+        # Compressed state is much smaller than the hex encoded JSON.
+        legacy_encoded_state = self.__legacy_encode( state )
+        assert len( encoded_state ) * 5 < len( legacy_encoded_state )
+
+        for state_string in [ encoded_state, legacy_encoded_state ]:
+            decoded_state = DefaultToolState()
+            decoded_state.decode( state_string, self.tool, self.app )
+            assert decoded_state.inputs[ "param1" ] == "moo"
+            assert len( decoded_state.inputs[ "repeat1" ] ) == 500
+            assert decoded_state.inputs[ "repeat1" ][ 499 ][ "param2" ] == "value 499"
+
+    def test_tampered_state_rejected( self ):
+        self._init_tool( tools_support.SIMPLE_TOOL_CONTENTS )
+        state = self.__inputs_to_state( dict( param1="moo" ) )
+        state.page = 0
+        encoded_state = state.encode( self.tool, self.app )
+        other_state = self.__inputs_to_state( dict( param1="cow" ) )
+        other_state.page = 0
+        other_encoded_state = other_state.encode( self.tool, self.app )
+        tampered_state = "%s:%s" % ( encoded_state.split( ":" )[ 0 ], other_encoded_state.split( ":" )[ 1 ] )
+        try:
+            DefaultToolState().decode( tampered_state, self.tool, self.app )
+        except AssertionError:
+            pass
+        else:
+            raise AssertionError( "Tampered tool state was decoded." )
+
     def test_data_param_execute( self ):
         self._init_tool( tools_support.SIMPLE_CAT_TOOL_CONTENTS )
         hda = self.__add_dataset(1)
@@ -432,6 +468,11 @@ class ToolExecutionTestCase( TestCase, tools_support.UsesApp, tools_support.Uses
     def __state_to_string( self, tool_state ):
         return object_to_string( tool_state.encode( self.tool, self.app ) )
 
+    def __legacy_encode( self, tool_state ):
+        # Tool states were hex encoded JSON prior to being compressed.
+        value = tool_state.encode( self.tool, self.app, secure=False )
+        return "%s:%s" % ( hmac_new( self.app.config.tool_secret, value ), binascii.hexlify( value ) )
+
     def __inputs_to_state_string( self, inputs ):
         tool_state = self.__inputs_to_state( inputs )
         return self.__state_to_string( tool_state )
@@ -3,6 +3,9 @@ from .workflow_support import MockTrans
 from galaxy import model
 from galaxy.workflow.run_request import normalize_step_parameters
 from galaxy.workflow.run_request import normalize_inputs
+from galaxy.workflow.run_request import WorkflowRunConfig
+from galaxy.workflow.run_request import workflow_run_config_to_request
+from galaxy.workflow.run_request import workflow_request_to_run_config
 
 STEP_ID_OFFSET = 4  # Offset a little so ids and order index are different.
 
@@ -72,6 +75,32 @@ def test_inputs_by_name():
     assert normalized_inputs[ STEP_ID_OFFSET + 2 ] == input2[ 'content' ]
 
 
+def test_run_config_to_request_round_trip():
+    trans = MockTrans()
+    workflow = __workflow_fixure( trans )
+    history = model.History()
+    tool_step_id = workflow.steps[ 2 ].id
+    run_config = WorkflowRunConfig(
+        target_history=history,
+        replacement_dict={ "sample": "A" },
+        copy_inputs_to_history=True,
+        param_map={ tool_step_id: { "foo": "bar" } },
+    )
+    workflow_invocation = workflow_run_config_to_request( trans, run_config, workflow )
+    trans.app.model.context.add( workflow_invocation )
+    trans.app.model.context.flush()
+    invocation_id = workflow_invocation.id
+    trans.app.model.context.expunge_all()
+
+    workflow_invocation = trans.app.model.context.query( model.WorkflowInvocation ).get( invocation_id )
+    assert workflow_invocation.state == model.WorkflowInvocation.states.NEW
+    recovered_config = workflow_request_to_run_config( trans, workflow_invocation )
+    assert recovered_config.replacement_dict == { "sample": "A" }
+    assert recovered_config.copy_inputs_to_history
+    assert recovered_config.param_map == { tool_step_id: { "foo": "bar" } }
+    assert recovered_config.target_history.id == workflow_invocation.history_id
+
+
 def __normalize_parameters_against_fixture( params ):
     trans = MockTrans()
     # Create a throw away workflow so step ids and order_index